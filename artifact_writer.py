@@ -0,0 +1,119 @@
+import json
+import logging as log
+import os
+import queue
+import threading
+
+ARTIFACTS_OFF = "off"
+ARTIFACTS_JSONL = "jsonl"
+DEBUG_ARTIFACTS = ARTIFACTS_JSONL
+
+_CLOSE = object()
+
+
+def _artifact_chunk(content):
+    return content if isinstance(content, str) else json.dumps(content) + "\n"
+
+
+class NullArtifactWriter:
+    """Discards debug artifacts, for production runs that only need the output rows."""
+
+    is_enabled = False
+
+    def append(self, path, content):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ArtifactCollector(NullArtifactWriter):
+    """
+    Collects debug artifacts in memory as the text an ArtifactWriter would append to each file, so worker processes
+    can hand them back to the writer of the main process as one string per file.
+    """
+
+    is_enabled = True
+
+    def __init__(self):
+        self._chunks_by_path = {}
+
+    def append(self, path, content):
+        self._chunks_by_path.setdefault(path, []).append(_artifact_chunk(content))
+
+    def text_by_path(self) -> dict[str, str]:
+        return {path: "".join(chunks) for path, chunks in self._chunks_by_path.items()}
+
+
+class ArtifactWriter(NullArtifactWriter):
+    """
+    Writes debug artifacts, such as the parsed questions and answers of each chapter, on a background thread.
+    Appends are queued without ever blocking the caller, and the thread writes everything queued for the same file
+    with a single write. Each file is truncated the first time it is written to during the run.
+    """
+
+    is_enabled = True
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._files = {}
+        self._thread = threading.Thread(target=self._run, name="artifact-writer", daemon=True)
+        self._thread.start()
+
+    def append(self, path, content):
+        """Queue `content` to be appended to the file at `path`: a string as is, anything else as a JSON line."""
+        self._queue.put((path, content))
+
+    def _file(self, path):
+        if path not in self._files:
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._files[path] = open(path, 'w')
+        return self._files[path]
+
+    def _write_batch(self, batch):
+        chunks_by_path = {}
+        for path, content in batch:
+            chunks_by_path.setdefault(path, []).append(_artifact_chunk(content))
+        for path, chunks in chunks_by_path.items():
+            self._file(path).write("".join(chunks))
+
+    def _run(self):
+        is_closing = False
+        while not is_closing:
+            batch = [self._queue.get()]
+            # Take everything else that was queued meanwhile, to write it in as few calls as possible
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _CLOSE in batch:
+                is_closing = True
+                batch = [item for item in batch if item is not _CLOSE]
+            try:
+                self._write_batch(batch)
+            except OSError as e:
+                log.warning(f"Failed to write debug artifacts: {e}")
+        for file in self._files.values():
+            file.close()
+
+    def close(self):
+        """Wait for everything queued so far to be written."""
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+
+def open_artifact_writer(mode=DEBUG_ARTIFACTS) -> NullArtifactWriter:
+    if mode == ARTIFACTS_OFF:
+        return NullArtifactWriter()
+    if mode == ARTIFACTS_JSONL:
+        return ArtifactWriter()
+    raise ValueError(f"Unknown debug artifacts mode: {mode}")
@@ -0,0 +1,333 @@
+"""
+Generate flashcards for a whole catalogue of books in one run. Pages of every book are extracted on a single pool of
+workers, so the pool stays busy from the first book to the last instead of draining between books, and each book is
+parsed and saved as soon as its last page is extracted. A book that fails is reported and skipped without stopping
+the others.
+
+Books are parsed on a thread of their own, so workers keep extracting the pages of the next books in the meantime.
+
+The manifest is a JSON list of books, for example:
+
+    [
+        {"pdf": "anatomy.pdf", "output": "anatomy.csv"},
+        {"pdf": "physiology.pdf", "output": "physiology.jsonl", "layout": "auto", "incremental": true},
+        {"pdf": "pathology.pdf", "output": "pathology.csv", "skip_non_question_pages": true},
+        {
+            "pdf": "histology.pdf",
+            "output": "histology.tsv",
+            "format": "anki",
+            "layout": {
+                "left_col_bbox": [40, 0, 290, 770], "right_col_bbox": [290, 0, 560, 770], "first_content_page": 12
+            }
+        }
+    ]
+
+"layout" is "default" (the default), "auto" to detect it, or an explicit layout.
+"""
+import argparse
+import json
+import logging as log
+import sys
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterator
+
+import logging_setup
+from artifact_writer import NullArtifactWriter
+from checkpoint_store import CheckpointStore, open_checkpoint_store
+from exporters import open_exporter
+from metrics import RUN_METRICS, RUN_REPORT_PATH
+from model import ExtractionPlan, LayoutProfile, MemoryBudget
+from page_scheduler import PageScheduler, ReorderBuffer, SchedulerStats
+from pdf_processing import (
+    create_worker_pool,
+    DEFAULT_LAYOUT,
+    extract_columns_from_page_range,
+    extraction_task_kwargs,
+    log_pool_sizing,
+    plan_extraction,
+    pop_extracted_pages,
+    push_batch_result,
+    size_worker_pool
+)
+from profiling import PARENT_PROFILE, PROFILE_DIR, PROFILE_MODES, RUN_PROFILER
+from text_processing import process_questions_and_answers, stream_questions_and_answers
+
+DEFAULT_LAYOUT_SETTING = "default"
+AUTO_LAYOUT_SETTING = "auto"
+
+
+def parse_layout_setting(layout_setting) -> LayoutProfile | None:
+    """Layout of a "layout" setting: "default", "auto" to detect it, given as None, or an explicit layout."""
+    if layout_setting == DEFAULT_LAYOUT_SETTING:
+        return DEFAULT_LAYOUT
+    if layout_setting == AUTO_LAYOUT_SETTING:
+        return None
+    return LayoutProfile.from_dict(layout_setting)
+
+
+@dataclass
+class BookJob:
+    pdf_path: str
+    output_path: str
+    # None to detect the layout, like --layout auto
+    layout: LayoutProfile | None
+    output_format: str | None = None
+    incremental: bool = False
+    skip_non_question_pages: bool = False
+
+    @staticmethod
+    def from_dict(data):
+        return BookJob(
+            pdf_path=data['pdf'],
+            output_path=data['output'],
+            output_format=data.get('format'),
+            layout=parse_layout_setting(data.get('layout', DEFAULT_LAYOUT_SETTING)),
+            incremental=data.get('incremental', False),
+            skip_non_question_pages=data.get('skip_non_question_pages', False)
+        )
+
+
+def load_batch_manifest(manifest_path) -> list[BookJob]:
+    with open(manifest_path) as f:
+        return [BookJob.from_dict(book) for book in json.load(f)]
+
+
+class BookRun:
+    """Progress of one book of the batch, from planning its extraction to saving its rows."""
+
+    def __init__(self, job: BookJob):
+        self.job = job
+        self.plan: ExtractionPlan | None = None
+        self.buffer: ReorderBuffer | None = None
+        self.batches_completed = 0
+        self.rows_saved = 0
+        self.error: BaseException | None = None
+        self.started_at = None
+        self.parse_started_at = None
+        self.finished_at = None
+
+    @property
+    def name(self):
+        return self.job.pdf_path
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    def fail(self, error: BaseException):
+        log.error(f"{self.name}: failed, skipping the rest of the book: {error!r}")
+        self.error = error
+        self.finished_at = time.time()
+        # Whatever was extracted is in the checkpoint store already, the next run picks up from there
+        self.buffer = None
+
+
+def _finish_book(run: BookRun, checkpoint_store: CheckpointStore, memory_budget: MemoryBudget = None):
+    """
+    Parse the questions and answers of a fully extracted book and save them to its output. With a memory budget,
+    chapters are parsed and saved as their pages are loaded, so the whole book is never held in memory.
+    """
+    run.parse_started_at = time.time()
+    try:
+        # Pages are handed over one at a time, so spooled pages are only loaded from the store as they are parsed
+        page_datas = pop_extracted_pages(run.buffer, run.plan, checkpoint_store)
+        with open_exporter(run.job.output_path, run.job.output_format) as exporter:
+            if memory_budget is not None:
+                # Debug artifacts have fixed paths, every book would overwrite those of the others
+                for chapter_rows in stream_questions_and_answers(page_datas, artifact_writer=NullArtifactWriter()):
+                    exporter.write_rows(chapter_rows)
+                    run.rows_saved += len(chapter_rows)
+            else:
+                output_rows = process_questions_and_answers(
+                    page_datas,
+                    artifact_writer=NullArtifactWriter(),
+                    checkpoint_store=checkpoint_store,
+                    incremental_key=run.job.pdf_path if run.job.incremental else None
+                )
+                exporter.write_rows(output_rows)
+                run.rows_saved = len(output_rows)
+        assert run.buffer.is_done(), f"Page {run.buffer.next_page_number} was never extracted"
+    except Exception as e:
+        run.fail(e)
+        return
+    run.buffer = None
+    run.finished_at = time.time()
+    log.info(f"{run.name}: saved {run.rows_saved} rows at {run.job.output_path}")
+
+
+def _iter_extraction_tasks(
+        runs: list[BookRun],
+        checkpoint_store: CheckpointStore,
+        parser: Executor,
+        memory_budget: MemoryBudget = None
+) -> Iterator[tuple]:
+    """
+    (book run, batch, task kwargs) for every batch of every book, in book order. Each book is planned only once the
+    scheduler asks for its first batch, so planning overlaps with the extraction of the previous book. Books with
+    nothing left to extract are handed to the parser right away, and the batches of a book that failed are dropped.
+    """
+    for run in runs:
+        run.started_at = time.time()
+        if memory_budget is not None and run.job.incremental:
+            # Incremental parsing compares the text of every chapter of the book, which has to be in memory at once
+            run.fail(ValueError("incremental books cannot be parsed with a memory budget, run them without one"))
+            continue
+        try:
+            run.plan = plan_extraction(
+                run.job.pdf_path, checkpoint_store, run.job.layout, run.job.skip_non_question_pages
+            )
+            run.buffer = ReorderBuffer(run.plan.page_nums)
+        except Exception as e:
+            run.fail(e)
+            continue
+        log.info(f"{run.name}: {len(run.plan.batches)} batches of pages to extract")
+        if not run.plan.batches:
+            parser.submit(_finish_book, run, checkpoint_store, memory_budget)
+            continue
+        task_kwargs = extraction_task_kwargs(run.plan, checkpoint_store, memory_budget)
+        for batch in run.plan.batches:
+            if run.failed:
+                break
+            yield run, batch, task_kwargs
+
+
+def run_batch(
+        jobs: list[BookJob],
+        max_workers: int = None,
+        checkpoint_store: CheckpointStore = None,
+        memory_budget: MemoryBudget = None
+) -> list[BookRun]:
+    """
+    Extract, parse and save every book, sharing one pool of workers between all of them, which is sized from the CPUs
+    and memory available without `max_workers`. With a memory budget, pages wait in the checkpoint store rather than
+    in memory until their book is parsed, chapter by chapter, and incremental books fail. Books are parsed one at a
+    time on a parser thread, while the workers go on extracting the next books.
+    """
+    checkpoint_store = checkpoint_store or open_checkpoint_store()
+    runs = [BookRun(job) for job in jobs]
+
+    sizing = size_worker_pool(max_workers, memory_budget)
+    log_pool_sizing(sizing)
+    # Parsing a book on the scheduler's thread would leave the workers without new batches until it is saved
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="parser") as parser:
+        with create_worker_pool(sizing.workers, memory_budget) as executor:
+            scheduler = PageScheduler(executor, sizing.workers, worker_rss_limit_mb=sizing.worker_rss_limit_mb)
+            log.info(f"Processing {len(runs)} books on {sizing.workers} workers...")
+            for run, future in scheduler.run_tasks(
+                    _iter_extraction_tasks(runs, checkpoint_store, parser, memory_budget),
+                    RUN_PROFILER.wrap_task(extract_columns_from_page_range)
+            ):
+                if run.failed:
+                    continue
+                try:
+                    result = future.result()
+                except Exception as e:
+                    run.fail(e)
+                    continue
+                run.batches_completed += 1
+                push_batch_result(run.buffer, run.plan, result)
+                log.info(f"{run.name}: {run.batches_completed} out of {len(run.plan.batches)} batches have completed.")
+                if run.batches_completed == len(run.plan.batches):
+                    # The scheduler is done with the book, only the parser touches it from now on
+                    parser.submit(_finish_book, run, checkpoint_store, memory_budget)
+            scheduler.stats.log_summary()
+            RUN_METRICS.record_scheduler(scheduler.stats)
+
+    RUN_METRICS.record_books([_book_timings(run, scheduler.stats) for run in runs])
+    return runs
+
+
+def _book_timings(run: BookRun, scheduler_stats: SchedulerStats) -> dict:
+    parse_idle_ratio = (
+        scheduler_stats.idle_ratio_between(run.parse_started_at, run.finished_at)
+        if run.parse_started_at is not None and run.finished_at is not None
+        else None
+    )
+    return {
+        "pdf": run.name,
+        "failed": run.failed,
+        "rows": run.rows_saved,
+        "started_at": run.started_at,
+        "parse_started_at": run.parse_started_at,
+        "finished_at": run.finished_at,
+        # Workers should stay busy with the next books while this one is parsed, None when none were left
+        "worker_idle_ratio_while_parsing": parse_idle_ratio
+    }
+
+
+def log_batch_summary(runs: list[BookRun]):
+    for run in runs:
+        seconds = (run.finished_at or time.time()) - (run.started_at or time.time())
+        if run.failed:
+            log.error(f"{run.name}: FAILED after {seconds:.1f}s: {run.error!r}")
+        else:
+            log.info(f"{run.name}: {run.rows_saved} rows saved at {run.job.output_path}, done after {seconds:.1f}s")
+    failed_count = sum(run.failed for run in runs)
+    log.info(f"{len(runs) - failed_count} out of {len(runs)} books succeeded.")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate flashcards for every book of a manifest in one run.")
+    parser.add_argument("manifest", help="JSON list of books, each with its PDF, output and optional layout.")
+    parser.add_argument(
+        "--workers",
+        "--max-parallelism",
+        type=int,
+        help="Processes extracting pages, shared by all books. By default, one per available CPU as long as their "
+             "memory fits."
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Also log every page, instead of one line per batch of pages."
+    )
+    parser.add_argument(
+        "--run-report",
+        default=RUN_REPORT_PATH,
+        help="Where to save the JSON report of stage timings, throughput, worker idle time and checkpoint hit rate."
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILE_MODES,
+        help="Profile the workers and this process with cProfile, or sample their stacks at a low overhead, and merge "
+             "the profiles into one report along with the slowest pages."
+    )
+    parser.add_argument("--profile-dir", default=PROFILE_DIR, help="Where to save the profiles and their report.")
+    parser.add_argument(
+        "--bounded-memory",
+        action="store_true",
+        help="Keep memory flat on very large books: recycle workers, keep pages on disk until they are parsed and "
+             "parse them chapter by chapter. Incremental books fail, they need the whole book in memory."
+    )
+    parser.add_argument(
+        "--max-worker-rss-mb",
+        type=float,
+        default=MemoryBudget.max_worker_rss_mb,
+        help="With --bounded-memory, workers above this RSS reopen the PDF before their next page."
+    )
+    parser.add_argument(
+        "--pages-per-worker",
+        type=int,
+        default=MemoryBudget.pages_per_worker,
+        help="With --bounded-memory, each worker is replaced by a fresh process after about this many pages."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging_setup.setup_logging(level=log.DEBUG if args.verbose else log.INFO)
+
+    memory_budget = (
+        MemoryBudget(pages_per_worker=args.pages_per_worker, max_worker_rss_mb=args.max_worker_rss_mb)
+        if args.bounded_memory
+        else None
+    )
+    if args.profile:
+        RUN_PROFILER.enable(args.profile, args.profile_dir)
+    with RUN_PROFILER.profile(PARENT_PROFILE):
+        book_runs = run_batch(load_batch_manifest(args.manifest), args.workers, memory_budget=memory_budget)
+    log_batch_summary(book_runs)
+    RUN_METRICS.write_report(args.run_report)
+    RUN_PROFILER.write_report(RUN_METRICS)
+    sys.exit(1 if any(run.failed for run in book_runs) else 0)
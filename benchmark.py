@@ -0,0 +1,722 @@
+"""
+Benchmarks for the hot paths of the pipeline, each checking that the optimized code produces the same output as the
+reference implementation it replaces. Run `python benchmark.py --help` for the available benchmarks.
+"""
+import argparse
+import hashlib
+import json
+import logging as log
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import logging_setup
+from model import Answer, BookData, Question
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# A run that only loads checkpoints should finish well within this
+STARTUP_BUDGET_SECONDS = 1.0
+# Roughly what a page of the two-column textbook extracts to
+LINES_PER_PAGE = 90
+# Digest of the rows of every synthetic book of the suite, recorded once with --update-golden
+GOLDEN_PATH = os.path.join(REPO_DIR, "benchmark_golden.json")
+MIN_SUITE_PAGES = 10
+MAX_SUITE_PAGES = 5_000
+
+
+def _best_time(fn, repeat):
+    """Best wall time of `repeat` calls of fn, which is the least noisy estimate for short benchmarks."""
+    best = float("inf")
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started_at)
+    return best
+
+
+def _parse_page_range(page_range: str) -> range:
+    first, _, last = page_range.partition("-")
+    return range(int(first), int(last or first) + 1)
+
+
+def benchmark_column_extraction(pdf_path, page_nums, repeat) -> bool:
+    """Compare the single-pass char splitter with two within_bbox extractions per page on real pages."""
+    from column_extraction import extract_columns_from_chars, extract_columns_with_bboxes
+    from pdf_processing import LEFT_COL_BBOX, open_pdf, RIGHT_COL_BBOX
+
+    matches = True
+    reference_seconds = chars_seconds = 0.0
+    with open_pdf(pdf_path) as pdf:
+        for page_num in page_nums:
+            page = pdf.pages[page_num]
+            page.chars  # Parse the page's layout once, both engines share it
+
+            reference = extract_columns_with_bboxes(page, LEFT_COL_BBOX, RIGHT_COL_BBOX)
+            if extract_columns_from_chars(page, LEFT_COL_BBOX, RIGHT_COL_BBOX) != reference:
+                log.error(f"Page {page_num}: char splitter output differs from within_bbox output")
+                matches = False
+
+            reference_seconds += _best_time(
+                lambda: extract_columns_with_bboxes(page, LEFT_COL_BBOX, RIGHT_COL_BBOX), repeat
+            )
+            chars_seconds += _best_time(
+                lambda: extract_columns_from_chars(page, LEFT_COL_BBOX, RIGHT_COL_BBOX), repeat
+            )
+
+    log.info(
+        f"Column extraction over {len(page_nums)} pages: within_bbox {reference_seconds / len(page_nums) * 1000:.2f} ms"
+        f"/page, char splitter {chars_seconds / len(page_nums) * 1000:.2f} ms/page, "
+        f"speedup {reference_seconds / chars_seconds:.2f}x"
+    )
+    return matches
+
+
+# ASCII stand-ins and the typography many PDFs use instead, for pages whose text happens to be pure ASCII
+TYPOGRAPHY_BY_ASCII = {"'": "\u2019", '"': "\u201d", "-": "\u2010", "fi": "\ufb01", "...": "\u2026", ". ": ".\u00a0"}
+
+
+def benchmark_sanitization(pdf_path, page_nums, repeat) -> bool:
+    """Compare sanitize_text with unidecode on the columns of real pages, as extracted and with typography added."""
+    from unidecode import unidecode
+
+    from column_extraction import extract_columns_from_chars
+    from pdf_processing import LEFT_COL_BBOX, open_pdf, RIGHT_COL_BBOX
+    from text_processing import sanitize_text, TRANSLITERATION_TABLE
+
+    matches = True
+    for code_point, replacement in list(TRANSLITERATION_TABLE.items()):
+        if unidecode(chr(code_point)) != replacement:
+            log.error(f"Transliteration of {chr(code_point)!r} differs from unidecode's {unidecode(chr(code_point))!r}")
+            matches = False
+
+    with open_pdf(pdf_path) as pdf:
+        columns = [
+            column for page_num in page_nums
+            for column in extract_columns_from_chars(pdf.pages[page_num], LEFT_COL_BBOX, RIGHT_COL_BBOX)
+        ]
+    typographic_columns = []
+    for column in columns:
+        for ascii_text, typography in TYPOGRAPHY_BY_ASCII.items():
+            column = column.replace(ascii_text, typography)
+        typographic_columns.append(column)
+
+    for name, texts in [("as extracted", columns), ("with typography", typographic_columns)]:
+        if [sanitize_text(text) for text in texts] != [unidecode(text) for text in texts]:
+            log.error(f"sanitize_text output differs from unidecode on the columns {name}")
+            matches = False
+        ascii_ratio = sum(text.isascii() for text in texts) / len(texts)
+        reference_seconds = _best_time(lambda: [unidecode(text) for text in texts], repeat)
+        sanitize_seconds = _best_time(lambda: [sanitize_text(text) for text in texts], repeat)
+        log.info(
+            f"Sanitizing {len(texts)} columns {name} ({ascii_ratio:.0%} pure ASCII): "
+            f"unidecode {reference_seconds * 1000:.2f} ms, sanitize_text {sanitize_seconds * 1000:.2f} ms, "
+            f"speedup {reference_seconds / sanitize_seconds:.2f}x"
+        )
+    return matches
+
+
+def reference_parse_questions(lines: list[(str, int)], chapter: int) -> list[Question]:
+    """parse_questions as it was before the single-pass tokenizer, kept as the reference output."""
+    questions = []
+    question_number = None
+    question_text_lines = []
+    options = {}
+    option_pattern = re.compile(r'^([A-Z])\.\s+(.+)')  # Regex to match options like "A. Option text"
+    question_pattern = re.compile(r'^(\d+)\s+(.+)')  # Regex to match the start of a question like "66 A 23-year-old..."
+    last_question_num = 0  # Keep track of the last correct question number
+    last_page_number = None
+
+    for line, page_number in lines:
+        line = line.strip()
+
+        # Check if line starts a new question
+        question_match = question_pattern.match(line)
+        if question_match:
+            cur_question_num = int(question_match.group(1))
+
+            # Check if the question number is logically incorrect (like 1285 instead of 128)
+            if cur_question_num > last_question_num + 1:
+                log.warning(
+                    f"Question number {cur_question_num} is out of sequence. Adjusting to {last_question_num + 1}."
+                )
+                cur_question_num = last_question_num + 1
+
+            # If we already have a question stored, finalize it and start a new one
+            if question_number is not None:
+                question = Question(
+                    chapter=chapter,
+                    page_number=page_number,
+                    question_number=question_number,
+                    text=' '.join(question_text_lines),
+                    question_options=options
+                )
+                questions.append(question)
+
+            # Reset for new question
+            question_number = cur_question_num
+            last_question_num = question_number  # Update the last valid question number
+            question_text_lines = [question_match.group(2)]  # Start collecting text for this question
+            options = {}
+            continue
+
+        # If it's not a new question, check for options
+        option_match = option_pattern.match(line)
+        if option_match:
+            options[option_match.group(1)] = option_match.group(2)  # Add option key (A, B, etc.) and text
+        else:
+            # Continue collecting text for the current question
+            question_text_lines.append(line)
+        last_page_number = page_number
+
+    # Add the last question to the list
+    if question_number is not None:
+        question = Question(
+            chapter=chapter,
+            page_number=last_page_number,
+            question_number=question_number,
+            text=' '.join(question_text_lines),
+            question_options=options
+        )
+        questions.append(question)
+
+    return questions
+
+
+def reference_parse_answers(lines: list[(str, int)], chapter: int) -> list[Answer]:
+    """parse_answers as it was before the single-pass tokenizer, kept as the reference output."""
+    answers = []
+    answer_letter = None
+    answer_text_lines = []
+    answer_pattern = re.compile(r'^(\d+)\s+([A-Z])\.\s+(.+)')
+    last_page_number = None
+    last_answer_number = 0  # Keep track of the last correct answer number
+
+    def handle_new_answer_start(new_answer_start):
+        nonlocal last_answer_number, answer_letter, answer_text_lines, answer
+
+        current_answer_number = int(new_answer_start.group(1))
+        # Check if the answer number is logically incorrect
+        if current_answer_number > last_answer_number + 1:
+            log.warning(
+                f"Answer number {current_answer_number} is out of sequence. Adjusting to {last_answer_number + 1}."
+            )
+            current_answer_number = last_answer_number + 1
+
+        # If we already have an answer queued up, finalize it and start a new one
+        if last_answer_number is not None:
+            answer = Answer(
+                chapter=chapter,
+                page_number=page_number,
+                question_number=last_answer_number,
+                answer_letter=answer_letter,
+                text=' '.join(answer_text_lines)  # Join all lines into a single string
+            )
+            answers.append(answer)
+
+        # Start new answer
+        last_answer_number = current_answer_number  # Update the last valid answer number
+        answer_letter = new_answer_start.group(2)  # Capture the letter (e.g., B)
+        answer_text_lines = [new_answer_start.group(3)]  # Start collecting text for this answer
+
+        return answer_letter, answer_text_lines
+
+    for line, page_number in lines:
+        line = line.strip()
+
+        # Check if line starts a new answer
+        found_new_answer_start = answer_pattern.match(line)
+        if found_new_answer_start:
+            answer_letter, answer_text_lines = handle_new_answer_start(found_new_answer_start)
+            continue
+
+        # Continue collecting text for the current answer
+        answer_text_lines.append(line)
+        last_page_number = page_number
+
+    # Add the last answer to the list
+    answer = Answer(
+        chapter=chapter,
+        page_number=last_page_number,
+        question_number=last_answer_number,
+        answer_letter=answer_letter,
+        text=' '.join(answer_text_lines)  # Join all lines into a single string
+    )
+    answers.append(answer)
+
+    return answers
+
+
+def synthetic_chapter(question_count, seed=0) -> tuple[list[tuple[str, int]], list[tuple[str, int]]]:
+    """
+    (question_lines, answer_lines) of a chapter with `question_count` questions, shaped like the extracted text:
+    wrapped question and answer text, lettered options and the odd line with stray whitespace or no text.
+    """
+    rng = random.Random(seed)
+    words = ["nerve", "artery", "the", "of", "lateral", "muscle", "23-year-old", "patient", "which", "B.", "(12)"]
+
+    def text_line():
+        line = " ".join(rng.choice(words) for _ in range(rng.randint(1, 9)))
+        return rng.choice(["", " ", "\t"]) + line + rng.choice(["", "  "]) if rng.random() < 0.1 else line
+
+    question_lines, answer_lines = [], []
+    for number in range(1, question_count + 1):
+        page_number = 17 + number // 8
+        question_lines.append((f"{number} {text_line()}", page_number))
+        question_lines.extend((text_line(), page_number) for _ in range(rng.randint(1, 6)))
+        question_lines.extend((f"{letter}. {text_line()}", page_number) for letter in "ABCDE"[:rng.randint(4, 5)])
+        answer_lines.append((f"{number} {rng.choice('ABCDE')}. {text_line()}", page_number + 40))
+        answer_lines.extend((text_line(), page_number + 40) for _ in range(rng.randint(2, 12)))
+        if rng.random() < 0.05:
+            answer_lines.append(("", page_number + 40))
+    return question_lines, answer_lines
+
+
+def synthetic_book_lines(chapter_count, questions_per_chapter) -> list[str]:
+    """Lines of a book of synthetic chapters, each with an introduction, a questions and an answers section."""
+    lines = ["Front matter"] * 50
+    for chapter_number in range(1, chapter_count + 1):
+        question_lines, answer_lines = synthetic_chapter(questions_per_chapter, seed=chapter_number)
+        lines.extend([f"{chapter_number} Chapter INTRODUCTION", *["Introduction text"] * 30])
+        lines.extend(["QUESTIONS", "MAIN QUESTIONS"])
+        lines.extend(line for line, _ in question_lines)
+        lines.extend(["Back", "ANSWERS"])
+        lines.extend(line for line, _ in answer_lines)
+        lines.append("Back")
+    return lines
+
+
+def reference_segment_chapters(lines, page_number_by_line_idx) -> list:
+    """Chapters as the line-by-line segmentation loop splits them."""
+    from text_processing import ChapterSegmenter
+
+    segmenter = ChapterSegmenter()
+    chapters = []
+    for idx, line in enumerate(lines):
+        completed_chapter = segmenter.feed(line, page_number_by_line_idx[idx])
+        if completed_chapter is not None:
+            chapters.append(completed_chapter)
+    chapters.append(segmenter.finish())
+    return chapters
+
+
+def benchmark_segmentation(chapter_count, repeat) -> bool:
+    """Compare the section index built in one marker pass with the line-by-line segmentation loop."""
+    from text_processing import build_section_index, slice_chapters
+
+    lines = synthetic_book_lines(chapter_count, questions_per_chapter=60)
+    page_number_by_line_idx = {idx: idx // LINES_PER_PAGE for idx in range(len(lines))}
+    book = BookData()
+    for idx, line in enumerate(lines):
+        book.append_line(line, idx // LINES_PER_PAGE)
+    book_text = "\n".join(lines)
+
+    def segment_with_index():
+        return slice_chapters(build_section_index(book_text, len(lines)), book)
+
+    matches = segment_with_index() == reference_segment_chapters(lines, page_number_by_line_idx)
+    if not matches:
+        log.error("Chapters sliced with the section index differ from the line-by-line segmentation")
+
+    reference_seconds = _best_time(lambda: reference_segment_chapters(lines, page_number_by_line_idx), repeat)
+    index_seconds = _best_time(lambda: build_section_index(book_text, len(lines)), repeat)
+    slice_seconds = _best_time(segment_with_index, repeat)
+    log.info(
+        f"Segmenting {len(lines)} lines into {chapter_count} chapters: line-by-line {reference_seconds * 1000:.1f} ms, "
+        f"section index {index_seconds * 1000:.1f} ms, index and slicing {slice_seconds * 1000:.1f} ms, "
+        f"speedup {reference_seconds / slice_seconds:.2f}x"
+    )
+    return matches
+
+
+def benchmark_page_mapping(page_count) -> bool:
+    """Compare the memory taken by BookData's page runs with a dict of the page number of every line."""
+    lines = [f"Line {idx % 1000}" for idx in range(page_count * LINES_PER_PAGE)]
+
+    def allocated_bytes(build):
+        tracemalloc.start()
+        built = build()
+        allocated = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return built, allocated
+
+    def build_dict():
+        return {idx: idx // LINES_PER_PAGE for idx in range(len(lines))}
+
+    def build_book_data():
+        book = BookData(lines=lines)
+        for page_number in range(page_count):
+            book.page_numbers.append(page_number)
+            book.page_start_line_idxs.append(page_number * LINES_PER_PAGE)
+        return book
+
+    page_number_by_line_idx, dict_bytes = allocated_bytes(build_dict)
+    book, book_data_bytes = allocated_bytes(build_book_data)
+    matches = (
+        list(book.page_numbers_of_lines(0, len(lines))) == list(page_number_by_line_idx.values())
+        and all(book.page_number_of_line(idx) == page_number_by_line_idx[idx] for idx in range(0, len(lines), 997))
+    )
+    if not matches:
+        log.error("Page numbers of the page runs differ from those of the dict")
+    log.info(
+        f"Page numbers of {len(lines):,} lines on {page_count:,} pages: dict {dict_bytes / 1024 / 1024:.1f} MiB, "
+        f"page runs {book_data_bytes / 1024:.1f} KiB"
+    )
+    return matches
+
+
+def benchmark_parsing(question_count, repeat) -> bool:
+    """Compare the single-pass tokenizer parsers with the line-by-line regex parsers on a large synthetic chapter."""
+    from text_processing import parse_answers, parse_questions
+
+    question_lines, answer_lines = synthetic_chapter(question_count)
+    matches = True
+    for section, lines, parse, reference_parse in [
+        ("questions", question_lines, parse_questions, reference_parse_questions),
+        ("answers", answer_lines, parse_answers, reference_parse_answers),
+    ]:
+        if parse(lines, 1) != reference_parse(lines, 1):
+            log.error(f"Tokenizer {section} parser output differs from the reference parser")
+            matches = False
+        reference_seconds = _best_time(lambda: reference_parse(lines, 1), repeat)
+        tokenizer_seconds = _best_time(lambda: parse(lines, 1), repeat)
+        log.info(
+            f"Parsing {len(lines)} lines of {section}: line-by-line {len(lines) / reference_seconds:,.0f} lines/s, "
+            f"tokenizer {len(lines) / tokenizer_seconds:,.0f} lines/s, "
+            f"speedup {reference_seconds / tokenizer_seconds:.2f}x"
+        )
+    return matches
+
+
+def benchmark_parallel_parsing(chapter_count, workers, repeat) -> bool:
+    """Compare parsing the chapters of a synthetic book in a pool of workers with parsing them one after another."""
+    from artifact_writer import NullArtifactWriter
+    from model import ChapterLines
+    from text_processing import parse_chapter, parse_chapters_in_parallel
+
+    # Chapters of different sizes, like a real book, so the largest one bounds the parallel time
+    chapters = [
+        ChapterLines(chapter_number, *synthetic_chapter(200 + 150 * (chapter_number % 7), seed=chapter_number))
+        for chapter_number in range(1, chapter_count + 1)
+    ]
+    line_count = sum(len(chapter.question_lines) + len(chapter.answer_lines) for chapter in chapters)
+    artifact_writer = NullArtifactWriter()
+
+    def parse_sequentially():
+        return [row for chapter in chapters for row in parse_chapter(chapter, artifact_writer)]
+
+    def parse_in_parallel():
+        return parse_chapters_in_parallel(chapters, workers, artifact_writer)
+
+    # The synthetic answers include unmatched numbers, whose warnings would drown the results
+    log.disable(log.WARNING)
+    matches = parse_in_parallel() == parse_sequentially()
+    sequential_seconds = _best_time(parse_sequentially, repeat)
+    # Includes starting the pool and sending the chapters to it, as every run has to
+    parallel_seconds = _best_time(parse_in_parallel, repeat)
+    log.disable(log.NOTSET)
+    if not matches:
+        log.error("Rows parsed in parallel differ from the rows parsed chapter by chapter")
+    log.info(
+        f"Parsing {chapter_count} chapters of {line_count} lines on {os.cpu_count()} CPUs: "
+        f"sequential {sequential_seconds * 1000:.0f} ms, {workers} workers {parallel_seconds * 1000:.0f} ms, "
+        f"speedup {sequential_seconds / parallel_seconds:.2f}x"
+    )
+    return matches
+
+
+def _rows_digest(output_rows) -> str:
+    digest = hashlib.sha256()
+    for row in output_rows:
+        digest.update(json.dumps(row.to_dict(), sort_keys=True).encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def _golden_key(page_count, seed):
+    return f"{page_count}-pages-seed-{seed}"
+
+
+def _load_golden() -> dict:
+    if not os.path.exists(GOLDEN_PATH):
+        return {}
+    with open(GOLDEN_PATH) as f:
+        return json.load(f)
+
+
+def _extract_synthetic_pdf(
+        pdf_path,
+        workers,
+        work_dir,
+        auto_layout=False,
+        skip_non_question_pages=False
+) -> tuple[float, list]:
+    """
+    Seconds to extract the pages of a synthetic book's PDF on a fresh checkpoint store, and the pages. With
+    `auto_layout`, the layout is detected like --layout auto does instead of using the default one.
+    """
+    from checkpoint_store import SqliteCheckpointStore
+    from pdf_processing import DEFAULT_LAYOUT, iter_pages_in_order
+
+    store_name = f"{os.path.basename(pdf_path)}-{'auto' if auto_layout else 'default'}.sqlite3"
+    checkpoint_store = SqliteCheckpointStore(os.path.join(work_dir, store_name))
+    log.disable(log.INFO)
+    started_at = time.perf_counter()
+    extracted_pages = list(iter_pages_in_order(
+        pdf_path,
+        workers,
+        checkpoint_store,
+        layout=None if auto_layout else DEFAULT_LAYOUT,
+        skip_non_question_pages=skip_non_question_pages
+    ))
+    extraction_seconds = time.perf_counter() - started_at
+    log.disable(log.NOTSET)
+    checkpoint_store.close()
+    return extraction_seconds, extracted_pages
+
+
+def _parse_synthetic_pages(pages) -> list:
+    from artifact_writer import NullArtifactWriter
+    from text_processing import build_book_data, build_section_index, parse_chapter, slice_chapters
+
+    book = build_book_data(pages)
+    chapters = slice_chapters(build_section_index("\n".join(book.lines), len(book.lines)), book)
+    # The synthetic answers include unmatched numbers, whose warnings would drown the results
+    log.disable(log.WARNING)
+    output_rows = [row for chapter in chapters for row in parse_chapter(chapter, NullArtifactWriter())]
+    log.disable(log.NOTSET)
+    return output_rows
+
+
+def benchmark_suite(page_counts, seed, with_pdf, workers, repeat, update_golden) -> bool:
+    """
+    Run every stage of the pipeline on synthetic books of each size, timing the stages one by one, and compare the
+    rows with the golden ones recorded for the same book. With --pdf, the book is also laid out in a PDF and its pages
+    extracted back, which must give the generated text exactly, and extracted again with the layout detected like
+    --layout auto does, which must give the golden rows. A book without hyphenation, whose intro pages can be
+    skipped, is also laid out with its section markers split between text operators and extracted skipping
+    non-question pages, which must give the same rows as its generated text.
+    """
+    from artifact_writer import NullArtifactWriter
+    from exporters import open_exporter
+    from synthetic_book import generate_book_pages, write_book_pdf
+    from text_processing import build_book_data, build_section_index, parse_chapter, slice_chapters
+
+    golden = _load_golden()
+    matches = True
+    for page_count in page_counts:
+        pages = generate_book_pages(page_count, seed)
+        seconds_by_stage = {}
+        with tempfile.TemporaryDirectory() as work_dir:
+            if with_pdf:
+                pdf_path = os.path.join(work_dir, "synthetic.pdf")
+                write_book_pdf(pages, pdf_path)
+                seconds_by_stage["extraction"], extracted_pages = _extract_synthetic_pdf(pdf_path, workers, work_dir)
+                if extracted_pages != pages:
+                    log.error(f"{page_count} pages: pages extracted from the PDF differ from the generated ones")
+                    matches = False
+                _, auto_layout_pages = _extract_synthetic_pdf(pdf_path, workers, work_dir, auto_layout=True)
+                auto_layout_rows = _parse_synthetic_pages(auto_layout_pages)
+
+                unhyphenated_pages = generate_book_pages(page_count, seed, hyphenate=False)
+                split_pdf_path = os.path.join(work_dir, "split_markers.pdf")
+                write_book_pdf(unhyphenated_pages, split_pdf_path, split_markers=True)
+                _, extracted_pages = _extract_synthetic_pdf(
+                    split_pdf_path, workers, work_dir, skip_non_question_pages=True
+                )
+                expected_rows = _parse_synthetic_pages(unhyphenated_pages)
+                extracted_rows = _parse_synthetic_pages(extracted_pages)
+                if _rows_digest(extracted_rows) != _rows_digest(expected_rows):
+                    log.error(
+                        f"{page_count} pages: {len(extracted_rows)} rows extracted skipping non-question pages of the "
+                        f"PDF with split section markers differ from the {len(expected_rows)} rows of its text"
+                    )
+                    matches = False
+
+            book = build_book_data(pages)
+            book_text = "\n".join(book.lines)
+            chapters = slice_chapters(build_section_index(book_text, len(book.lines)), book)
+            # The synthetic answers include unmatched numbers, whose warnings would drown the results
+            log.disable(log.WARNING)
+            output_rows = [row for chapter in chapters for row in parse_chapter(chapter, NullArtifactWriter())]
+
+            def write_output():
+                with open_exporter(os.path.join(work_dir, "output.csv")) as exporter:
+                    exporter.write_rows(output_rows)
+
+            seconds_by_stage["sanitization"] = _best_time(lambda: build_book_data(pages), repeat)
+            seconds_by_stage["segmentation"] = _best_time(
+                lambda: slice_chapters(build_section_index("\n".join(book.lines), len(book.lines)), book), repeat
+            )
+            seconds_by_stage["parsing"] = _best_time(
+                lambda: [parse_chapter(chapter, NullArtifactWriter()) for chapter in chapters], repeat
+            )
+            seconds_by_stage["output"] = _best_time(write_output, repeat)
+            log.disable(log.NOTSET)
+
+        result = {"rows": len(output_rows), "digest": _rows_digest(output_rows)}
+        if with_pdf and _rows_digest(auto_layout_rows) != result["digest"]:
+            log.error(
+                f"{page_count} pages: {len(auto_layout_rows)} rows extracted with the detected layout differ from the "
+                f"{len(output_rows)} golden rows"
+            )
+            matches = False
+        key = _golden_key(page_count, seed)
+        if update_golden:
+            golden[key] = result
+        elif key not in golden:
+            log.error(f"{page_count} pages: no golden rows for {key}, record them with --update-golden")
+            matches = False
+        elif golden[key] != result:
+            log.error(f"{page_count} pages: {len(output_rows)} rows differ from the {golden[key]['rows']} golden rows")
+            matches = False
+
+        stage_summary = ", ".join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in seconds_by_stage.items())
+        total_seconds = sum(seconds_by_stage.values())
+        log.info(
+            f"{page_count} pages, {len(chapters)} chapters, {len(output_rows)} rows: {stage_summary}, "
+            f"{page_count / total_seconds:,.0f} pages/s"
+        )
+
+    if update_golden:
+        with open(GOLDEN_PATH, "w") as f:
+            json.dump(golden, f, indent=2, sort_keys=True)
+        log.info(f"Golden rows saved at {GOLDEN_PATH}")
+    return matches
+
+
+def _parse_suite_page_counts(page_counts: str) -> list[int]:
+    counts = [int(count) for count in page_counts.split(",")]
+    if any(not MIN_SUITE_PAGES <= count <= MAX_SUITE_PAGES for count in counts):
+        raise argparse.ArgumentTypeError(f"page counts must be between {MIN_SUITE_PAGES} and {MAX_SUITE_PAGES}")
+    return counts
+
+
+def _slowest_imports(count=10) -> list[tuple[int, str]]:
+    """Modules imported directly by `import main` with the largest cumulative import time, in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"], cwd=REPO_DIR, capture_output=True, text=True
+    )
+    import_times = []
+    for line in result.stderr.splitlines():
+        # Lines look like "import time:       self [us] |  cumulative | imported package", nesting indents the name
+        _, _, timings = line.partition("import time:")
+        _, _, rest = timings.partition("|")
+        cumulative_us, _, name = rest.partition("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if cumulative_us.strip().isdigit() and depth <= 1:
+            import_times.append((int(cumulative_us), name.strip()))
+    return sorted(import_times, reverse=True)[:count]
+
+
+def benchmark_startup(repeat, run_main_args=None) -> bool:
+    """
+    Time importing main in a fresh interpreter, listing the slowest imports, and optionally a whole run of main.py in
+    the current directory, which is expected to be fully checkpointed and to stay within STARTUP_BUDGET_SECONDS.
+    """
+    interpreter_seconds = _best_time(lambda: subprocess.run([sys.executable, "-c", "pass"], check=True), repeat)
+    import_seconds = _best_time(
+        lambda: subprocess.run([sys.executable, "-c", "import main"], cwd=REPO_DIR, check=True), repeat
+    )
+    log.info(
+        f"Interpreter startup {interpreter_seconds * 1000:.0f} ms, "
+        f"import main {(import_seconds - interpreter_seconds) * 1000:.0f} ms on top of it"
+    )
+    for cumulative_us, name in _slowest_imports():
+        log.info(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    if run_main_args is None:
+        return True
+    run_seconds = _best_time(
+        lambda: subprocess.run(
+            [sys.executable, os.path.join(REPO_DIR, "main.py"), *run_main_args], check=True, capture_output=True
+        ),
+        repeat
+    )
+    log.info(f"main.py {' '.join(run_main_args)} took {run_seconds * 1000:.0f} ms")
+    return run_seconds <= STARTUP_BUDGET_SECONDS
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline's hot paths against their reference output.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the best one is reported.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    columns_parser = subparsers.add_parser("columns", help="Column extraction engines on pages of a real PDF.")
+    columns_parser.add_argument("pdf_path")
+    columns_parser.add_argument("--pages", type=_parse_page_range, default=range(17, 37), help="e.g. 17-36")
+
+    sanitization_parser = subparsers.add_parser("sanitization", help="Unicode sanitization of real extracted pages.")
+    sanitization_parser.add_argument("pdf_path")
+    sanitization_parser.add_argument("--pages", type=_parse_page_range, default=range(17, 37), help="e.g. 17-36")
+
+    parsing_parser = subparsers.add_parser("parsing", help="Question and answer parsers on a synthetic chapter.")
+    parsing_parser.add_argument("--questions", type=int, default=20_000, help="Questions in the synthetic chapter.")
+
+    segmentation_parser = subparsers.add_parser("segmentation", help="Chapter segmentation of a synthetic book.")
+    segmentation_parser.add_argument("--chapters", type=int, default=100, help="Chapters in the synthetic book.")
+
+    page_mapping_parser = subparsers.add_parser("page-mapping", help="Memory taken by the line to page mapping.")
+    page_mapping_parser.add_argument("--pages", type=int, default=2_000, help="Pages in the synthetic book.")
+
+    parallel_parsing_parser = subparsers.add_parser(
+        "parallel-parsing", help="Chapters of a synthetic book parsed in a pool of workers and one after another."
+    )
+    parallel_parsing_parser.add_argument("--chapters", type=int, default=40, help="Chapters in the synthetic book.")
+    parallel_parsing_parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Parse workers.")
+
+    suite_parser = subparsers.add_parser(
+        "suite", help="Every stage of the pipeline on synthetic books, checked against golden rows."
+    )
+    suite_parser.add_argument(
+        "--pages", type=_parse_suite_page_counts, default=[10, 100, 1_000], help="Book sizes, e.g. 10,100,1000"
+    )
+    suite_parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic books.")
+    suite_parser.add_argument("--pdf", action="store_true", help="Also lay the books out in PDFs and extract them.")
+    suite_parser.add_argument(
+        "--workers", type=int, help="Extraction workers with --pdf, sized from the available resources by default."
+    )
+    suite_parser.add_argument(
+        "--update-golden", action="store_true", help="Record the rows as the new golden ones instead of checking them."
+    )
+
+    startup_parser = subparsers.add_parser("startup", help="Import time, and optionally a fully checkpointed run.")
+    startup_parser.add_argument(
+        "--run-main",
+        nargs=argparse.REMAINDER,
+        help="Also time main.py with these arguments in the current directory, e.g. --run-main --stream"
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging_setup.setup_logging()
+    args = parse_args()
+
+    if args.benchmark == "columns":
+        output_matches = benchmark_column_extraction(args.pdf_path, args.pages, args.repeat)
+    elif args.benchmark == "sanitization":
+        output_matches = benchmark_sanitization(args.pdf_path, args.pages, args.repeat)
+    elif args.benchmark == "parsing":
+        output_matches = benchmark_parsing(args.questions, args.repeat)
+    elif args.benchmark == "segmentation":
+        output_matches = benchmark_segmentation(args.chapters, args.repeat)
+    elif args.benchmark == "page-mapping":
+        output_matches = benchmark_page_mapping(args.pages)
+    elif args.benchmark == "parallel-parsing":
+        output_matches = benchmark_parallel_parsing(args.chapters, args.workers, args.repeat)
+    elif args.benchmark == "suite":
+        output_matches = benchmark_suite(
+            args.pages, args.seed, args.pdf, args.workers, args.repeat, args.update_golden
+        )
+    elif args.benchmark == "startup":
+        output_matches = benchmark_startup(args.repeat, args.run_main)
+    else:
+        raise ValueError(f"Unknown benchmark: {args.benchmark}")
+
+    sys.exit(0 if output_matches else 1)
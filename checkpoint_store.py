@@ -0,0 +1,316 @@
+import hashlib
+import json
+import logging as log
+import os
+import sqlite3
+import threading
+
+from model import RawPageData
+
+CHECKPOINT_FOLDER = "extracted_pages"
+CHECKPOINT_DB_PATH = "extracted_pages.sqlite3"
+LEGACY_MIGRATED_MARKER = "MIGRATED"
+
+JSON_BACKEND = "json"
+SQLITE_BACKEND = "sqlite"
+CHECKPOINT_BACKEND = SQLITE_BACKEND
+
+
+def checkpoint_key(page_digest: str, left_col_bbox, right_col_bbox, extractor_version) -> str:
+    """
+    Content-addressed key of a page's extracted text: it only changes when the page content, the column bounding
+    boxes or the extractor change, so the same cache can be shared between books, editions and bbox tweaks.
+    """
+    key_input = f"{extractor_version}|{page_digest}|{tuple(left_col_bbox)}|{tuple(right_col_bbox)}"
+    return hashlib.sha256(key_input.encode()).hexdigest()
+
+
+class CheckpointStore:
+    """
+    Storage for the text extracted from each page, so interrupted or repeated runs skip pages already extracted.
+    Page texts are stored by checkpoint_key, and each document (identified by its content fingerprint) records the
+    content digest of each of its pages, so the parent can compute keys without opening any page.
+    Stores are pickled to the extraction workers, which write their whole batch of pages in one call.
+    """
+
+    def save_pages(self, page_datas_by_key: dict[str, RawPageData]):
+        raise NotImplementedError
+
+    def load_page(self, key, page_num) -> RawPageData | None:
+        raise NotImplementedError
+
+    def completed_keys(self, keys) -> set[str]:
+        """Return the subset of `keys` that already have a checkpoint."""
+        raise NotImplementedError
+
+    def save_page_digests(self, document, digest_by_page_num: dict[int, str]):
+        raise NotImplementedError
+
+    def load_page_digests(self, document) -> dict[int, str]:
+        raise NotImplementedError
+
+    def save_fingerprint(self, path, size, mtime_ns, fingerprint):
+        raise NotImplementedError
+
+    def load_fingerprint(self, path, size, mtime_ns) -> str | None:
+        """Return the cached content fingerprint of the file at `path`, if it has not changed since."""
+        raise NotImplementedError
+
+    def save_artifact(self, kind, key, payload: dict):
+        """Store a small JSON-serializable result derived from a document, such as its layout profile."""
+        raise NotImplementedError
+
+    def load_artifact(self, kind, key) -> dict | None:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def _write_json(file_path, output):
+    # Write to a temporary file first, so readers never see a partially written file
+    temp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(output, f)
+    os.replace(temp_path, file_path)
+
+
+def _read_json(file_path, default=None):
+    if not os.path.exists(file_path):
+        return default
+    with open(file_path, 'r') as f:
+        return json.load(f)
+
+
+class JsonFolderCheckpointStore(CheckpointStore):
+    """One `<key>.json` file per page text, plus one digest file per document."""
+
+    def __init__(self, folder=CHECKPOINT_FOLDER):
+        self.folder = folder
+
+    def _documents_folder(self):
+        return os.path.join(self.folder, "documents")
+
+    def save_pages(self, page_datas_by_key: dict[str, RawPageData]):
+        os.makedirs(self.folder, exist_ok=True)
+        for key, page_data in page_datas_by_key.items():
+            _write_json(
+                os.path.join(self.folder, f"{key}.json"),
+                {"left_text": page_data.left_col, "right_text": page_data.right_col}
+            )
+
+    def load_page(self, key, page_num) -> RawPageData | None:
+        data = _read_json(os.path.join(self.folder, f"{key}.json"))
+        if data is None:
+            return None
+        return RawPageData(page_number=page_num, left_col=data['left_text'], right_col=data['right_text'])
+
+    def completed_keys(self, keys) -> set[str]:
+        if not os.path.exists(self.folder):
+            return set()
+        checkpoint_files = set(os.listdir(self.folder))
+        return {key for key in keys if f"{key}.json" in checkpoint_files}
+
+    def save_page_digests(self, document, digest_by_page_num: dict[int, str]):
+        # Workers of the same document update this file concurrently, so it holds one file per batch
+        os.makedirs(os.path.join(self._documents_folder(), document), exist_ok=True)
+        first_page_num = min(digest_by_page_num, default=0)
+        _write_json(
+            os.path.join(self._documents_folder(), document, f"pages_{first_page_num}.json"),
+            {str(page_num): digest for page_num, digest in digest_by_page_num.items()}
+        )
+
+    def load_page_digests(self, document) -> dict[int, str]:
+        document_folder = os.path.join(self._documents_folder(), document)
+        if not os.path.isdir(document_folder):
+            return {}
+        digest_by_page_num = {}
+        for file_name in os.listdir(document_folder):
+            if file_name.endswith(".json"):
+                for page_num, digest in _read_json(os.path.join(document_folder, file_name), {}).items():
+                    digest_by_page_num[int(page_num)] = digest
+        return digest_by_page_num
+
+    def save_fingerprint(self, path, size, mtime_ns, fingerprint):
+        os.makedirs(self.folder, exist_ok=True)
+        fingerprints_path = os.path.join(self.folder, "fingerprints.json")
+        fingerprints = _read_json(fingerprints_path, {})
+        fingerprints[path] = {"size": size, "mtime_ns": mtime_ns, "fingerprint": fingerprint}
+        _write_json(fingerprints_path, fingerprints)
+
+    def load_fingerprint(self, path, size, mtime_ns) -> str | None:
+        cached = _read_json(os.path.join(self.folder, "fingerprints.json"), {}).get(path)
+        if cached is None or cached["size"] != size or cached["mtime_ns"] != mtime_ns:
+            return None
+        return cached["fingerprint"]
+
+    def save_artifact(self, kind, key, payload: dict):
+        os.makedirs(os.path.join(self.folder, "artifacts", kind), exist_ok=True)
+        _write_json(os.path.join(self.folder, "artifacts", kind, f"{key}.json"), payload)
+
+    def load_artifact(self, kind, key) -> dict | None:
+        return _read_json(os.path.join(self.folder, "artifacts", kind, f"{key}.json"))
+
+
+class SqliteCheckpointStore(CheckpointStore):
+    """
+    All checkpoints in a single SQLite database in WAL mode, so workers can write concurrently while the parent reads.
+    A connection is opened lazily in each process and each thread using the store, and is not pickled.
+    """
+
+    def __init__(self, db_path=CHECKPOINT_DB_PATH):
+        self.db_path = db_path
+        # SQLite connections cannot be shared between threads
+        self._local = threading.local()
+
+    def __getstate__(self):
+        return {"db_path": self.db_path}
+
+    def __setstate__(self, state):
+        self.__init__(state["db_path"])
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # A connection inherited through fork must not be reused by the child
+        if getattr(self._local, "connection", None) is None or self._local.connection_pid != os.getpid():
+            connection = sqlite3.connect(self.db_path, timeout=60)
+            self._local.connection = connection
+            self._local.connection_pid = os.getpid()
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS page_texts (key TEXT PRIMARY KEY, left_text TEXT, right_text TEXT);
+                CREATE TABLE IF NOT EXISTS page_digests (
+                    document TEXT, page_number INTEGER, digest TEXT, PRIMARY KEY (document, page_number)
+                );
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, fingerprint TEXT
+                );
+                CREATE TABLE IF NOT EXISTS artifacts (kind TEXT, key TEXT, payload TEXT, PRIMARY KEY (kind, key));
+            """)
+        return self._local.connection
+
+    def save_pages(self, page_datas_by_key: dict[str, RawPageData]):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO page_texts (key, left_text, right_text) VALUES (?, ?, ?)",
+                [(key, page_data.left_col, page_data.right_col) for key, page_data in page_datas_by_key.items()]
+            )
+
+    def load_page(self, key, page_num) -> RawPageData | None:
+        row = self.connection.execute(
+            "SELECT left_text, right_text FROM page_texts WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return RawPageData(page_number=page_num, left_col=row[0], right_col=row[1])
+
+    def completed_keys(self, keys) -> set[str]:
+        keys = list(keys)
+        completed = set()
+        # Stay well below SQLite's limit on the number of query parameters
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            completed.update(
+                row[0] for row in self.connection.execute(
+                    f"SELECT key FROM page_texts WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                )
+            )
+        return completed
+
+    def save_page_digests(self, document, digest_by_page_num: dict[int, str]):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO page_digests (document, page_number, digest) VALUES (?, ?, ?)",
+                [(document, page_num, digest) for page_num, digest in digest_by_page_num.items()]
+            )
+
+    def load_page_digests(self, document) -> dict[int, str]:
+        return dict(self.connection.execute(
+            "SELECT page_number, digest FROM page_digests WHERE document = ?", (document,)
+        ))
+
+    def save_fingerprint(self, path, size, mtime_ns, fingerprint):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO fingerprints (path, size, mtime_ns, fingerprint) VALUES (?, ?, ?, ?)",
+                (path, size, mtime_ns, fingerprint)
+            )
+
+    def load_fingerprint(self, path, size, mtime_ns) -> str | None:
+        row = self.connection.execute(
+            "SELECT fingerprint FROM fingerprints WHERE path = ? AND size = ? AND mtime_ns = ?", (path, size, mtime_ns)
+        ).fetchone()
+        return row[0] if row else None
+
+    def save_artifact(self, kind, key, payload: dict):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO artifacts (kind, key, payload) VALUES (?, ?, ?)",
+                (kind, key, json.dumps(payload))
+            )
+
+    def load_artifact(self, kind, key) -> dict | None:
+        row = self.connection.execute(
+            "SELECT payload FROM artifacts WHERE kind = ? AND key = ?", (kind, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def close(self):
+        """Close the connection of the calling thread."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.connection_pid == os.getpid():
+            connection.close()
+        self._local.connection = None
+
+
+def legacy_checkpoint_page_numbers(folder=CHECKPOINT_FOLDER) -> list[int]:
+    """
+    Page numbers checkpointed in the legacy layout, with one `page_N.json` file per page number.
+    Empty once the folder has been migrated.
+    """
+    if not os.path.isdir(folder) or os.path.exists(os.path.join(folder, LEGACY_MIGRATED_MARKER)):
+        return []
+    return sorted(
+        int(file_name[len("page_"):-len(".json")])
+        for file_name in os.listdir(folder)
+        if file_name.startswith("page_") and file_name.endswith(".json")
+    )
+
+
+def migrate_legacy_checkpoints(
+        store: CheckpointStore,
+        document,
+        key_by_page_num: dict[int, str],
+        digest_by_page_num: dict[int, str],
+        folder=CHECKPOINT_FOLDER,
+        batch_size=500
+) -> int:
+    """
+    Copy the pages of a legacy per-page JSON checkpoint folder into `store`. Legacy checkpoints are only keyed by
+    page number, so the caller provides the content digest and checkpoint key of each page of the document they were
+    extracted from. Returns the number of pages migrated.
+    """
+    page_nums = [page_num for page_num in legacy_checkpoint_page_numbers(folder) if page_num in key_by_page_num]
+    for i in range(0, len(page_nums), batch_size):
+        page_datas_by_key = {}
+        for page_num in page_nums[i:i + batch_size]:
+            data = _read_json(os.path.join(folder, f"page_{page_num}.json"))
+            page_datas_by_key[key_by_page_num[page_num]] = RawPageData(
+                page_number=page_num, left_col=data['left_text'], right_col=data['right_text']
+            )
+        store.save_pages(page_datas_by_key)
+    store.save_page_digests(document, {page_num: digest_by_page_num[page_num] for page_num in page_nums})
+    # Legacy checkpoints only ever belong to one document, never migrate them into another one
+    with open(os.path.join(folder, LEGACY_MIGRATED_MARKER), 'w') as f:
+        f.write(document)
+    log.info(f"Migrated {len(page_nums)} checkpointed pages from {folder}")
+    return len(page_nums)
+
+
+def open_checkpoint_store(backend=CHECKPOINT_BACKEND) -> CheckpointStore:
+    if backend == JSON_BACKEND:
+        return JsonFolderCheckpointStore()
+    if backend == SQLITE_BACKEND:
+        return SqliteCheckpointStore()
+    raise ValueError(f"Unknown checkpoint backend: {backend}")
@@ -0,0 +1,48 @@
+BBOX_ENGINE = "bbox"
+CHARS_ENGINE = "chars"
+
+
+def extract_columns_with_bboxes(page, left_col_bbox, right_col_bbox) -> tuple[str, str]:
+    """Reference engine: crop the page once per column and let pdfplumber assemble each column's text."""
+    left_text = page.within_bbox(left_col_bbox).extract_text()
+    right_text = page.within_bbox(right_col_bbox).extract_text()
+    return left_text, right_text
+
+
+def _within_bbox_mask(x0, top, x1, bottom, bbox):
+    """Same test as pdfplumber's within_bbox: the char lies entirely inside the bbox and is not zero-sized."""
+    bbox_x0, bbox_top, bbox_x1, bbox_bottom = bbox
+    return (
+        (x0 >= bbox_x0) & (x1 <= bbox_x1) & (top >= bbox_top) & (bottom <= bbox_bottom)
+        & ((x1 - x0) + (bottom - top) > 0)
+    )
+
+
+def split_chars_into_columns(chars, left_col_bbox, right_col_bbox) -> tuple[list, list]:
+    """Partition the page's chars into the left and right column with one vectorized pass over their positions."""
+    import numpy as np  # Imported on first use, so importing this module stays cheap for the parent process
+
+    if not chars:
+        return [], []
+    positions = np.array([(char["x0"], char["top"], char["x1"], char["bottom"]) for char in chars], dtype=float)
+    x0, top, x1, bottom = positions.T
+    left_indexes = np.flatnonzero(_within_bbox_mask(x0, top, x1, bottom, left_col_bbox))
+    right_indexes = np.flatnonzero(_within_bbox_mask(x0, top, x1, bottom, right_col_bbox))
+    return [chars[i] for i in left_indexes], [chars[i] for i in right_indexes]
+
+
+def extract_columns_from_chars(page, left_col_bbox, right_col_bbox) -> tuple[str, str]:
+    """
+    Read the page's chars once and split them into columns, instead of cropping the page twice, which re-filters
+    every layout object of the page for each column.
+    """
+    from pdfplumber.utils import extract_text
+
+    left_chars, right_chars = split_chars_into_columns(page.chars, left_col_bbox, right_col_bbox)
+    return extract_text(left_chars), extract_text(right_chars)
+
+
+COLUMN_EXTRACTORS = {
+    BBOX_ENGINE: extract_columns_with_bboxes,
+    CHARS_ENGINE: extract_columns_from_chars,
+}
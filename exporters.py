@@ -0,0 +1,173 @@
+import csv
+import html
+import json
+import logging as log
+import os
+
+from metrics import OUTPUT_WRITING_STAGE, ROWS_COUNTER, RUN_METRICS
+from model import ANSWER_COL, ANSWER_LETTER_COL, OutputRow, QUESTION_COL, QUESTION_OPTIONS_COL
+
+CSV_FORMAT = "csv"
+JSONL_FORMAT = "jsonl"
+PARQUET_FORMAT = "parquet"
+ANKI_FORMAT = "anki"
+
+FORMAT_BY_EXTENSION = {
+    ".csv": CSV_FORMAT,
+    ".jsonl": JSONL_FORMAT,
+    ".parquet": PARQUET_FORMAT,
+    ".tsv": ANKI_FORMAT,
+    ".txt": ANKI_FORMAT,
+}
+
+PARQUET_ROW_GROUP_SIZE = 10_000
+STRING_COLUMNS = {QUESTION_COL, QUESTION_OPTIONS_COL, ANSWER_LETTER_COL, ANSWER_COL}
+
+
+class RowExporter:
+    """
+    Writes output rows to a file incrementally, as they are produced, flushing after every batch so rows reach disk
+    early. Only the current batch of rows is held in memory.
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.rows_written = 0
+
+    def write_rows(self, output_rows: [OutputRow]):
+        with RUN_METRICS.span(OUTPUT_WRITING_STAGE):
+            self._write_rows(output_rows)
+        self.rows_written += len(output_rows)
+        RUN_METRICS.count(ROWS_COUNTER, len(output_rows))
+
+    def _write_rows(self, output_rows: [OutputRow]):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+    def close(self):
+        with RUN_METRICS.span(OUTPUT_WRITING_STAGE):
+            self._close()
+        log.info(f"Saved {self.rows_written} rows at {self.output_path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class CsvExporter(RowExporter):
+    """Plain CSV with a header row, in the same dialect pandas' to_csv used to write."""
+
+    def __init__(self, output_path):
+        super().__init__(output_path)
+        self._file = open(output_path, 'w', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=OutputRow.column_headers(), lineterminator=os.linesep)
+        self._writer.writeheader()
+
+    def _write_rows(self, output_rows: [OutputRow]):
+        self._writer.writerows(row.to_dict() for row in output_rows)
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+
+class JsonlExporter(RowExporter):
+    """One JSON object per row."""
+
+    def __init__(self, output_path):
+        super().__init__(output_path)
+        self._file = open(output_path, 'w')
+
+    def _write_rows(self, output_rows: [OutputRow]):
+        self._file.write("".join(json.dumps(row.to_dict()) + "\n" for row in output_rows))
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+
+class ParquetExporter(RowExporter):
+    """Parquet written one row group at a time, so memory is bounded by PARQUET_ROW_GROUP_SIZE rows."""
+
+    def __init__(self, output_path, row_group_size=PARQUET_ROW_GROUP_SIZE):
+        super().__init__(output_path)
+        # Only this format needs pyarrow, don't make every run pay for importing it
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._schema = pa.schema([
+            (column, pa.string() if column in STRING_COLUMNS else pa.int64())
+            for column in OutputRow.column_headers()
+        ])
+        self._writer = pq.ParquetWriter(output_path, self._schema)
+        self._row_group_size = row_group_size
+        self._pending_rows = []
+
+    def _flush_row_group(self):
+        columns = {column: [row[column] for row in self._pending_rows] for column in self._schema.names}
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self._schema))
+        self._pending_rows = []
+
+    def _write_rows(self, output_rows: [OutputRow]):
+        for row in output_rows:
+            self._pending_rows.append(row.to_dict())
+            if len(self._pending_rows) >= self._row_group_size:
+                self._flush_row_group()
+
+    def _close(self):
+        if self._pending_rows:
+            self._flush_row_group()
+        self._writer.close()
+
+
+class AnkiTsvExporter(RowExporter):
+    """
+    Tab-separated notes ready for Anki's File > Import: the question and its options on the front, the answer on the
+    back, and the chapter and page as tags.
+    """
+
+    def __init__(self, output_path):
+        super().__init__(output_path)
+        self._file = open(output_path, 'w')
+        self._file.write("#separator:tab\n#html:true\n#tags column:3\n")
+
+    @staticmethod
+    def _field(text):
+        return html.escape(text or "").replace("\t", " ").replace("\r", "").replace("\n", "<br>")
+
+    def _write_rows(self, output_rows: [OutputRow]):
+        lines = []
+        for row in output_rows:
+            front = self._field(row.question)
+            if row.question_options:
+                front += "<br><br>" + self._field(row.question_options)
+            back = self._field(f"{row.answer_letter}. {row.answer}")
+            tags = f"chapter_{row.chapter} page_{row.page_number}"
+            lines.append(f"{front}\t{back}\t{tags}\n")
+        self._file.write("".join(lines))
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+
+EXPORTERS = {
+    CSV_FORMAT: CsvExporter,
+    JSONL_FORMAT: JsonlExporter,
+    PARQUET_FORMAT: ParquetExporter,
+    ANKI_FORMAT: AnkiTsvExporter,
+}
+
+
+def open_exporter(output_path, output_format=None) -> RowExporter:
+    """Open the exporter for `output_format`, or for the output path's extension if no format is given."""
+    if output_format is None:
+        output_format = FORMAT_BY_EXTENSION.get(os.path.splitext(output_path)[1].lower())
+        if output_format is None:
+            raise ValueError(f"Can't infer the output format of {output_path}, specify one of {sorted(EXPORTERS)}")
+    return EXPORTERS[output_format](output_path)
@@ -0,0 +1,172 @@
+import logging as log
+import math
+
+import numpy as np
+
+from checkpoint_store import CheckpointStore
+from model import LayoutProfile
+
+# Bump whenever a change to the analysis would detect a different layout for the same document
+LAYOUT_VERSION = 2
+LAYOUT_ARTIFACT = "layout"
+
+SAMPLE_PAGE_COUNT = 24
+BIN_WIDTH = 1.0  # points
+MIN_GUTTER_WIDTH = 4.0
+# Share of the page margin added to the column bboxes, since lines wider than any on the sample pages may be elsewhere
+MARGIN_PADDING_RATIO = 0.5
+# Footers such as page numbers are only looked for in the bottom part of the page
+FOOTER_BAND = 0.15
+# The gap above a footer has to be clearly wider than the gaps between lines, otherwise the text reaches the bottom
+MIN_FOOTER_GAP_RATIO = 2.0
+MIN_FOOTER_GAP = 4.0  # points
+# Share of the histogram's peak below which a bin counts as empty, so a few headings crossing the gutter are tolerated
+EMPTY_BIN_RATIO = 0.05
+# Pages are sampled after the front part of the book, where front matter is unlikely
+FRONT_MATTER_RATIO = 0.25
+MIN_CONTENT_CHARS = 100
+MAX_GUTTER_CROSSING_RATIO = 0.02
+MIN_COLUMN_CHAR_RATIO = 0.15
+
+
+def _char_positions(page) -> np.ndarray:
+    """(x0, top, x1, bottom) of every char of the page."""
+    return np.array(
+        [(char["x0"], char["top"], char["x1"], char["bottom"]) for char in page.chars], dtype=float
+    ).reshape(-1, 4)
+
+
+def _coverage_histogram(starts: np.ndarray, ends: np.ndarray, size: float) -> np.ndarray:
+    """Number of chars covering each BIN_WIDTH-wide bin of [0, size)."""
+    bin_count = int(math.ceil(size / BIN_WIDTH))
+    changes = np.zeros(bin_count + 1)
+    np.add.at(changes, np.clip(np.floor(starts / BIN_WIDTH).astype(int), 0, bin_count), 1)
+    np.add.at(changes, np.clip(np.ceil(ends / BIN_WIDTH).astype(int), 0, bin_count), -1)
+    return np.cumsum(changes)[:bin_count]
+
+
+def _empty_runs(is_empty: np.ndarray) -> list[tuple[int, int]]:
+    """[start, end) bin ranges of consecutive empty bins."""
+    padded = np.concatenate(([False], is_empty, [False])).astype(int)
+    edges = np.flatnonzero(np.diff(padded))
+    return list(zip(edges[::2], edges[1::2]))
+
+
+def _find_gutter(x_coverage: np.ndarray, text_start: int, text_end: int):
+    """Centre of the widest empty vertical band in the middle of the text block, or None for single-column text."""
+    is_empty = x_coverage <= x_coverage.max() * EMPTY_BIN_RATIO
+    text_width = text_end - text_start
+    candidates = [
+        (start, end) for start, end in _empty_runs(is_empty[text_start:text_end])
+        if 0.3 * text_width <= (start + end) / 2 <= 0.7 * text_width and (end - start) * BIN_WIDTH >= MIN_GUTTER_WIDTH
+    ]
+    if not candidates:
+        return None
+    start, end = max(candidates, key=lambda run: run[1] - run[0])
+    return (text_start + (start + end) / 2) * BIN_WIDTH
+
+
+def _find_body_bottom(y_coverage: np.ndarray, page_height: float) -> float:
+    """
+    Top of the footer, found as the widest empty horizontal band near the bottom with text below it, as long as it is
+    clearly wider than the typical gap between lines. Without such a band, the body reaches the bottom of the page.
+    """
+    # Footers such as page numbers are sparse, so only bins without any char count as empty
+    is_empty = y_coverage == 0
+    non_empty_bins = np.flatnonzero(~is_empty)
+    if not len(non_empty_bins):
+        return page_height
+    first_text_bin, last_text_bin = non_empty_bins[0], non_empty_bins[-1]
+    footer_band_start = int((1 - FOOTER_BAND) * len(y_coverage))
+    empty_runs = _empty_runs(is_empty)
+    candidates = [(start, end) for start, end in empty_runs if start >= footer_band_start and end <= last_text_bin]
+    if not candidates:
+        return page_height
+    start, end = max(candidates, key=lambda run: run[1] - run[0])
+    line_gaps = [
+        gap_end - gap_start for gap_start, gap_end in empty_runs
+        if gap_start > first_text_bin and gap_end < footer_band_start
+    ]
+    typical_line_gap = float(np.median(line_gaps)) if line_gaps else 0.0
+    if (end - start) * BIN_WIDTH < max(MIN_FOOTER_GAP_RATIO * typical_line_gap * BIN_WIDTH, MIN_FOOTER_GAP):
+        return page_height
+    return (start + end) / 2 * BIN_WIDTH
+
+
+def _is_two_column_page(positions: np.ndarray, gutter_x: float) -> bool:
+    if len(positions) < MIN_CONTENT_CHARS:
+        return False
+    x0, x1 = positions[:, 0], positions[:, 2]
+    left_count = np.count_nonzero(x1 <= gutter_x)
+    right_count = np.count_nonzero(x0 >= gutter_x)
+    crossing_count = len(positions) - left_count - right_count
+    return (
+        crossing_count <= MAX_GUTTER_CROSSING_RATIO * len(positions)
+        and min(left_count, right_count) >= MIN_COLUMN_CHAR_RATIO * len(positions)
+    )
+
+
+def detect_layout(pdf) -> LayoutProfile | None:
+    """
+    Find the column gutter, the text margins, the footer and the first two-column page of the book from histograms of
+    char positions on a sample of pages. Returns None if the pages don't look like two columns of text.
+    """
+    total_pages = len(pdf.pages)
+    first_sample_page = int(total_pages * FRONT_MATTER_RATIO)
+    sample_page_nums = sorted(set(
+        np.linspace(first_sample_page, total_pages - 1, num=min(SAMPLE_PAGE_COUNT, total_pages)).astype(int)
+    ))
+    log.info(f"Analysing the layout of {len(sample_page_nums)} sample pages...")
+
+    sample_pages = [pdf.pages[page_num] for page_num in sample_page_nums]
+    positions = np.concatenate([_char_positions(page) for page in sample_pages])
+    if not len(positions):
+        return None
+    page_width = max(page.width for page in sample_pages)
+    page_height = max(page.height for page in sample_pages)
+
+    # Margins are taken from every char, a wider bbox only costs time while a narrower one would drop text
+    x_coverage = _coverage_histogram(positions[:, 0], positions[:, 2], page_width)
+    text_bins = np.flatnonzero(x_coverage > 0)
+    text_start, text_end = text_bins[0], text_bins[-1] + 1
+    gutter_x = _find_gutter(x_coverage, text_start, text_end)
+    if gutter_x is None:
+        return None
+    body_bottom = _find_body_bottom(_coverage_histogram(positions[:, 1], positions[:, 3], page_height), page_height)
+
+    first_content_page = 0
+    for page_num in range(total_pages):
+        if _is_two_column_page(_char_positions(pdf.pages[page_num]), gutter_x):
+            first_content_page = page_num
+            break
+
+    text_left, text_right = text_start * BIN_WIDTH, min(text_end * BIN_WIDTH, page_width)
+    left_margin = float(text_left - text_left * MARGIN_PADDING_RATIO)
+    right_margin = float(text_right + (page_width - text_right) * MARGIN_PADDING_RATIO)
+    gutter_x, body_bottom = float(gutter_x), float(body_bottom)
+    return LayoutProfile(
+        left_col_bbox=(left_margin, 0, gutter_x, body_bottom),
+        right_col_bbox=(gutter_x, 0, right_margin, body_bottom),
+        first_content_page=first_content_page
+    )
+
+
+def _layout_key(document):
+    return f"{document}-v{LAYOUT_VERSION}"
+
+
+def load_cached_layout(document, checkpoint_store: CheckpointStore) -> LayoutProfile | None:
+    """Layout profile detected by an earlier run, if any."""
+    cached = checkpoint_store.load_artifact(LAYOUT_ARTIFACT, _layout_key(document))
+    return LayoutProfile.from_dict(cached) if cached is not None else None
+
+
+def detect_and_cache_layout(pdf, document, checkpoint_store: CheckpointStore, fallback: LayoutProfile) -> LayoutProfile:
+    """Detect the layout profile of the document and cache it for later runs."""
+    layout = detect_layout(pdf)
+    if layout is None:
+        log.warning("Could not detect a two-column layout, falling back to the default layout.")
+        layout = fallback
+    log.info(f"Detected layout: {layout}")
+    checkpoint_store.save_artifact(LAYOUT_ARTIFACT, _layout_key(document), layout.to_dict())
+    return layout
@@ -1,4 +1,16 @@
+import atexit
 import logging as log
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+CONSOLE_HANDLER_NAME = "console"
+# Libraries whose debug logs would drown ours, and slow down every page, when running at DEBUG
+QUIET_LOGGERS = ["pdfminer", "pdfplumber", "PIL"]
+# Records of worker processes are formatted here, so their elapsed time counts from the start of this process too
+_STARTED_AT = time.time()
+# Queue and listener through which the workers of every pool of this process log, created with the first pool
+_worker_log_queue = None
+_worker_log_listener = None
 
 
 # Configure the logging system
@@ -8,8 +20,8 @@ class HumanFriendlyFormatter(log.Formatter):
         Override the formatTime method to display elapsed time in a human-readable format:
         X seconds Y millis, or minutes/hours when appropriate.
         """
-        # Get the number of milliseconds since the start of the logging system
-        elapsed_time = record.relativeCreated
+        # Get the number of milliseconds since the start of this process, whichever process the record comes from
+        elapsed_time = (record.created - _STARTED_AT) * 1000
 
         # Calculate hours, minutes, seconds, and milliseconds
         millis = int(elapsed_time % 1000)
@@ -25,15 +37,58 @@ class HumanFriendlyFormatter(log.Formatter):
             return f"{seconds} seconds {millis} millis"
 
 
-def setup_logging(clear_existing_handlers=False):
+def _set_level(level) -> log.Logger:
+    for logger_name in QUIET_LOGGERS:
+        log.getLogger(logger_name).setLevel(max(level, log.INFO))
     logger = log.getLogger()
-    logger.setLevel(log.INFO)
+    logger.setLevel(level)
+    return logger
+
+
+def setup_logging(clear_existing_handlers=False, level=log.INFO):
+    """Log to the console. Calling it again only changes the level, it never adds a second console handler."""
+    logger = _set_level(level)
     if logger.hasHandlers() and clear_existing_handlers:
         logger.handlers.clear()
+    if any(handler.get_name() == CONSOLE_HANDLER_NAME for handler in logger.handlers):
+        return
     console_handler = log.StreamHandler()
+    console_handler.set_name(CONSOLE_HANDLER_NAME)
     console_handler.setFormatter(
         HumanFriendlyFormatter(
             '[Proc ID: %(process)s] %(levelname)s - %(message)s - [Elapsed: %(asctime)s]'
         )
     )
     logger.addHandler(console_handler)
+
+
+class _ParentLoggerHandler:
+    """Hands the records of worker processes to the logger they were logged with, as configured in this process."""
+
+    @staticmethod
+    def handle(record):
+        logger = log.getLogger(record.name)
+        # Logger.handle skips the level and log.disable checks that logging in this process would go through
+        if logger.isEnabledFor(record.levelno):
+            logger.handle(record)
+
+
+def worker_log_queue(mp_context):
+    """
+    Queue for worker processes to send their records to this process, where a single listener thread writes them,
+    so lines of different workers never interleave and workers never wait on a contended stderr.
+    """
+    global _worker_log_queue, _worker_log_listener
+    if _worker_log_queue is None:
+        _worker_log_queue = mp_context.Queue()
+        _worker_log_listener = QueueListener(_worker_log_queue, _ParentLoggerHandler())
+        _worker_log_listener.start()
+        # Flushes the records still in the queue on exit
+        atexit.register(_worker_log_listener.stop)
+    return _worker_log_queue
+
+
+def setup_worker_logging(log_queue, level=log.INFO):
+    """Send every record of this worker process through the queue, replacing any handler it inherited."""
+    logger = _set_level(level)
+    logger.handlers = [QueueHandler(log_queue)]
@@ -1,25 +1,150 @@
+import argparse
 import logging as log
 
 import logging_setup
-from file_operations import save_to_csv
-from model import OutputRow, RawPageData
-from pdf_processing import process_pdf_concurrently
-from text_processing import process_questions_and_answers
+from artifact_writer import ARTIFACTS_JSONL, ARTIFACTS_OFF, open_artifact_writer
+from exporters import EXPORTERS, open_exporter
+from metrics import RUN_METRICS, RUN_REPORT_PATH
+from model import MemoryBudget, OutputRow, RawPageData
+from pdf_processing import DEFAULT_LAYOUT, iter_pages_in_order, process_pdf_concurrently
+from profiling import PARENT_PROFILE, PROFILE_DIR, PROFILE_MODES, RUN_PROFILER
+from text_processing import process_questions_and_answers, stream_questions_and_answers
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate flashcards from a textbook's questions and answers.")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Parse chapters while pages are still being extracted and write rows to the CSV as chapters complete."
+    )
+    parser.add_argument(
+        "--layout",
+        choices=["default", "auto"],
+        default="default",
+        help="Column layout of the book: the hand-tuned default one, or detected from the PDF and cached per document."
+    )
+    parser.add_argument(
+        "--debug-artifacts",
+        choices=[ARTIFACTS_JSONL, ARTIFACTS_OFF],
+        default=ARTIFACTS_JSONL,
+        help="Write the book text and one JSONL file of parsed questions and answers per chapter, or nothing."
+    )
+    parser.add_argument(
+        "--output",
+        default="output_questions_answers.csv",
+        help="Where to save the questions and answers, in the format given by its extension unless --format is set."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Processes extracting pages. By default, one per available CPU as long as their memory fits."
+    )
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=1,
+        help="Processes parsing chapters in parallel after extraction, in batch mode. 1 parses them in this process."
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only parse the chapters whose text or pages changed since the last incremental run, in batch mode."
+    )
+    parser.add_argument(
+        "--skip-non-question-pages",
+        action="store_true",
+        help="Classify pages from their raw text first and skip extracting figure and introduction pages."
+    )
+    parser.add_argument(
+        "--bounded-memory",
+        action="store_true",
+        help="Keep memory flat on very large books: recycle workers, keep pages on disk until they are parsed and "
+             "parse them chapter by chapter like --stream. Not with --incremental or --parse-workers, which parse the "
+             "whole book at once."
+    )
+    parser.add_argument(
+        "--max-worker-rss-mb",
+        type=float,
+        default=MemoryBudget.max_worker_rss_mb,
+        help="With --bounded-memory, workers above this RSS reopen the PDF before their next page."
+    )
+    parser.add_argument(
+        "--pages-per-worker",
+        type=int,
+        default=MemoryBudget.pages_per_worker,
+        help="With --bounded-memory, each worker is replaced by a fresh process after about this many pages."
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Also log every page, instead of one line per batch of pages."
+    )
+    parser.add_argument(
+        "--run-report",
+        default=RUN_REPORT_PATH,
+        help="Where to save the JSON report of stage timings, throughput, worker idle time and checkpoint hit rate."
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILE_MODES,
+        help="Profile the workers and this process with cProfile, or sample their stacks at a low overhead, and merge "
+             "the profiles into one report along with the slowest pages."
+    )
+    parser.add_argument("--profile-dir", default=PROFILE_DIR, help="Where to save the profiles and their report.")
+    parser.add_argument("--format", choices=sorted(EXPORTERS), help="Output format: csv, jsonl, parquet or anki.")
+    args = parser.parse_args()
+    # Both hold the text of every chapter in memory at once, which --bounded-memory is there to avoid
+    if args.bounded_memory and (args.incremental or args.parse_workers > 1):
+        parser.error("--bounded-memory parses the book chapter by chapter, without --incremental or --parse-workers")
+    return args
 
-MAX_PARALLELISM = 10
 
 if __name__ == "__main__":
-    logging_setup.setup_logging()
+    args = parse_args()
+    logging_setup.setup_logging(level=log.DEBUG if args.verbose else log.INFO)
 
     # Path to your PDF
     pdf_path = "anatomy.pdf"
-    # Path to save the CSV
-    output_csv_path = "output_questions_answers.csv"
+    layout = DEFAULT_LAYOUT if args.layout == "default" else None
+    memory_budget = (
+        MemoryBudget(pages_per_worker=args.pages_per_worker, max_worker_rss_mb=args.max_worker_rss_mb)
+        if args.bounded_memory
+        else None
+    )
+
+    if args.profile:
+        RUN_PROFILER.enable(args.profile, args.profile_dir)
+
+    with RUN_PROFILER.profile(PARENT_PROFILE), open_artifact_writer(args.debug_artifacts) as artifact_writer:
+        if args.stream or memory_budget is not None:
+            # Extract, parse and save chapter by chapter, as soon as each chapter's pages are available. With a memory
+            # budget, this keeps the parent from holding the lines, text and chapters of the whole book
+            log.info("Starting streaming PDF processing...")
+            with open_exporter(args.output, args.format) as exporter:
+                page_datas = iter_pages_in_order(
+                    pdf_path,
+                    args.workers,
+                    layout=layout,
+                    memory_budget=memory_budget,
+                    skip_non_question_pages=args.skip_non_question_pages
+                )
+                for chapter_rows in stream_questions_and_answers(page_datas, artifact_writer):
+                    exporter.write_rows(chapter_rows)
+        else:
+            # Step 1: Extract columns from pages concurrently
+            log.info("Starting PDF processing...")
+            page_datas: list[RawPageData] = process_pdf_concurrently(
+                pdf_path, args.workers, layout, skip_non_question_pages=args.skip_non_question_pages
+            )
+            output_rows: list[OutputRow] = process_questions_and_answers(
+                page_datas,
+                artifact_writer,
+                parse_workers=args.parse_workers,
+                incremental_key=pdf_path if args.incremental else None
+            )
 
-    # Step 1: Extract columns from pages concurrently
-    log.info("Starting PDF processing...")
-    page_datas: list[RawPageData] = process_pdf_concurrently(pdf_path, MAX_PARALLELISM)
-    output_rows: list[OutputRow] = process_questions_and_answers(page_datas)
+            # Step 2: Save the data
+            with open_exporter(args.output, args.format) as exporter:
+                exporter.write_rows(output_rows)
 
-    # Step 2: Save the data to CSV
-    save_to_csv(output_rows, output_csv_path)
+    RUN_METRICS.write_report(args.run_report)
+    RUN_PROFILER.write_report(RUN_METRICS)
@@ -0,0 +1,146 @@
+"""
+Timings and counters of a run, gathered cheaply enough to always be on and saved as a JSON run report at the end.
+Stages are timed with spans, which only cost two perf_counter calls each, so they wrap whole steps or single pages
+but never single lines. Spans of different stages may nest, planning includes opening the PDF for example, so stage
+times don't add up to the wall time. Workers time their batches with their own RunMetrics and send it back with
+their results. Threads of the same process, such as the jobs of the extraction service, may share one RunMetrics.
+"""
+import json
+import logging as log
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+RUN_REPORT_PATH = "run_report.json"
+
+PLANNING_STAGE = "planning"
+PDF_OPEN_STAGE = "pdf_open"
+PAGE_DIGEST_STAGE = "page_digest"
+COLUMN_EXTRACTION_STAGE = "column_extraction"
+CHECKPOINT_IO_STAGE = "checkpoint_io"
+SANITIZATION_STAGE = "sanitization"
+SEGMENTATION_STAGE = "segmentation"
+PARSING_STAGE = "parsing"
+OUTPUT_WRITING_STAGE = "output_writing"
+
+PAGES_COUNTER = "pages"
+ROWS_COUNTER = "rows"
+CHECKPOINT_HITS_COUNTER = "checkpoint_hits"
+CHECKPOINT_MISSES_COUNTER = "checkpoint_misses"
+SKIPPED_PAGES_COUNTER = "skipped_pages"
+
+
+class RunMetrics:
+    def __init__(self):
+        self.started_at = time.time()
+        self.stage_seconds = defaultdict(float)
+        self.stage_calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        # Extraction time of every page that went through a worker by PDF, digest and checkpoint lookups included
+        self.page_seconds: dict[str, dict[int, float]] = defaultdict(dict)
+        self.scheduler: dict | None = None
+        self.pool: dict | None = None
+        self.books: list[dict] | None = None
+        # Re-entrant, merging a snapshot adds spans and counts under the same lock
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(stage, time.perf_counter() - started)
+
+    def add_span(self, stage, seconds, calls=1):
+        with self._lock:
+            self.stage_seconds[stage] += seconds
+            self.stage_calls[stage] += calls
+
+    def count(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def snapshot(self) -> dict:
+        """Everything gathered so far, in a form that is cheap to send back from a worker and merge."""
+        with self._lock:
+            return {
+                "stage_seconds": dict(self.stage_seconds),
+                "stage_calls": dict(self.stage_calls),
+                "counters": dict(self.counters),
+                "page_seconds": {pdf_path: dict(seconds) for pdf_path, seconds in self.page_seconds.items()}
+            }
+
+    def merge(self, snapshot: dict):
+        with self._lock:
+            for stage, seconds in snapshot["stage_seconds"].items():
+                self.add_span(stage, seconds, snapshot["stage_calls"][stage])
+            for counter, amount in snapshot["counters"].items():
+                self.count(counter, amount)
+            for pdf_path, seconds_by_page_num in snapshot["page_seconds"].items():
+                self.page_seconds[pdf_path].update(seconds_by_page_num)
+
+    def record_scheduler(self, scheduler_stats):
+        """Busy and idle time of the extraction workers, from the SchedulerStats of the run."""
+        with self._lock:
+            self.scheduler = scheduler_stats.to_dict()
+
+    def record_pool_sizing(self, pool_sizing):
+        """Workers chosen for the extraction pool and the resources they were chosen from, from its PoolSizing."""
+        with self._lock:
+            self.pool = pool_sizing.to_dict()
+
+    def record_books(self, books: list[dict]):
+        """Timings of every book of a batch run, such as how idle the workers were while the book was parsed."""
+        with self._lock:
+            self.books = books
+
+    def report(self) -> dict:
+        with self._lock:
+            return self._report()
+
+    def _report(self) -> dict:
+        wall_seconds = time.time() - self.started_at
+        checkpoint_lookups = self.counters[CHECKPOINT_HITS_COUNTER] + self.counters[CHECKPOINT_MISSES_COUNTER]
+        page_seconds = sorted(
+            seconds for seconds_by_page_num in self.page_seconds.values() for seconds in seconds_by_page_num.values()
+        )
+        return {
+            "started_at": self.started_at,
+            "wall_seconds": wall_seconds,
+            "stages": {
+                stage: {"seconds": seconds, "calls": self.stage_calls[stage]}
+                for stage, seconds in sorted(self.stage_seconds.items())
+            },
+            "counters": dict(sorted(self.counters.items())),
+            "throughput": {
+                "pages_per_second": self.counters[PAGES_COUNTER] / wall_seconds if wall_seconds else 0.0,
+                "rows_per_second": self.counters[ROWS_COUNTER] / wall_seconds if wall_seconds else 0.0
+            },
+            "checkpoint_hit_rate": (
+                self.counters[CHECKPOINT_HITS_COUNTER] / checkpoint_lookups if checkpoint_lookups else None
+            ),
+            "page_extraction_seconds": {
+                "p50": page_seconds[len(page_seconds) // 2] if page_seconds else None,
+                "p95": page_seconds[int(len(page_seconds) * 0.95)] if page_seconds else None,
+                "max": page_seconds[-1] if page_seconds else None,
+                "by_page": {
+                    pdf_path: {str(page_num): seconds for page_num, seconds in sorted(seconds_by_page_num.items())}
+                    for pdf_path, seconds_by_page_num in self.page_seconds.items()
+                }
+            },
+            "pool": self.pool,
+            "scheduler": self.scheduler,
+            "books": self.books
+        }
+
+    def write_report(self, report_path=RUN_REPORT_PATH):
+        with open(report_path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        log.info(f"Run report saved at {report_path}")
+
+
+# Metrics of the current process, like the root logger there is one per run
+RUN_METRICS = RunMetrics()
+
@@ -1,4 +1,8 @@
-from dataclasses import dataclass
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from itertools import repeat
+from typing import Iterator
 
 CHAPTER_NUMBER_COL = 'chapter'
 PAGE_NUMBER_COL = 'page'
@@ -16,10 +20,189 @@ class RawPageData:
     right_col: str
 
 
+@dataclass
+class LayoutProfile:
+    left_col_bbox: tuple[float, float, float, float]
+    right_col_bbox: tuple[float, float, float, float]
+    first_content_page: int
+
+    def to_dict(self):
+        return {
+            'left_col_bbox': list(self.left_col_bbox),
+            'right_col_bbox': list(self.right_col_bbox),
+            'first_content_page': self.first_content_page
+        }
+
+    @staticmethod
+    def from_dict(data):
+        return LayoutProfile(
+            left_col_bbox=tuple(data['left_col_bbox']),
+            right_col_bbox=tuple(data['right_col_bbox']),
+            first_content_page=data['first_content_page']
+        )
+
+
+@dataclass
+class ExtractionPlan:
+    pdf_path: str
+    document: str
+    layout: LayoutProfile
+    total_pages: int
+    # Content pages of the book, in page order
+    page_nums: list[int]
+    # Pages whose columns are already in the checkpoint store, with their checkpoint key
+    checkpoint_key_by_page_num: dict[int, str]
+    # Batches of the other pages, to hand out to the workers
+    batches: list[list[int]]
+    # Pages that cannot yield rows, handed over as empty pages instead of being extracted
+    skipped_page_nums: set[int] = field(default_factory=set)
+
+
+@dataclass
+class PageOutline:
+    """What a page's raw text says about it, read from its content stream without laying out its chars."""
+    # False when some text of the page cannot be decoded, or may be drawn by a form XObject
+    readable: bool
+    text_line_count: int
+    has_introduction: bool
+    has_questions: bool
+    has_answers: bool
+    # Some text line starts with a number, like question and answer lines do
+    has_numbered_lines: bool
+    # Some text line ends with a hyphen, so it may be joined with a line of the next page
+    has_hyphenated_lines: bool
+
+    def to_dict(self):
+        return {
+            'readable': self.readable,
+            'text_line_count': self.text_line_count,
+            'has_introduction': self.has_introduction,
+            'has_questions': self.has_questions,
+            'has_answers': self.has_answers,
+            'has_numbered_lines': self.has_numbered_lines,
+            'has_hyphenated_lines': self.has_hyphenated_lines
+        }
+
+    @staticmethod
+    def from_dict(data):
+        return PageOutline(
+            readable=data['readable'],
+            text_line_count=data['text_line_count'],
+            has_introduction=data['has_introduction'],
+            has_questions=data['has_questions'],
+            has_answers=data['has_answers'],
+            has_numbered_lines=data['has_numbered_lines'],
+            has_hyphenated_lines=data['has_hyphenated_lines']
+        )
+
+
 @dataclass
 class BookData:
-    lines: list[str]
-    page_number_by_line_idx: dict[int, int]
+    """
+    Lines of the book and the page each one starts on. Pages are stored as runs of consecutive lines, run i starting
+    at line page_start_line_idxs[i] on page page_numbers[i], so the mapping takes two ints per page instead of a
+    dict entry per line.
+    """
+    lines: list[str] = field(default_factory=list)
+    page_numbers: array = field(default_factory=lambda: array('q'))
+    page_start_line_idxs: array = field(default_factory=lambda: array('q'))
+
+    def append_line(self, line, page_number):
+        if not self.page_numbers or self.page_numbers[-1] != page_number:
+            self.page_numbers.append(page_number)
+            self.page_start_line_idxs.append(len(self.lines))
+        self.lines.append(line)
+
+    def page_number_of_line(self, line_idx) -> int:
+        return self.page_numbers[bisect_right(self.page_start_line_idxs, line_idx) - 1]
+
+    def page_numbers_of_lines(self, start_line, end_line) -> Iterator[int]:
+        """Page number of each line in [start_line, end_line), one run at a time."""
+        run_idx = bisect_right(self.page_start_line_idxs, start_line) - 1
+        while start_line < end_line:
+            next_run_idx = run_idx + 1
+            run_end_line = (
+                self.page_start_line_idxs[next_run_idx] if next_run_idx < len(self.page_start_line_idxs) else end_line
+            )
+            run_end_line = min(run_end_line, end_line)
+            yield from repeat(self.page_numbers[run_idx], run_end_line - start_line)
+            start_line, run_idx = run_end_line, next_run_idx
+
+
+@dataclass
+class SectionIndex:
+    chapter_count: int
+    # (chapter, QUESTIONS or ANSWERS, start_line, end_line) ranges of book lines in book order
+    spans: list[tuple[int, str, int, int]]
+    # Lines that belong to a section only up to the INTRODUCTION marker they contain
+    truncated_lines: dict[int, str]
+
+    def to_dict(self):
+        return {
+            'chapter_count': self.chapter_count,
+            'spans': [list(span) for span in self.spans],
+            'truncated_lines': {str(line_idx): line for line_idx, line in self.truncated_lines.items()}
+        }
+
+    @staticmethod
+    def from_dict(data):
+        return SectionIndex(
+            chapter_count=data['chapter_count'],
+            spans=[tuple(span) for span in data['spans']],
+            truncated_lines={int(line_idx): line for line_idx, line in data['truncated_lines'].items()}
+        )
+
+
+@dataclass
+class ChapterLines:
+    chapter: int
+    question_lines: list[tuple[str, int]]
+    answer_lines: list[tuple[str, int]]
+
+
+@dataclass
+class ChapterManifestEntry:
+    chapter: int
+    first_page: int | None
+    last_page: int | None
+    # Digest of everything the chapter's rows are parsed from: its lines, their pages and the parser version
+    input_digest: str
+
+    def to_dict(self):
+        return {
+            'chapter': self.chapter,
+            'first_page': self.first_page,
+            'last_page': self.last_page,
+            'input_digest': self.input_digest
+        }
+
+    @staticmethod
+    def from_dict(data):
+        return ChapterManifestEntry(
+            chapter=data['chapter'],
+            first_page=data['first_page'],
+            last_page=data['last_page'],
+            input_digest=data['input_digest']
+        )
+
+
+@dataclass
+class BookManifest:
+    book_text_digest: str
+    chapters: list[ChapterManifestEntry]
+
+    def to_dict(self):
+        return {
+            'book_text_digest': self.book_text_digest,
+            'chapters': [chapter.to_dict() for chapter in self.chapters]
+        }
+
+    @staticmethod
+    def from_dict(data):
+        return BookManifest(
+            book_text_digest=data['book_text_digest'],
+            chapters=[ChapterManifestEntry.from_dict(chapter) for chapter in data['chapters']]
+        )
 
 
 @dataclass
@@ -89,3 +272,62 @@ class OutputRow:
             ANSWER_LETTER_COL: self.answer_letter,
             ANSWER_COL: self.answer
         }
+
+    @staticmethod
+    def from_dict(data):
+        return OutputRow(
+            chapter=data[CHAPTER_NUMBER_COL],
+            page_number=data[PAGE_NUMBER_COL],
+            question_number=data[QUESTION_NUMBER_COL],
+            question=data[QUESTION_COL],
+            question_options=data[QUESTION_OPTIONS_COL],
+            answer_letter=data[ANSWER_LETTER_COL],
+            answer=data[ANSWER_COL]
+        )
+
+
+@dataclass
+class PageBatchResult:
+    worker_pid: int
+    started_at: float
+    finished_at: float
+    pages: list[RawPageData]
+    # Checkpoint keys of the pages, when they were left in the checkpoint store instead of being sent back
+    spooled_page_keys: dict[int, str] = field(default_factory=dict)
+    worker_rss_mb: float = 0.0
+    # RunMetrics snapshot of the batch, merged into the metrics of the run
+    metrics: dict = field(default_factory=dict)
+
+
+@dataclass
+class MemoryBudget:
+    """Limits that keep the memory of an extraction flat, however many pages the book has."""
+    # Workers are replaced by fresh processes after extracting about this many pages
+    pages_per_worker: int = 200
+    # A worker above this resident set size drops the parsed document and reopens the PDF before its next page
+    max_worker_rss_mb: float = 1024
+
+
+@dataclass
+class PoolSizing:
+    """How many extraction workers a run uses, and the resources of the machine they were chosen from."""
+    workers: int
+    available_cpus: int
+    # None where the available memory cannot be read
+    available_memory_mb: float | None
+    # Memory each worker is expected to need at most
+    worker_memory_mb: float
+    # Above this RSS, a worker takes more than its share of the memory and the scheduler queues fewer batches
+    worker_rss_limit_mb: float | None
+    # What capped the number of workers: requested, cpus, memory or batches
+    limited_by: str
+
+    def to_dict(self):
+        return {
+            'workers': self.workers,
+            'available_cpus': self.available_cpus,
+            'available_memory_mb': self.available_memory_mb,
+            'worker_memory_mb': self.worker_memory_mb,
+            'worker_rss_limit_mb': self.worker_rss_limit_mb,
+            'limited_by': self.limited_by
+        }
@@ -0,0 +1,253 @@
+"""
+Cheap pre-pass over the pages of a book, telling which ones can yield rows before any of them is laid out. The raw
+text of a page is read straight from its content stream, which takes a few milliseconds, while laying out its chars
+for the column extraction takes a couple of hundred.
+"""
+import logging as log
+import re
+from collections import Counter
+
+from checkpoint_store import CheckpointStore
+from model import PageOutline
+from text_processing import ANSWERS, INTRODUCTION, QUESTIONS
+
+# Bump whenever a change to the outlines would describe the same page differently
+PAGE_OUTLINE_VERSION = 2
+PAGE_OUTLINES_ARTIFACT = "page_outlines"
+
+INTRO_PAGE = "intro"
+QUESTION_PAGE = "question"
+ANSWER_PAGE = "answer"
+FIGURE_PAGE = "figure"
+BACK_MATTER_PAGE = "back_matter"
+# Unreadable pages, and pages whose section depends on the order of their markers
+UNKNOWN_PAGE = "unknown"
+
+_NUMBERED_LINE_PATTERN = re.compile(r"\s*\d+\s")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+# Operators showing text, the string being their last operand
+_SHOW_TEXT_OPERATORS = {"Tj", "'", '"'}
+
+
+def _decode_text(font, data: bytes) -> str:
+    """Text of a string drawn with the font, like pdfminer decodes it for the chars of the page."""
+    from pdfminer.pdffont import PDFUnicodeNotDefined
+
+    chars = []
+    for cid in font.decode(data):
+        try:
+            chars.append(font.to_unichr(cid))
+        except PDFUnicodeNotDefined:
+            chars.append(f"(cid:{cid})")
+    return "".join(chars)
+
+
+def _has_form_xobjects(resources) -> bool:
+    """Form XObjects draw text of their own, which is not in the page's content stream."""
+    from pdfminer.pdfinterp import LITERAL_FORM
+    from pdfminer.pdftypes import dict_value, resolve1
+
+    xobjects = dict_value(resources.get("XObject", {}))
+    return any(resolve1(xobject).get("Subtype") is LITERAL_FORM for xobject in xobjects.values())
+
+
+def page_text_lines(page, resource_manager) -> list[str] | None:
+    """
+    Text of every text-showing operation of the page, in content stream order, which is usually one line of text each.
+    None if some of the text cannot be read without interpreting the page.
+    """
+    from pdfminer.pdfinterp import PDFContentParser
+    from pdfminer.psparser import keyword_name, PSEOF, PSKeyword
+    from pdfminer.pdftypes import dict_value, resolve1
+
+    resources = dict_value(resolve1(page.page_obj.resources) or {})
+    if _has_form_xobjects(resources):
+        return None
+    font_specs = dict_value(resources.get("Font", {}))
+    fonts = {}
+    font = None
+    text_lines = []
+    operands = []
+    parser = PDFContentParser(page.page_obj.contents)
+    while True:
+        try:
+            _, token = parser.nextobject()
+        except PSEOF:
+            break
+        if not isinstance(token, PSKeyword):
+            operands.append(token)
+            continue
+        operator = keyword_name(token)
+        if operator == "Tf" and len(operands) == 2:
+            font_name = getattr(operands[0], "name", operands[0])
+            if font_name not in fonts:
+                try:
+                    fonts[font_name] = resource_manager.get_font(None, dict_value(font_specs[font_name]))
+                except Exception:  # Missing or broken font, the page has to be interpreted properly
+                    return None
+            font = fonts[font_name]
+        elif operator in _SHOW_TEXT_OPERATORS or operator == "TJ":
+            if font is None or not operands:
+                return None
+            strings = operands[-1] if operator == "TJ" else [operands[-1]]
+            text_lines.append("".join(_decode_text(font, string) for string in strings if isinstance(string, bytes)))
+        operands = []
+    return text_lines
+
+
+def outline_page(page, resource_manager) -> PageOutline:
+    text_lines = page_text_lines(page, resource_manager)
+    if text_lines is None:
+        return PageOutline(
+            readable=False,
+            text_line_count=0,
+            has_introduction=False,
+            has_questions=False,
+            has_answers=False,
+            has_numbered_lines=False,
+            has_hyphenated_lines=False
+        )
+    text = "\n".join(text_lines)
+    # A line of the page may be drawn by several operators, and a marker split between them is still a marker for the
+    # parser, so are markers split by hyphenation, which the parser joins back. Searching the text without the breaks
+    # between operators, without hyphenation or without any whitespace errs toward finding QUESTIONS and ANSWERS,
+    # which only ever makes fewer pages skippable.
+    texts = (text, "".join(text_lines), text.replace("-\n", ""), _WHITESPACE_PATTERN.sub("", text))
+    return PageOutline(
+        readable=True,
+        text_line_count=len(text_lines),
+        # Only matched as drawn, an introduction found where the parser sees none would make question pages skippable
+        has_introduction=INTRODUCTION in text,
+        has_questions=any(QUESTIONS in marker_text for marker_text in texts),
+        has_answers=any(ANSWERS in marker_text for marker_text in texts),
+        has_numbered_lines=any(_NUMBERED_LINE_PATTERN.match(line) for line in text_lines),
+        has_hyphenated_lines=any(line.rstrip().endswith("-") for line in text_lines)
+    )
+
+
+def _page_outlines_key(document):
+    return f"{document}-v{PAGE_OUTLINE_VERSION}"
+
+
+def load_cached_page_outlines(document, checkpoint_store: CheckpointStore) -> dict[int, PageOutline] | None:
+    """Outlines of every page of the document from an earlier run, if any."""
+    cached = checkpoint_store.load_artifact(PAGE_OUTLINES_ARTIFACT, _page_outlines_key(document))
+    if cached is None:
+        return None
+    return {int(page_num): PageOutline.from_dict(outline) for page_num, outline in cached.items()}
+
+
+def outline_and_cache_pages(pdf, document, checkpoint_store: CheckpointStore) -> dict[int, PageOutline]:
+    """Outline every page of the document and cache the outlines for later runs."""
+    from pdfminer.pdfinterp import PDFResourceManager
+
+    log.info(f"Outlining the raw text of {len(pdf.pages)} pages...")
+    resource_manager = PDFResourceManager(caching=True)
+    outline_by_page_num = {}
+    for page_num, page in enumerate(pdf.pages):
+        outline_by_page_num[page_num] = outline_page(page, resource_manager)
+        page.close()
+    checkpoint_store.save_artifact(
+        PAGE_OUTLINES_ARTIFACT,
+        _page_outlines_key(document),
+        {str(page_num): outline.to_dict() for page_num, outline in outline_by_page_num.items()}
+    )
+    return outline_by_page_num
+
+
+def classify_pages(page_nums: list[int], outline_by_page_num: dict[int, PageOutline]) -> dict[int, str]:
+    """
+    Class of every content page, following the section markers through the pages the way ChapterSegmenter follows
+    them through the lines. A page is an intro page when all of it is inside an introduction, otherwise it gets the
+    class of the section it ends in, or the one it starts in if it ends in an introduction. Only the markers on a page
+    are known, not their order, so a page with markers whose order matters is unknown and so is what follows it, until
+    the next marker that settles the section.
+    """
+    class_by_page_num = {}
+    section = QUESTION_PAGE  # The book starts in the questions of the first chapter
+    for page_num in page_nums:
+        outline = outline_by_page_num[page_num]
+        if not outline.readable:
+            page_class = section = UNKNOWN_PAGE
+        elif not outline.text_line_count:
+            page_class = FIGURE_PAGE
+        elif outline.has_questions:
+            # Only QUESTIONS ends an introduction, and it ends an answers section as well
+            if outline.has_answers or outline.has_introduction:
+                page_class, section = QUESTION_PAGE, UNKNOWN_PAGE
+            else:
+                page_class = section = QUESTION_PAGE
+        elif section == INTRO_PAGE:
+            # Every other marker is ignored inside an introduction
+            page_class = INTRO_PAGE
+        elif outline.has_introduction:
+            # Whatever precedes the introduction belongs to the section it interrupts
+            page_class = ANSWER_PAGE if outline.has_answers else section
+            section = INTRO_PAGE
+        elif outline.has_answers:
+            page_class = section = ANSWER_PAGE
+        else:
+            page_class = section
+        class_by_page_num[page_num] = page_class
+
+    # The answers of the last chapter run to the end of the book, the pages after its last answer are back matter
+    for page_num in reversed(page_nums):
+        outline = outline_by_page_num[page_num]
+        if class_by_page_num[page_num] == FIGURE_PAGE:
+            continue
+        if class_by_page_num[page_num] != ANSWER_PAGE or outline.has_numbered_lines or outline.has_answers:
+            break
+        class_by_page_num[page_num] = BACK_MATTER_PAGE
+    return class_by_page_num
+
+
+def skippable_pages(
+        page_nums: list[int],
+        class_by_page_num: dict[int, str],
+        outline_by_page_num: dict[int, PageOutline]
+) -> set[int]:
+    """
+    Pages whose extraction can be replaced by an empty page without changing any row. Figure pages have no text to
+    extract at all. Intro pages only hold lines that are thrown away, as long as none of them can be joined with a line
+    of a neighbouring page by hyphenation, and as long as the QUESTIONS marker ending their introduction was found: an
+    introduction that never ends on a known page may be a marker that was missed. Back matter is still extracted, it is
+    part of the last answer for the parser.
+    """
+    # Whether the introduction each intro page belongs to ends on a page where QUESTIONS was found
+    closed_intro_page_nums = set()
+    closed = False
+    for page_num in reversed(page_nums):
+        page_class = class_by_page_num[page_num]
+        if page_class == INTRO_PAGE:
+            if closed:
+                closed_intro_page_nums.add(page_num)
+        elif page_class != FIGURE_PAGE:
+            closed = outline_by_page_num[page_num].has_questions
+
+    skipped = set()
+    previous_page_num = None
+    for page_num in page_nums:
+        outline = outline_by_page_num[page_num]
+        page_class = class_by_page_num[page_num]
+        previous_may_join = (
+            previous_page_num is not None
+            and previous_page_num not in skipped
+            and outline_by_page_num[previous_page_num].has_hyphenated_lines
+        )
+        if page_class == FIGURE_PAGE:
+            skipped.add(page_num)
+        elif (
+                page_class == INTRO_PAGE
+                and page_num in closed_intro_page_nums
+                and not outline.has_hyphenated_lines
+                and not previous_may_join
+        ):
+            skipped.add(page_num)
+        previous_page_num = page_num
+    return skipped
+
+
+def log_page_classes(class_by_page_num: dict[int, str], skipped_page_nums: set[int]):
+    class_counts = Counter(class_by_page_num.values())
+    classes_summary = ", ".join(f"{count} {page_class}" for page_class, count in sorted(class_counts.items()))
+    log.info(f"Page classes: {classes_summary}. Skipping the extraction of {len(skipped_page_nums)} pages.")
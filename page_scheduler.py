@@ -0,0 +1,242 @@
+import logging as log
+import math
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
+
+from model import PageBatchResult, RawPageData
+
+PAGE_BATCH_SIZE = 4
+# Batches in flight are kept between one and this many per worker while the pool is not short of memory
+MAX_IN_FLIGHT_PER_WORKER = 4
+# Each worker gets enough batches queued up to stay busy this long, covering the round trip of its next result
+TARGET_QUEUED_SECONDS = 0.5
+# Weight of the latest batch in the moving average of the page latency
+LATENCY_SMOOTHING = 0.3
+# Above this share of their RSS limit, workers get no batches queued up beyond the one they work on
+RSS_PRESSURE_SHARE = 0.8
+
+
+def batch_pages(page_nums: list[int], batch_size: int = PAGE_BATCH_SIZE) -> list[list[int]]:
+    """Split the pages to extract into small batches that are handed out to workers one at a time."""
+    return [page_nums[i:i + batch_size] for i in range(0, len(page_nums), batch_size)]
+
+
+@dataclass
+class SchedulerStats:
+    num_workers: int
+    started_at: float = 0.0
+    finished_at: float = 0.0
+    batches_completed: int = 0
+    pages_completed: int = 0
+    busy_seconds_by_worker: dict[int, float] = field(default_factory=dict)
+    peak_worker_rss_mb: float = 0.0
+    # Every change of the number of batches in flight, with what caused it
+    in_flight_changes: list[dict] = field(default_factory=list)
+    # (started_at, finished_at) of every batch, to tell how busy the workers were during part of the run
+    busy_intervals: list[tuple[float, float]] = field(default_factory=list)
+
+    def record(self, result: PageBatchResult):
+        self.batches_completed += 1
+        self.pages_completed += len(result.pages) + len(result.spooled_page_keys)
+        self.peak_worker_rss_mb = max(self.peak_worker_rss_mb, result.worker_rss_mb)
+        busy_seconds = result.finished_at - result.started_at
+        self.busy_intervals.append((result.started_at, result.finished_at))
+        self.busy_seconds_by_worker[result.worker_pid] = (
+            self.busy_seconds_by_worker.get(result.worker_pid, 0.0) + busy_seconds
+        )
+
+    def wall_seconds(self) -> float:
+        return max(self.finished_at - self.started_at, 0.0)
+
+    def idle_seconds(self) -> float:
+        """Total time workers spent without a batch to work on while the pool was running."""
+        total_worker_seconds = self.wall_seconds() * self.num_workers
+        return max(total_worker_seconds - sum(self.busy_seconds_by_worker.values()), 0.0)
+
+    def idle_ratio(self) -> float:
+        total_worker_seconds = self.wall_seconds() * self.num_workers
+        return self.idle_seconds() / total_worker_seconds if total_worker_seconds else 0.0
+
+    def idle_ratio_between(self, started_at, finished_at) -> float | None:
+        """
+        Share of worker time spent idle between the two times, clipped to when the pool was running. None if the pool
+        was not running at all then.
+        """
+        started_at, finished_at = max(started_at, self.started_at), min(finished_at, self.finished_at)
+        total_worker_seconds = (finished_at - started_at) * self.num_workers
+        if total_worker_seconds <= 0:
+            return None
+        busy_seconds = sum(
+            max(min(batch_finished_at, finished_at) - max(batch_started_at, started_at), 0.0)
+            for batch_started_at, batch_finished_at in self.busy_intervals
+        )
+        return max(total_worker_seconds - busy_seconds, 0.0) / total_worker_seconds
+
+    def to_dict(self):
+        wall_seconds = self.wall_seconds()
+        return {
+            'num_workers': self.num_workers,
+            'wall_seconds': wall_seconds,
+            'batches_completed': self.batches_completed,
+            'pages_completed': self.pages_completed,
+            'idle_seconds': self.idle_seconds(),
+            'idle_ratio': self.idle_ratio(),
+            'peak_worker_rss_mb': self.peak_worker_rss_mb,
+            'in_flight_changes': self.in_flight_changes,
+            'workers': {
+                str(worker_pid): {'busy_seconds': busy_seconds, 'idle_seconds': max(wall_seconds - busy_seconds, 0.0)}
+                for worker_pid, busy_seconds in sorted(self.busy_seconds_by_worker.items())
+            }
+        }
+
+    def log_summary(self):
+        log.info(
+            f"Scheduler finished {self.batches_completed} batches ({self.pages_completed} pages) "
+            f"in {self.wall_seconds():.2f}s with {self.num_workers} workers. "
+            f"Worker idle time: {self.idle_seconds():.2f}s ({self.idle_ratio():.1%} of worker time). "
+            f"Peak worker memory: {self.peak_worker_rss_mb:.0f} MiB. "
+            f"Batches in flight changed {len(self.in_flight_changes)} times."
+        )
+        for worker_pid, busy_seconds in sorted(self.busy_seconds_by_worker.items()):
+            log.info(f"Worker {worker_pid} was busy for {busy_seconds:.2f}s")
+
+
+class PageScheduler:
+    """
+    Hands out small batches of pages to a process pool on demand. Only a bounded number of batches are in flight
+    at any time, so a worker that frees up picks up the next batch instead of idling while a slower worker finishes
+    a large, fixed page range.
+    Unless `max_in_flight` is given, the number of batches in flight follows the workers: more of them are queued up
+    when pages are quick to extract, and fewer when workers grow close to `worker_rss_limit_mb`.
+    """
+
+    def __init__(self, executor, num_workers: int, max_in_flight: int = None, worker_rss_limit_mb: float = None):
+        self.executor = executor
+        self.num_workers = num_workers
+        self.adaptive = max_in_flight is None
+        # One extra batch per worker keeps the pool's queue primed without front-loading all the work
+        self.max_in_flight = max_in_flight or num_workers * 2
+        self.worker_rss_limit_mb = worker_rss_limit_mb
+        # Moving average of the extraction time of a page, None until a batch with pages completes
+        self.page_seconds: float | None = None
+        # RSS of the workers behind the latest results, recycled workers drop out of it as new results come in
+        self._recent_worker_rss_mb = deque(maxlen=num_workers)
+        self.stats = SchedulerStats(num_workers=num_workers)
+
+    def _in_flight_target(self) -> tuple[int, str]:
+        """Batches to keep in flight given the latest results, and why."""
+        worker_rss_mb = max(self._recent_worker_rss_mb, default=0.0)
+        if self.worker_rss_limit_mb is not None and worker_rss_mb > self.worker_rss_limit_mb:
+            # Leave some workers without a batch until their memory goes back down
+            return (
+                max(self.num_workers // 2, 1),
+                f"a worker is at {worker_rss_mb:.0f} MiB, above its {self.worker_rss_limit_mb:.0f} MiB"
+            )
+        if self.worker_rss_limit_mb is not None and worker_rss_mb > self.worker_rss_limit_mb * RSS_PRESSURE_SHARE:
+            return (
+                self.num_workers,
+                f"a worker is at {worker_rss_mb:.0f} MiB, close to its {self.worker_rss_limit_mb:.0f} MiB"
+            )
+        batch_seconds = self.page_seconds * PAGE_BATCH_SIZE
+        queued_per_worker = math.ceil(TARGET_QUEUED_SECONDS / batch_seconds) if batch_seconds else math.inf
+        queued_per_worker = min(max(queued_per_worker, 1), MAX_IN_FLIGHT_PER_WORKER - 1)
+        return self.num_workers * (1 + queued_per_worker), f"pages take {self.page_seconds * 1000:.0f} ms"
+
+    def _adapt_in_flight(self, result: PageBatchResult):
+        page_count = len(result.pages) + len(result.spooled_page_keys)
+        if page_count:
+            page_seconds = (result.finished_at - result.started_at) / page_count
+            self.page_seconds = (
+                page_seconds if self.page_seconds is None
+                else LATENCY_SMOOTHING * page_seconds + (1 - LATENCY_SMOOTHING) * self.page_seconds
+            )
+        self._recent_worker_rss_mb.append(result.worker_rss_mb)
+        if not self.adaptive or self.page_seconds is None:
+            return
+        max_in_flight, reason = self._in_flight_target()
+        if max_in_flight != self.max_in_flight:
+            log.info(f"Keeping {max_in_flight} batches in flight instead of {self.max_in_flight}, {reason}")
+            self.stats.in_flight_changes.append({
+                'batches_completed': self.stats.batches_completed,
+                'max_in_flight': max_in_flight,
+                'reason': reason
+            })
+            self.max_in_flight = max_in_flight
+
+    def run(self, batches: list[list[int]], task_fn, **task_kwargs):
+        """
+        Run `task_fn(page_range=batch, **task_kwargs)` for every batch.
+        Yields each PageBatchResult as soon as its batch completes, in completion order.
+        """
+        for _, future in self.run_tasks(((None, batch, task_kwargs) for batch in batches), task_fn):
+            yield future.result()
+
+    def run_tasks(self, tasks: Iterable[tuple[object, list[int], dict]], task_fn) -> Iterator[tuple[object, Future]]:
+        """
+        Run `task_fn(page_range=batch, **task_kwargs)` for every (tag, batch, task_kwargs) task, which may come from
+        different documents. Tasks are only taken from `tasks` when a slot frees up, so a lazy iterable can still
+        drop or add tasks while earlier ones run. Yields (tag, future) as soon as each task completes, in completion
+        order, leaving it to the caller to handle the failure of a task without stopping the others.
+        """
+        pending_tasks = iter(tasks)
+        tag_by_future = {}
+
+        def submit_next():
+            task = next(pending_tasks, None)
+            if task is None:
+                return False
+            tag, batch, task_kwargs = task
+            tag_by_future[self.executor.submit(task_fn, page_range=batch, **task_kwargs)] = tag
+            return True
+
+        self.stats.started_at = time.time()
+        while len(tag_by_future) < self.max_in_flight and submit_next():
+            pass
+
+        while tag_by_future:
+            done, _ = wait(tag_by_future, return_when=FIRST_COMPLETED)
+            for future in done:
+                tag = tag_by_future.pop(future)
+                if future.exception() is None:
+                    self.stats.record(future.result())
+                    self._adapt_in_flight(future.result())
+                while len(tag_by_future) < self.max_in_flight and submit_next():
+                    pass
+                yield tag, future
+        self.stats.finished_at = time.time()
+
+
+class ReorderBuffer:
+    """
+    Turns page results that arrive in completion order into a contiguous, in-order page stream.
+    Only pages that arrived ahead of the next expected page are held in memory.
+    """
+
+    def __init__(self, page_nums: list[int]):
+        self._expected_page_nums = iter(sorted(page_nums))
+        self._next_page_num = next(self._expected_page_nums, None)
+        self._waiting: dict[int, RawPageData] = {}
+
+    @property
+    def next_page_number(self):
+        return self._next_page_num
+
+    def is_done(self) -> bool:
+        return self._next_page_num is None
+
+    def buffered_count(self) -> int:
+        return len(self._waiting)
+
+    def push(self, page_data: RawPageData):
+        self._waiting[page_data.page_number] = page_data
+
+    def pop_next(self):
+        """Return the next page in order if it has arrived, otherwise None."""
+        if self._next_page_num is None or self._next_page_num not in self._waiting:
+            return None
+        page_data = self._waiting.pop(self._next_page_num)
+        self._next_page_num = next(self._expected_page_nums, None)
+        return page_data
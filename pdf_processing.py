@@ -1,30 +1,232 @@
+import gc
+import hashlib
+import importlib
 import logging as log
-from concurrent.futures import as_completed, ProcessPoolExecutor
+import math
+import os
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, ExitStack
+from typing import Iterator
 
-import pdfplumber
+from checkpoint_store import (
+    checkpoint_key,
+    CheckpointStore,
+    legacy_checkpoint_page_numbers,
+    migrate_legacy_checkpoints,
+    open_checkpoint_store
+)
+from column_extraction import CHARS_ENGINE, COLUMN_EXTRACTORS
+from file_operations import file_fingerprint, open_pdf_readonly
+from metrics import (
+    CHECKPOINT_HITS_COUNTER,
+    CHECKPOINT_IO_STAGE,
+    CHECKPOINT_MISSES_COUNTER,
+    COLUMN_EXTRACTION_STAGE,
+    PAGE_DIGEST_STAGE,
+    PAGES_COUNTER,
+    PDF_OPEN_STAGE,
+    PLANNING_STAGE,
+    RUN_METRICS,
+    RunMetrics,
+    SKIPPED_PAGES_COUNTER
+)
+from model import ExtractionPlan, LayoutProfile, MemoryBudget, PageBatchResult, PoolSizing, RawPageData
+from page_scheduler import batch_pages, PAGE_BATCH_SIZE, PageScheduler, ReorderBuffer
+from profiling import RUN_PROFILER
+from worker_pool import available_cpus, available_memory_mb, create_process_pool, current_rss_mb
 
-import logging_setup
-from file_operations import create_pdf_copies, load_checkpoint, remove_temp_pdfs, save_checkpoint
-from model import RawPageData
+# Peak RSS of a worker laying out the pages of a large book, assumed when sizing the pool without a memory budget
+ESTIMATED_WORKER_RSS_MB = 400
+# Share of the available memory the extraction workers may take together, the rest is left to parsing and the system
+WORKERS_MEMORY_SHARE = 0.75
 
 LEFT_COL_BBOX = (50, 0, 300, 783)
 RIGHT_COL_BBOX = (300, 0, 570, 783)
+START_PAGE = 17  # pages are 0-indexed, so -1. Start from page 18, 0-14 rubbish, 14-17 intro
+# Hand-tuned layout of the original textbook, also the fallback when no layout can be detected
+DEFAULT_LAYOUT = LayoutProfile(
+    left_col_bbox=LEFT_COL_BBOX, right_col_bbox=RIGHT_COL_BBOX, first_content_page=START_PAGE
+)
+# Bump whenever a change to the extraction would produce different text for the same page
+EXTRACTOR_VERSION = 1
+# Bump whenever page_content_digest changes, so page digests saved by earlier runs are computed again
+PAGE_DIGEST_VERSION = 2
+# All engines produce the same text, CHARS_ENGINE reads the page's chars once for both columns
+EXTRACTION_ENGINE = CHARS_ENGINE
+DOCUMENT_ARTIFACT = "document"
+# Opening a large PDF costs more than extracting a batch of its pages, so workers keep the documents they read open
+# between batches. A few of them, for the extraction service interleaving the batches of several books
+MAX_OPEN_DOCUMENTS_PER_WORKER = 2
+# Heavy modules imported once by the fork server, so every worker forked from it starts with them already loaded
+WORKER_PRELOAD_MODULES = ["pdfplumber", "numpy", "pdf_processing"]
 
 
-def distribute_page_ranges(total_pages, max_parallelism):
-    """Distributes pages into chunks for parallel processing with logging."""
-    log.info("Distributing pages among workers...")
-    page_ranges = []
-    start_page = 17  # page ranges are 0-indexed, so -1. Start from page 18, 0-14 rubbish, 14-17 intro
-    pages_per_worker = (total_pages - start_page) // max_parallelism
-    for i in range(max_parallelism):
-        if i == max_parallelism - 1:
-            page_range = range(start_page + i * pages_per_worker, total_pages)
-        else:
-            page_range = range(start_page + i * pages_per_worker, start_page + (i + 1) * pages_per_worker)
-        page_ranges.append(page_range)
-        log.info(f"Worker {i} will process pages {page_range}")
-    return page_ranges
+@contextmanager
+def open_pdf(pdf_path):
+    """Open the PDF read-only with pdfplumber, which is only imported once a PDF actually needs to be read."""
+    import pdfplumber
+
+    with open_pdf_readonly(pdf_path) as pdf_stream, pdfplumber.open(pdf_stream) as pdf:
+        yield pdf
+
+
+# Documents open in this worker, by path and fingerprint, with the ExitStack closing each of them
+_open_documents = OrderedDict()
+
+
+def _open_worker_pdf(path, document, batch_metrics: RunMetrics):
+    """The PDF of the document, opened by the first batch of the worker reading it and reused by the next ones."""
+    key = (path, document)
+    if key in _open_documents:
+        _open_documents.move_to_end(key)
+        return _open_documents[key][1]
+    while len(_open_documents) >= MAX_OPEN_DOCUMENTS_PER_WORKER:
+        _, (pdf_stack, _) = _open_documents.popitem(last=False)
+        pdf_stack.close()
+    pdf_stack = ExitStack()
+    with batch_metrics.span(PDF_OPEN_STAGE):
+        pdf = pdf_stack.enter_context(open_pdf(path))
+    _open_documents[key] = (pdf_stack, pdf)
+    return pdf
+
+
+def _close_worker_pdfs():
+    while _open_documents:
+        _, (pdf_stack, _) = _open_documents.popitem()
+        pdf_stack.close()
+    gc.collect()
+
+
+def _init_worker():
+    """Runs once in each worker process, instead of once per task."""
+    # Already loaded when preloaded by the fork server, otherwise paid once here rather than by the first task
+    importlib.import_module("pdfplumber")
+
+
+def create_worker_pool(max_workers, memory_budget: MemoryBudget = None) -> ProcessPoolExecutor:
+    """
+    Pool of extraction workers, which start with pdfplumber already imported. With a memory budget, workers are
+    replaced by fresh ones after extracting the budget's pages per worker.
+    """
+    max_tasks_per_child = math.ceil(memory_budget.pages_per_worker / PAGE_BATCH_SIZE) if memory_budget else None
+    return create_process_pool(max_workers, WORKER_PRELOAD_MODULES, _init_worker, max_tasks_per_child)
+
+
+def size_worker_pool(
+        requested_workers: int = None,
+        memory_budget: MemoryBudget = None,
+        batch_count: int = None
+) -> PoolSizing:
+    """
+    Number of extraction workers: as requested, otherwise one per available CPU, as long as their memory fits in the
+    available memory and there are batches enough to keep them all busy.
+    """
+    cpus = available_cpus()
+    memory_mb = available_memory_mb()
+    worker_memory_mb = memory_budget.max_worker_rss_mb if memory_budget else ESTIMATED_WORKER_RSS_MB
+    workers_memory_mb = memory_mb * WORKERS_MEMORY_SHARE if memory_mb is not None else None
+
+    if requested_workers:
+        workers, limited_by = requested_workers, "requested"
+    else:
+        workers, limited_by = cpus, "cpus"
+        if workers_memory_mb is not None and workers_memory_mb // worker_memory_mb < workers:
+            workers, limited_by = max(int(workers_memory_mb // worker_memory_mb), 1), "memory"
+        if batch_count is not None and batch_count < workers:
+            workers, limited_by = max(batch_count, 1), "batches"
+
+    if memory_budget is not None:
+        worker_rss_limit_mb = memory_budget.max_worker_rss_mb
+    else:
+        worker_rss_limit_mb = workers_memory_mb / workers if workers_memory_mb is not None else None
+    return PoolSizing(
+        workers=workers,
+        available_cpus=cpus,
+        available_memory_mb=memory_mb,
+        worker_memory_mb=worker_memory_mb,
+        worker_rss_limit_mb=worker_rss_limit_mb,
+        limited_by=limited_by
+    )
+
+
+def log_pool_sizing(sizing: PoolSizing):
+    memory_summary = f"{sizing.available_memory_mb:,.0f} MiB" if sizing.available_memory_mb is not None else "unknown"
+    log.info(
+        f"Extracting on {sizing.workers} workers, limited by {sizing.limited_by}: {sizing.available_cpus} CPUs and "
+        f"{memory_summary} of memory available, {sizing.worker_memory_mb:,.0f} MiB expected per worker."
+    )
+    RUN_METRICS.record_pool_sizing(sizing)
+
+
+# Digests of the indirect objects of each open document, shared by its pages, which mostly use the same fonts
+_object_digests_by_document = weakref.WeakKeyDictionary()
+
+
+def _pdf_object_digest(obj, digest_by_objid: dict[int, str]) -> str:
+    """Digest of a PDF object and of everything it references, streams included, memoized by indirect object."""
+    from pdfminer.pdfinterp import LITERAL_IMAGE
+    from pdfminer.pdftypes import PDFObjRef, PDFStream
+
+    if isinstance(obj, PDFObjRef):
+        if obj.objid not in digest_by_objid:
+            # A reference back to an object being hashed is hashed as a cycle instead of recursing forever
+            digest_by_objid[obj.objid] = "cycle"
+            digest_by_objid[obj.objid] = _pdf_object_digest(obj.resolve(), digest_by_objid)
+        return digest_by_objid[obj.objid]
+
+    digest = hashlib.sha256()
+    if isinstance(obj, PDFStream):
+        digest.update(b"stream" + _pdf_object_digest(obj.attrs, digest_by_objid).encode())
+        # Image samples can't change the text of a page, and they are the bulk of most PDFs
+        if obj.attrs.get("Subtype") is not LITERAL_IMAGE:
+            digest.update(obj.get_data())
+    elif isinstance(obj, dict):
+        digest.update(b"dict")
+        for key, value in sorted(obj.items()):
+            digest.update(f"{key}={_pdf_object_digest(value, digest_by_objid)};".encode())
+    elif isinstance(obj, (list, tuple)):
+        digest.update(b"list")
+        for value in obj:
+            digest.update(f"{_pdf_object_digest(value, digest_by_objid)};".encode())
+    else:
+        digest.update(repr(obj).encode())
+    return digest.hexdigest()
+
+
+def _page_digests_key(document):
+    """Key of the saved page digests of a document, which only hold for the digest version they were computed with."""
+    return f"{document}-d{PAGE_DIGEST_VERSION}"
+
+
+def page_content_digest(page) -> str:
+    """
+    Digest of everything that determines the text of a page: its content streams and page box, and all of its
+    resources recursively, such as its fonts with their encodings and ToUnicode maps, and its form XObjects with their
+    own content streams and resources. It only depends on the page, so identical pages of different books share it.
+    """
+    from pdfminer.pdftypes import resolve1
+
+    digest_by_objid = _object_digests_by_document.setdefault(page.page_obj.doc, {})
+    digest = hashlib.sha256(f"{page.mediabox!r} rotate={page.rotation}".encode())
+    for stream in page.page_obj.contents:
+        digest.update(resolve1(stream).get_data())
+    digest.update(_pdf_object_digest(page.page_obj.resources or {}, digest_by_objid).encode())
+    return digest.hexdigest()
+
+
+def document_fingerprint(pdf_path, checkpoint_store: CheckpointStore) -> str:
+    """Content hash of the PDF, only recomputed when the file's size or modification time change."""
+    stat = os.stat(pdf_path)
+    real_path = os.path.realpath(pdf_path)
+    fingerprint = checkpoint_store.load_fingerprint(real_path, stat.st_size, stat.st_mtime_ns)
+    if fingerprint is None:
+        log.info(f"Computing the content fingerprint of {pdf_path}...")
+        fingerprint = file_fingerprint(pdf_path)
+        checkpoint_store.save_fingerprint(real_path, stat.st_size, stat.st_mtime_ns, fingerprint)
+    return fingerprint
 
 
 def extract_columns_from_page_range(
@@ -32,83 +234,340 @@ def extract_columns_from_page_range(
         page_range: [int],
         total_pages: int,
         left_col_bbox: (int, int, int, int),
-        right_col_bbox: (int, int, int, int)
-):
-    """Extracts the left and right columns from a given page range in a PDF copy."""
-    # Hack to ensure logging is set up in the worker processes, ideally should be done in a wrap_with_logging function,
-    # but ran into issues with pickling
-    logging_setup.setup_logging()
-
+        right_col_bbox: (int, int, int, int),
+        checkpoint_store: CheckpointStore,
+        document: str,
+        memory_budget: MemoryBudget = None
+) -> PageBatchResult:
+    """
+    Extracts the left and right columns from a given page range, reading the shared PDF read-only. The PDF stays open
+    in the worker for its next batches, and is reopened whenever the worker grows past the budget's RSS, or past the
+    RSS expected of a worker without a budget. With a memory budget, the pages are left in the checkpoint store for
+    the parent to load when it needs them instead of being sent back.
+    """
+    started_at = time.time()
+    extract_columns = COLUMN_EXTRACTORS[EXTRACTION_ENGINE]
     results: [RawPageData] = []
-    page_nums_to_read_from_pdf = set([x for x in page_range])
+    spooled_page_keys = {}
+    extracted_page_datas_by_key = {}
+    digest_by_page_num = {}
+    batch_metrics = RunMetrics()
+    page_seconds = batch_metrics.page_seconds[path]
+    # Checked once per batch, so pages don't pay for formatting lines that go nowhere
+    log_pages = log.getLogger().isEnabledFor(log.DEBUG)
+    max_worker_rss_mb = memory_budget.max_worker_rss_mb if memory_budget is not None else ESTIMATED_WORKER_RSS_MB
 
+    pdf = _open_worker_pdf(path, document, batch_metrics)
     for page_num in page_range:
-        page_data = load_checkpoint(page_num)
-        if page_data is not None:
-            log.info(f"Loaded checkpoint for page {page_num}")
-            results.append(page_data)
-            page_nums_to_read_from_pdf.remove(page_num)
-            continue
+        assert page_num < total_pages, f"Page number {page_num} exceeds total pages {total_pages}"
+        page_started = time.perf_counter()
 
-    with pdfplumber.open(path) as pdf:
-        for page_num in page_nums_to_read_from_pdf:
-            assert page_num < total_pages, f"Page number {page_num} exceeds total pages {total_pages}"
+        # pdfminer keeps the parsed objects of every page it has resolved, only dropping the document frees them
+        if current_rss_mb() > max_worker_rss_mb:
+            log.info(f"Page: {page_num} - Worker above {max_worker_rss_mb} MiB, reopening the PDF")
+            _close_worker_pdfs()
+            pdf = _open_worker_pdf(path, document, batch_metrics)
 
-            page = pdf.pages[page_num]
+        page = pdf.pages[page_num]
+        with batch_metrics.span(PAGE_DIGEST_STAGE):
+            digest_by_page_num[page_num] = page_content_digest(page)
+        key = checkpoint_key(digest_by_page_num[page_num], left_col_bbox, right_col_bbox, EXTRACTOR_VERSION)
 
+        # The same page may already have been extracted from another book or edition
+        with batch_metrics.span(CHECKPOINT_IO_STAGE):
+            page_data = checkpoint_store.load_page(key, page_num)
+        if page_data is not None:
+            batch_metrics.count(CHECKPOINT_HITS_COUNTER)
+            if log_pages:
+                log.debug(f"Page: {page_num} - Reused checkpoint of an identical page")
+        else:
+            batch_metrics.count(CHECKPOINT_MISSES_COUNTER)
             # Extract text from the left and right columns
-            left_text = page.within_bbox(left_col_bbox).extract_text()
-            right_text = page.within_bbox(right_col_bbox).extract_text()
+            with batch_metrics.span(COLUMN_EXTRACTION_STAGE):
+                left_text, right_text = extract_columns(page, left_col_bbox, right_col_bbox)
             page_data = RawPageData(page_number=page_num, left_col=left_text, right_col=right_text)
+            extracted_page_datas_by_key[key] = page_data
+            if log_pages:
+                log.debug(f"Page: {page_num} - Extracted columns text from pdf")
+        # Drop the chars and layout objects cached by the page, the pdf keeps every page it has handed out
+        page.close()
 
-            # Save the extracted columns to the checkpoint
-            save_checkpoint(page_data)
-            log.info(f"Page: {page_num} - Extracted columns text from pdf")
-
+        if memory_budget is not None:
+            spooled_page_keys[page_num] = key
+        else:
             results.append(page_data)
-    return results
+        page_seconds[page_num] = time.perf_counter() - page_started
 
+    # Save the extracted columns of the whole batch to the checkpoint store at once, before the digests pointing to them
+    with batch_metrics.span(CHECKPOINT_IO_STAGE):
+        checkpoint_store.save_pages(extracted_page_datas_by_key)
+        checkpoint_store.save_page_digests(_page_digests_key(document), digest_by_page_num)
+    # One line per batch instead of one per page
+    log.info(
+        f"Pages {page_range[0]}-{page_range[-1]}: extracted {batch_metrics.counters[CHECKPOINT_MISSES_COUNTER]}, "
+        f"reused {batch_metrics.counters[CHECKPOINT_HITS_COUNTER]} checkpoints of identical pages "
+        f"in {time.time() - started_at:.2f}s"
+    )
+    return PageBatchResult(
+        worker_pid=os.getpid(),
+        started_at=started_at,
+        finished_at=time.time(),
+        pages=results,
+        spooled_page_keys=spooled_page_keys,
+        worker_rss_mb=current_rss_mb(),
+        metrics=batch_metrics.snapshot()
+    )
 
-def process_pdf_concurrently(pdf_path, max_parallelism) -> list[RawPageData]:
-    """Process the PDF concurrently to extract columns from pages."""
-    temp_pdfs = create_pdf_copies(pdf_path, max_parallelism)
-    with pdfplumber.open(pdf_path) as pdf:
-        total_pages = len(pdf.pages)
-
-    # Distribute page ranges to the workers
-    page_ranges = distribute_page_ranges(total_pages, max_parallelism)
-    page_datas: [RawPageData] = []
-
-    # Use a ThreadPoolExecutor to process pages concurrently
-    with ProcessPoolExecutor(max_workers=max_parallelism) as executor:
-        futures = []
-        for i in range(max_parallelism):
-            assigned_temp_pdf = temp_pdfs[i]
-            assigned_page_range = page_ranges[i]
-
-            future = executor.submit(
-                extract_columns_from_page_range,
-                assigned_temp_pdf,
-                assigned_page_range,
-                total_pages,
-                LEFT_COL_BBOX,
-                RIGHT_COL_BBOX
-            )
-            futures.append(future)
-        log.info("Workers have started processing pages...")
-
-        completed = 0
-        for future in as_completed(futures):
-            result = future.result()
-            page_datas.extend(result)
-            log.info(f"{completed} out of {len(futures)} workers have completed processing pages.")
-            completed += 1
+
+def _migrate_legacy_checkpoints(pdf, document, checkpoint_store: CheckpointStore) -> dict[int, str]:
+    """
+    Migrate page-number keyed checkpoints, which were always extracted with the default layout, returning the content
+    digests of the migrated pages.
+    """
+    page_nums = [page_num for page_num in legacy_checkpoint_page_numbers() if page_num < len(pdf.pages)]
+    if not page_nums:
+        return {}
+    log.info(f"Computing content digests of {len(page_nums)} pages with legacy checkpoints...")
+    digest_by_page_num = {page_num: page_content_digest(pdf.pages[page_num]) for page_num in page_nums}
+    key_by_page_num = {
+        page_num: checkpoint_key(
+            digest, DEFAULT_LAYOUT.left_col_bbox, DEFAULT_LAYOUT.right_col_bbox, EXTRACTOR_VERSION
+        )
+        for page_num, digest in digest_by_page_num.items()
+    }
+    migrate_legacy_checkpoints(checkpoint_store, _page_digests_key(document), key_by_page_num, digest_by_page_num)
+    return digest_by_page_num
+
+
+def plan_extraction(
+        pdf_path,
+        checkpoint_store: CheckpointStore,
+        layout: LayoutProfile = None,
+        skip_non_question_pages=False
+) -> ExtractionPlan:
+    """
+    Work out the layout, the content pages and which of them still need to be extracted, batched for the workers.
+    Without an explicit layout, the layout is detected once per document and reused on later runs.
+    With skip_non_question_pages, pages are classified from their raw text first, also once per document, and the
+    pages that cannot yield rows are left out of the extraction.
+    """
+    with RUN_METRICS.span(PLANNING_STAGE):
+        return _plan_extraction(pdf_path, checkpoint_store, layout, skip_non_question_pages)
+
+
+def _plan_extraction(pdf_path, checkpoint_store: CheckpointStore, layout, skip_non_question_pages) -> ExtractionPlan:
+    document = document_fingerprint(pdf_path, checkpoint_store)
+    digest_by_page_num = checkpoint_store.load_page_digests(_page_digests_key(document))
+    document_info = checkpoint_store.load_artifact(DOCUMENT_ARTIFACT, document)
+    if layout is None:
+        from layout_analysis import load_cached_layout
+        layout = load_cached_layout(document, checkpoint_store)
+    outline_by_page_num = None
+    if skip_non_question_pages:
+        from page_classification import load_cached_page_outlines
+        outline_by_page_num = load_cached_page_outlines(document, checkpoint_store)
+
+    # Only open the PDF in the parent if something about it is not known from earlier runs yet
+    if (
+            document_info is None
+            or layout is None
+            or (skip_non_question_pages and outline_by_page_num is None)
+            or (not digest_by_page_num and legacy_checkpoint_page_numbers())
+    ):
+        with open_pdf(pdf_path) as pdf:
+            document_info = {"total_pages": len(pdf.pages)}
+            checkpoint_store.save_artifact(DOCUMENT_ARTIFACT, document, document_info)
+            if not digest_by_page_num:
+                digest_by_page_num = _migrate_legacy_checkpoints(pdf, document, checkpoint_store)
+            if layout is None:
+                from layout_analysis import detect_and_cache_layout
+                layout = detect_and_cache_layout(pdf, document, checkpoint_store, fallback=DEFAULT_LAYOUT)
+            if skip_non_question_pages and outline_by_page_num is None:
+                from page_classification import outline_and_cache_pages
+                outline_by_page_num = outline_and_cache_pages(pdf, document, checkpoint_store)
+    total_pages = document_info["total_pages"]
+
+    # Already checkpointed pages are never dispatched to the workers. Pages whose digest is not known yet are, and the
+    # worker reuses the checkpoint of an identical page if there is one.
+    page_nums = list(range(layout.first_content_page, total_pages))
+    skipped = set()
+    if skip_non_question_pages:
+        from page_classification import classify_pages, log_page_classes, skippable_pages
+        class_by_page_num = classify_pages(page_nums, outline_by_page_num)
+        skipped = skippable_pages(page_nums, class_by_page_num, outline_by_page_num)
+        log_page_classes(class_by_page_num, skipped)
+    key_by_page_num = {
+        page_num: checkpoint_key(
+            digest_by_page_num[page_num], layout.left_col_bbox, layout.right_col_bbox, EXTRACTOR_VERSION
+        )
+        for page_num in page_nums
+        if page_num in digest_by_page_num and page_num not in skipped
+    }
+    with RUN_METRICS.span(CHECKPOINT_IO_STAGE):
+        completed_keys = checkpoint_store.completed_keys(key_by_page_num.values())
+    checkpointed = {page_num: key for page_num, key in key_by_page_num.items() if key in completed_keys}
+    RUN_METRICS.count(CHECKPOINT_HITS_COUNTER, len(checkpointed))
+    RUN_METRICS.count(SKIPPED_PAGES_COUNTER, len(skipped))
+    log.info(f"Found checkpoints for {len(checkpointed)} out of {len(page_nums) - len(skipped)} pages")
+
+    return ExtractionPlan(
+        pdf_path=pdf_path,
+        document=document,
+        layout=layout,
+        total_pages=total_pages,
+        page_nums=page_nums,
+        checkpoint_key_by_page_num=checkpointed,
+        batches=batch_pages([
+            page_num for page_num in page_nums if page_num not in checkpointed and page_num not in skipped
+        ]),
+        skipped_page_nums=skipped
+    )
+
+
+def extraction_task_kwargs(
+        plan: ExtractionPlan,
+        checkpoint_store: CheckpointStore,
+        memory_budget: MemoryBudget = None
+) -> dict:
+    """Arguments of extract_columns_from_page_range for every batch of the plan, besides the page range."""
+    return dict(
+        path=plan.pdf_path,
+        total_pages=plan.total_pages,
+        left_col_bbox=plan.layout.left_col_bbox,
+        right_col_bbox=plan.layout.right_col_bbox,
+        checkpoint_store=checkpoint_store,
+        document=plan.document,
+        memory_budget=memory_budget
+    )
+
+
+def push_batch_result(buffer: ReorderBuffer, plan: ExtractionPlan, result: PageBatchResult):
+    """Hand the pages of a completed batch to the buffer, spooled pages being loaded once they are next in line."""
+    for page_data in result.pages:
+        buffer.push(page_data)
+    plan.checkpoint_key_by_page_num.update(result.spooled_page_keys)
+    RUN_METRICS.merge(result.metrics)
+
+
+def _extract_missing_page(pdf, plan: ExtractionPlan, page_num, checkpoint_store: CheckpointStore) -> RawPageData:
+    """Extract a page again in this process and checkpoint it, as its checkpoint went missing after it was planned."""
+    page = pdf.pages[page_num]
+    digest = page_content_digest(page)
+    with RUN_METRICS.span(COLUMN_EXTRACTION_STAGE):
+        left_text, right_text = COLUMN_EXTRACTORS[EXTRACTION_ENGINE](
+            page, plan.layout.left_col_bbox, plan.layout.right_col_bbox
+        )
+    page.close()
+    page_data = RawPageData(page_number=page_num, left_col=left_text, right_col=right_text)
+    key = checkpoint_key(digest, plan.layout.left_col_bbox, plan.layout.right_col_bbox, EXTRACTOR_VERSION)
+    with RUN_METRICS.span(CHECKPOINT_IO_STAGE):
+        checkpoint_store.save_pages({key: page_data})
+        checkpoint_store.save_page_digests(_page_digests_key(plan.document), {page_num: digest})
+    plan.checkpoint_key_by_page_num[page_num] = key
+    return page_data
+
+
+def pop_extracted_pages(
+        buffer: ReorderBuffer,
+        plan: ExtractionPlan,
+        checkpoint_store: CheckpointStore
+) -> Iterator[RawPageData]:
+    """
+    Yield every page of the plan that is next in line, loading checkpointed pages just in time. A page whose checkpoint
+    was deleted since it was planned or spooled is extracted again here, the PDF being opened once for all of them.
+    """
+    with ExitStack() as pdf_stack:
+        pdf = None
+        while not buffer.is_done():
+            page_num = buffer.next_page_number
+            if page_num in plan.skipped_page_nums:
+                buffer.push(RawPageData(page_number=page_num, left_col="", right_col=""))
+            elif page_num in plan.checkpoint_key_by_page_num:
+                key = plan.checkpoint_key_by_page_num[page_num]
+                with RUN_METRICS.span(CHECKPOINT_IO_STAGE):
+                    page_data = checkpoint_store.load_page(key, page_num)
+                if page_data is None:
+                    log.warning(f"Page: {page_num} - Checkpoint {key} is missing, extracting the page again")
+                    if pdf is None:
+                        with RUN_METRICS.span(PDF_OPEN_STAGE):
+                            pdf = pdf_stack.enter_context(open_pdf(plan.pdf_path))
+                    page_data = _extract_missing_page(pdf, plan, page_num, checkpoint_store)
+                buffer.push(page_data)
+            page_data = buffer.pop_next()
+            if page_data is None:
+                return
+            RUN_METRICS.count(PAGES_COUNTER)
+            yield page_data
+
+
+def iter_pages_in_order(
+        pdf_path,
+        max_workers: int = None,
+        checkpoint_store: CheckpointStore = None,
+        layout: LayoutProfile = None,
+        memory_budget: MemoryBudget = None,
+        skip_non_question_pages=False
+) -> Iterator[RawPageData]:
+    """
+    Extract the PDF concurrently and yield pages in page order as soon as every earlier page is available,
+    so the caller can start processing text while later pages are still being extracted.
+    Without an explicit layout, the layout is detected once per document and reused on later runs.
+    Without `max_workers`, the pool is sized from the CPUs and memory available.
+    With a memory budget, workers spool pages to the checkpoint store and they are loaded back one at a time as they
+    come up in page order, so memory stays flat as long as the caller doesn't keep the pages either.
+    """
+    checkpoint_store = checkpoint_store or open_checkpoint_store()
+    plan = plan_extraction(pdf_path, checkpoint_store, layout, skip_non_question_pages)
+    if not plan.batches:
+        yield from iter_planned_pages_in_order(plan, checkpoint_store)
+        return
+
+    sizing = size_worker_pool(max_workers, memory_budget, len(plan.batches))
+    log_pool_sizing(sizing)
+    with create_worker_pool(sizing.workers, memory_budget) as executor:
+        scheduler = PageScheduler(executor, sizing.workers, worker_rss_limit_mb=sizing.worker_rss_limit_mb)
+        yield from iter_planned_pages_in_order(plan, checkpoint_store, scheduler, memory_budget)
+
+
+def iter_planned_pages_in_order(
+        plan: ExtractionPlan,
+        checkpoint_store: CheckpointStore,
+        scheduler: PageScheduler = None,
+        memory_budget: MemoryBudget = None
+) -> Iterator[RawPageData]:
+    """
+    Yield the pages of an extraction plan in page order, running its batches on the scheduler's pool, which may be
+    shared with other extractions. The scheduler can be left out when the plan has no batches.
+    """
+    buffer = ReorderBuffer(plan.page_nums)
+    yield from pop_extracted_pages(buffer, plan, checkpoint_store)
+
+    batches = plan.batches
+    if batches:
+        log.info(f"Scheduling {len(batches)} batches of pages on {scheduler.num_workers} workers...")
+        for result in scheduler.run(
+                batches,
+                RUN_PROFILER.wrap_task(extract_columns_from_page_range),
+                **extraction_task_kwargs(plan, checkpoint_store, memory_budget)
+        ):
+            push_batch_result(buffer, plan, result)
+            log.info(f"{scheduler.stats.batches_completed} out of {len(batches)} batches have completed.")
+            yield from pop_extracted_pages(buffer, plan, checkpoint_store)
         log.info("All workers have completed processing pages.")
+        scheduler.stats.log_summary()
+        RUN_METRICS.record_scheduler(scheduler.stats)
 
-    # Sort the collected data by page number
-    page_datas.sort(key=lambda x: x.page_number)  # Sort by page number
+    yield from pop_extracted_pages(buffer, plan, checkpoint_store)
+    assert buffer.is_done(), f"Page {buffer.next_page_number} was never extracted"
 
-    # Remove temporary PDF copies
-    remove_temp_pdfs(temp_pdfs)
 
-    return page_datas
+def process_pdf_concurrently(
+        pdf_path,
+        max_workers: int = None,
+        layout: LayoutProfile = None,
+        skip_non_question_pages=False
+) -> list[RawPageData]:
+    """Process the PDF concurrently to extract columns from pages."""
+    return list(iter_pages_in_order(
+        pdf_path, max_workers, layout=layout, skip_non_question_pages=skip_non_question_pages
+    ))
@@ -0,0 +1,214 @@
+"""
+Profiling of a whole run, extraction workers included. Every batch a worker extracts is profiled on its own and saved
+as a part in the profile folder, next to the part of the parent process, and the parts are merged into one report at
+the end of the run, along with the slowest pages. Two profilers are available:
+
+- cprofile: deterministic, every call is timed, which slows down the run a lot, and a merged .prof file is saved for
+  pstats or snakeviz.
+- sampling: the stack of the main thread is sampled on a CPU time timer, which costs well under 1% of the run, so it
+  can be left on for production-sized books. Samples are also saved as collapsed stacks, for flame graph tools.
+"""
+import cProfile
+import itertools
+import json
+import logging as log
+import os
+import pstats
+import shutil
+import signal
+from collections import Counter
+from contextlib import contextmanager
+from glob import glob
+
+CPROFILE_MODE = "cprofile"
+SAMPLING_MODE = "sampling"
+PROFILE_MODES = [CPROFILE_MODE, SAMPLING_MODE]
+PROFILE_DIR = "profile"
+PROFILE_REPORT_NAME = "report.txt"
+MERGED_PROFILE_NAME = "merged.prof"
+COLLAPSED_STACKS_NAME = "stacks.collapsed"
+PARENT_PROFILE = "parent"
+WORKER_PROFILE = "worker"
+# A sample every 5 ms of CPU time, frequent enough to find hot spots in a single book
+SAMPLING_INTERVAL_SECONDS = 0.005
+REPORTED_FUNCTIONS = 40
+REPORTED_PAGES = 20
+
+_part_numbers = itertools.count()
+
+
+class StackSampler:
+    """Counts the stacks of the main thread, sampled by SIGPROF every `interval` seconds of CPU time of the process."""
+
+    def __init__(self, interval=SAMPLING_INTERVAL_SECONDS):
+        self.interval = interval
+        self.stack_counts = Counter()
+        # Labels are formatted once per function rather than once per sample
+        self._label_by_code = {}
+        self._previous_handler = None
+
+    def _label(self, code) -> str:
+        label = self._label_by_code.get(code)
+        if label is None:
+            label = self._label_by_code[code] = (
+                f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            )
+        return label
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(self._label(frame.f_code))
+            frame = frame.f_back
+        self.stack_counts[";".join(reversed(stack))] += 1
+
+    def start(self):
+        # Signal handlers only run in the main thread, which is where pages are extracted and text is processed
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler)
+
+
+class RunProfiler:
+    """Profiles parts of a run in any process, saving each part in the profile folder. Disabled without a mode."""
+
+    def __init__(self, mode: str = None, profile_dir=PROFILE_DIR):
+        self.mode = mode
+        self.profile_dir = profile_dir
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode is not None
+
+    @property
+    def parts_dir(self):
+        return os.path.join(self.profile_dir, "parts")
+
+    def enable(self, mode, profile_dir=PROFILE_DIR):
+        """Profile the rest of the run, dropping the parts of an earlier run saved in the same folder."""
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self.mode = mode
+        # Workers may not share the working directory of the parent
+        self.profile_dir = os.path.abspath(profile_dir)
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+        os.makedirs(self.parts_dir)
+        log.info(f"Profiling the run with {mode} in {self.profile_dir}")
+
+    @contextmanager
+    def profile(self, name):
+        """Profile the block as a part of the run named after what it does, if profiling is enabled."""
+        if not self.enabled:
+            yield
+            return
+        part_path = os.path.join(self.parts_dir, f"{name}-{os.getpid()}-{next(_part_numbers)}")
+        if self.mode == CPROFILE_MODE:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                profiler.dump_stats(f"{part_path}.prof")
+        else:
+            sampler = StackSampler()
+            sampler.start()
+            try:
+                yield
+            finally:
+                sampler.stop()
+                with open(f"{part_path}.json", "w") as f:
+                    json.dump({"name": name, "interval": sampler.interval, "stacks": sampler.stack_counts}, f)
+
+    def wrap_task(self, task_fn):
+        """The task function to hand to workers, profiling every task when profiling is enabled."""
+        return ProfiledTask(task_fn, self.mode, self.profile_dir) if self.enabled else task_fn
+
+    def write_report(self, run_metrics):
+        """Merge the parts of every process into one report, with the slowest pages timed by the run's metrics."""
+        if not self.enabled:
+            return
+        report_path = os.path.join(self.profile_dir, PROFILE_REPORT_NAME)
+        with open(report_path, "w") as f:
+            _write_slowest_pages(f, run_metrics.snapshot()["page_seconds"])
+            if self.mode == CPROFILE_MODE:
+                self._write_cprofile_report(f)
+            else:
+                self._write_sampling_report(f)
+        log.info(f"Profile report saved at {report_path}")
+
+    def _write_cprofile_report(self, f):
+        part_paths = sorted(glob(os.path.join(self.parts_dir, "*.prof")))
+        merged_path = os.path.join(self.profile_dir, MERGED_PROFILE_NAME)
+        pstats.Stats(*part_paths).dump_stats(merged_path)
+        f.write(f"\ncProfile stats merged from {len(part_paths)} parts, saved in {MERGED_PROFILE_NAME}\n")
+        # Loaded back from the merged file, so the stats list a single file instead of every part
+        stats = pstats.Stats(merged_path, stream=f).strip_dirs()
+        for sort_key in (pstats.SortKey.CUMULATIVE, pstats.SortKey.TIME):
+            stats.sort_stats(sort_key).print_stats(REPORTED_FUNCTIONS)
+
+    def _write_sampling_report(self, f):
+        part_paths = sorted(glob(os.path.join(self.parts_dir, "*.json")))
+        stack_counts = Counter()
+        interval = SAMPLING_INTERVAL_SECONDS
+        for part_path in part_paths:
+            with open(part_path) as part_file:
+                part = json.load(part_file)
+            interval = part["interval"]
+            # Rooted at the kind of process, so flame graphs show workers and the parent side by side
+            for stack, count in part["stacks"].items():
+                stack_counts[f"{part['name']};{stack}"] += count
+
+        with open(os.path.join(self.profile_dir, COLLAPSED_STACKS_NAME), "w") as stacks_file:
+            for stack, count in stack_counts.most_common():
+                stacks_file.write(f"{stack} {count}\n")
+
+        sample_count = sum(stack_counts.values())
+        self_counts = Counter()
+        total_counts = Counter()
+        for stack, count in stack_counts.items():
+            functions = stack.split(";")[1:]
+            if functions:
+                self_counts[functions[-1]] += count
+            # Recursive functions count once per sample
+            for function in set(functions):
+                total_counts[function] += count
+        f.write(
+            f"\n{sample_count} samples from {len(part_paths)} parts, one every {interval * 1000:.0f} ms of CPU time, "
+            f"about {sample_count * interval:.1f}s. Stacks saved in {COLLAPSED_STACKS_NAME}\n"
+        )
+        for title, counts in (("Self time", self_counts), ("Total time", total_counts)):
+            f.write(f"\n{title}:\n")
+            for function, count in counts.most_common(REPORTED_FUNCTIONS):
+                f.write(f"{count / sample_count:8.1%} {count * interval:8.2f}s  {function}\n")
+
+
+class ProfiledTask:
+    """Task function run under the profiler of the run in a worker, which saves the profile of every task as a part."""
+
+    def __init__(self, task_fn, mode, profile_dir):
+        self.task_fn = task_fn
+        self.profiler = RunProfiler(mode, profile_dir)
+
+    def __call__(self, **task_kwargs):
+        with self.profiler.profile(WORKER_PROFILE):
+            return self.task_fn(**task_kwargs)
+
+
+def _write_slowest_pages(f, page_seconds: dict[str, dict[int, float]]):
+    slowest_pages = sorted(
+        ((seconds, pdf_path, page_num)
+         for pdf_path, seconds_by_page_num in page_seconds.items()
+         for page_num, seconds in seconds_by_page_num.items()),
+        reverse=True
+    )[:REPORTED_PAGES]
+    f.write("Slowest pages to extract, timed while profiling:\n")
+    for seconds, pdf_path, page_num in slowest_pages:
+        f.write(f"{seconds * 1000:10.1f} ms  {pdf_path} page {page_num}\n")
+
+
+# Profiler of the current process, enabled for the whole run by --profile
+RUN_PROFILER = RunProfiler()
@@ -0,0 +1,327 @@
+"""
+Long-running extraction service. It keeps a warm pool of extraction workers and the checkpoint store open between jobs,
+so regenerating the flashcards of a book only costs the pages and chapters that changed since it was last processed.
+Jobs are posted as JSON over HTTP, on a local port or on a Unix socket:
+
+    python service.py --socket /tmp/flashcards.sock
+    curl --unix-socket /tmp/flashcards.sock -d '{"pdf": "anatomy.pdf", "layout": "auto"}' http://localhost/jobs
+
+A job takes the "pdf" of a book and the optional "layout", "incremental" and "skip_non_question_pages" settings of the
+batch manifest, paths being relative to the working directory of the service. The response streams one JSON event per
+line: the job, its planned extraction, the pages done so far, the rows of every chapter as soon as it is parsed, and
+finally done or error. A job posted for a document that is already being processed with the same settings follows the
+running job, getting all of its events from the first one, instead of processing the document a second time.
+GET /status returns the pool, the running jobs and the run report of everything the service has done so far.
+"""
+import argparse
+import itertools
+import json
+import logging as log
+import os
+import signal
+import socketserver
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, Iterator
+
+import logging_setup
+from artifact_writer import NullArtifactWriter
+from batch import AUTO_LAYOUT_SETTING, DEFAULT_LAYOUT_SETTING, parse_layout_setting
+from checkpoint_store import CheckpointStore, open_checkpoint_store
+from metrics import RUN_METRICS
+from model import LayoutProfile, RawPageData
+from page_scheduler import PageScheduler
+from pdf_processing import (
+    create_worker_pool,
+    iter_planned_pages_in_order,
+    log_pool_sizing,
+    plan_extraction,
+    size_worker_pool
+)
+from text_processing import process_questions_and_answers, stream_questions_and_answers
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Jobs of different documents processed at the same time, their batches sharing the workers of the pool
+MAX_CONCURRENT_JOBS = 4
+# A progress event is sent every this many pages, and after the last page
+PROGRESS_EVERY_PAGES = 10
+
+JOB_EVENT = "job"
+PLANNED_EVENT = "planned"
+PROGRESS_EVENT = "progress"
+ROWS_EVENT = "rows"
+DONE_EVENT = "done"
+ERROR_EVENT = "error"
+
+
+@dataclass
+class JobRequest:
+    pdf_path: str
+    # None to detect the layout, like --layout auto
+    layout: LayoutProfile | None
+    incremental: bool = False
+    skip_non_question_pages: bool = False
+
+    @staticmethod
+    def from_dict(data):
+        return JobRequest(
+            pdf_path=data['pdf'],
+            layout=parse_layout_setting(data.get('layout', DEFAULT_LAYOUT_SETTING)),
+            incremental=data.get('incremental', False),
+            skip_non_question_pages=data.get('skip_non_question_pages', False)
+        )
+
+    def dedup_key(self) -> tuple:
+        """Requests with the same key would extract the same pages and produce the same rows."""
+        layout_key = json.dumps(self.layout.to_dict(), sort_keys=True) if self.layout else AUTO_LAYOUT_SETTING
+        return os.path.realpath(self.pdf_path), layout_key, self.incremental, self.skip_non_question_pages
+
+
+class ServiceJob:
+    """
+    One document being processed by the service. Its events are kept until it is done, so every request following
+    the job gets all of them, however late it joined.
+    """
+
+    def __init__(self, job_id: int, request: JobRequest):
+        self.job_id = job_id
+        self.request = request
+        self.pages_done = 0
+        self.pages_total: int | None = None
+        self._events: list[dict] = []
+        self._condition = threading.Condition()
+
+    def publish(self, event, **fields):
+        with self._condition:
+            self._events.append({"event": event, "job_id": self.job_id, **fields})
+            self._condition.notify_all()
+
+    def follow(self) -> Iterator[dict]:
+        """Every event of the job from the first one, waiting for the next ones until the job is done or fails."""
+        next_event = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: next_event < len(self._events))
+                new_events = self._events[next_event:]
+            next_event += len(new_events)
+            yield from new_events
+            if new_events[-1]["event"] in (DONE_EVENT, ERROR_EVENT):
+                return
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'pdf': self.request.pdf_path,
+            'pages_done': self.pages_done,
+            'pages_total': self.pages_total
+        }
+
+
+def _publish_progress(job: ServiceJob, page_datas: Iterable[RawPageData]) -> Iterator[RawPageData]:
+    for page_data in page_datas:
+        job.pages_done += 1
+        if job.pages_done % PROGRESS_EVERY_PAGES == 0 or job.pages_done == job.pages_total:
+            job.publish(PROGRESS_EVENT, pages_done=job.pages_done, pages_total=job.pages_total)
+        yield page_data
+
+
+class ExtractionService:
+    """Runs jobs on one pool of extraction workers, which lives as long as the service does."""
+
+    def __init__(self, max_workers: int = None, checkpoint_store: CheckpointStore = None):
+        self.checkpoint_store = checkpoint_store or open_checkpoint_store()
+        self.sizing = size_worker_pool(max_workers)
+        log_pool_sizing(self.sizing)
+        self.executor = create_worker_pool(self.sizing.workers)
+        self._job_runner = ThreadPoolExecutor(MAX_CONCURRENT_JOBS, thread_name_prefix="job")
+        self._job_ids = itertools.count(1)
+        self._jobs_lock = threading.Lock()
+        self._jobs_by_key: dict[tuple, ServiceJob] = {}
+
+    def warm_up(self):
+        """Start every worker now, instead of when the first job comes in."""
+        started_at = time.time()
+        wait([self.executor.submit(os.getpid) for _ in range(self.sizing.workers)])
+        log.info(f"Started {self.sizing.workers} extraction workers in {time.time() - started_at:.2f}s")
+
+    def submit(self, request: JobRequest) -> tuple[ServiceJob, bool]:
+        """The job processing the request, and whether it was already running for an earlier request."""
+        key = request.dedup_key()
+        with self._jobs_lock:
+            job = self._jobs_by_key.get(key)
+            if job is not None:
+                log.info(f"Job {job.job_id}: {request.pdf_path} is already being processed, following it")
+                return job, True
+            job = ServiceJob(next(self._job_ids), request)
+            self._jobs_by_key[key] = job
+        log.info(f"Job {job.job_id}: processing {request.pdf_path}")
+        self._job_runner.submit(self._run_job, key, job)
+        return job, False
+
+    def _run_job(self, key: tuple, job: ServiceJob):
+        started_at = time.time()
+        try:
+            row_count = self._process(job)
+            log.info(f"Job {job.job_id}: {row_count} rows in {time.time() - started_at:.2f}s")
+            job.publish(DONE_EVENT, rows=row_count, seconds=time.time() - started_at)
+        except Exception as e:
+            log.error(f"Job {job.job_id}: failed: {e!r}")
+            job.publish(ERROR_EVENT, error=repr(e))
+        finally:
+            # Later requests start a new job, which only redoes what changed since this one
+            with self._jobs_lock:
+                del self._jobs_by_key[key]
+
+    def _process(self, job: ServiceJob) -> int:
+        request = job.request
+        plan = plan_extraction(
+            request.pdf_path, self.checkpoint_store, request.layout, request.skip_non_question_pages
+        )
+        job.pages_total = len(plan.page_nums)
+        job.publish(PLANNED_EVENT, pages_total=job.pages_total, batches=len(plan.batches))
+
+        # Each job schedules its own batches, the pool interleaves the batches of concurrent jobs
+        scheduler = PageScheduler(
+            self.executor, self.sizing.workers, worker_rss_limit_mb=self.sizing.worker_rss_limit_mb
+        )
+        page_datas = _publish_progress(job, iter_planned_pages_in_order(plan, self.checkpoint_store, scheduler))
+        if request.incremental:
+            # Only the chapters that changed are parsed, so all rows are ready at once
+            chapters_rows = [process_questions_and_answers(
+                page_datas, NullArtifactWriter(), self.checkpoint_store, incremental_key=request.pdf_path
+            )]
+        else:
+            chapters_rows = stream_questions_and_answers(page_datas, NullArtifactWriter())
+
+        row_count = 0
+        for rows in chapters_rows:
+            if rows:
+                job.publish(ROWS_EVENT, rows=[row.to_dict() for row in rows])
+                row_count += len(rows)
+        return row_count
+
+    def status(self) -> dict:
+        with self._jobs_lock:
+            jobs = [job.to_dict() for job in self._jobs_by_key.values()]
+        return {"pool": self.sizing.to_dict(), "jobs": jobs, "report": RUN_METRICS.report()}
+
+    def close(self):
+        self._job_runner.shutdown()
+        self.executor.shutdown()
+
+
+class _ServiceRequestHandler(BaseHTTPRequestHandler):
+
+    @property
+    def service(self) -> ExtractionService:
+        return self.server.service
+
+    def do_GET(self):
+        if self.path != "/status":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        self._send_json(200, self.service.status())
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            request = JobRequest.from_dict(json.loads(body))
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"Invalid job: {e!r}"})
+            return
+        if not os.path.isfile(request.pdf_path):
+            self._send_json(404, {"error": f"No PDF at {request.pdf_path}"})
+            return
+
+        job, joined = self.service.submit(request)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        try:
+            self._write_event({"event": JOB_EVENT, "job_id": job.job_id, "pdf": request.pdf_path, "joined": joined})
+            for event in job.follow():
+                self._write_event(event)
+        except (BrokenPipeError, ConnectionResetError):
+            # The job carries on, its results are checkpointed for the next request and it may have other followers
+            log.info(f"Job {job.job_id}: the client went away")
+
+    def _write_event(self, event: dict):
+        self.wfile.write(json.dumps(event).encode() + b"\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # The default one writes to stderr, and uses the client address, which a Unix socket doesn't have
+        log.debug(f"{self.command} {self.path}: {format % args}")
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def open_server(service: ExtractionService, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+    """HTTP server of the service, on the Unix socket if one is given and on the local port otherwise."""
+    if socket_path is not None:
+        # A socket left behind by a service that didn't shut down cleanly would fail the bind
+        if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            os.remove(socket_path)
+        server = _UnixHTTPServer(socket_path, _ServiceRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), _ServiceRequestHandler)
+    server.service = service
+    return server
+
+
+def _stop_on_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve flashcard generation jobs from a warm pool of workers.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on, without --socket.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on, without --socket.")
+    parser.add_argument("--socket", help="Unix socket to listen on instead of a port.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Processes extracting pages, shared by all jobs. By default, one per available CPU as long as their "
+             "memory fits."
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Also log every page and request, instead of one line per batch."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging_setup.setup_logging(level=log.DEBUG if args.verbose else log.INFO)
+
+    extraction_service = ExtractionService(args.workers)
+    extraction_service.warm_up()
+    http_server = open_server(extraction_service, args.host, args.port, args.socket)
+    log.info(f"Extraction service listening on {args.socket or f'http://{args.host}:{args.port}'}")
+    # Service managers stop the service with SIGTERM, which shuts it down as cleanly as Ctrl-C
+    signal.signal(signal.SIGTERM, _stop_on_sigterm)
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        log.info("Shutting down the extraction service...")
+    finally:
+        http_server.server_close()
+        extraction_service.close()
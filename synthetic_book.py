@@ -0,0 +1,175 @@
+"""
+Synthetic two-column question and answer textbooks, generated offline and reproducibly from a seed, for benchmarking
+the pipeline at any size. Books are laid out like the original textbook: front matter up to the default layout's
+first content page, then chapters made of an introduction, a QUESTIONS section and an ANSWERS section, flowing down
+the left column and then the right column of each page.
+
+    python synthetic_book.py synthetic.pdf --pages 500
+"""
+import argparse
+import logging as log
+import random
+
+import logging_setup
+from model import RawPageData
+from pdf_processing import DEFAULT_LAYOUT
+from text_processing import ANSWERS, QUESTIONS
+
+LINES_PER_COLUMN = 60
+QUESTIONS_PER_CHAPTER = 40
+# Short enough for every line to fit in its column at FONT_SIZE
+MAX_LINE_CHARS = 44
+PAGE_SIZE = (612, 792)
+FONT_NAME = "Helvetica"
+FONT_SIZE = 8
+LINE_HEIGHT = 12
+FIRST_LINE_TOP = 40
+COLUMN_PADDING = 5
+
+WORDS = [
+    "nerve", "artery", "vein", "muscle", "bone", "lateral", "medial", "anterior", "posterior", "the", "of", "and",
+    "patient", "which", "following", "most", "likely", "23-year-old", "injury", "supply", "branch", "(12)",
+]
+LONG_WORDS = ["musculocutaneous", "sternocleidomastoid", "thoracoacromial", "brachiocephalic"]
+# Typography a real PDF is full of, which sanitization has to transliterate
+TYPOGRAPHY = ["’s", "“deep”", "–", "fibre…"]
+
+
+class _LineWriter:
+    """Wraps words into lines of at most MAX_LINE_CHARS, hyphenating a long word across two lines now and then."""
+
+    def __init__(self, rng: random.Random, hyphenate=True):
+        self._rng = rng
+        self._hyphenate = hyphenate
+        self.lines = []
+
+    def paragraph(self, first_words: list[str], word_count):
+        words = list(first_words)
+        for _ in range(word_count):
+            roll = self._rng.random()
+            if roll < 0.03:
+                words.append(self._rng.choice(TYPOGRAPHY))
+            elif roll < 0.08:
+                words.append(self._rng.choice(LONG_WORDS))
+            else:
+                words.append(self._rng.choice(WORDS))
+        line = ""
+        for word in words:
+            if line and len(line) + 1 + len(word) > MAX_LINE_CHARS:
+                if self._hyphenate and word in LONG_WORDS and len(line) + 8 <= MAX_LINE_CHARS:
+                    split_at = self._rng.randint(3, len(word) - 3)
+                    self.lines.append(f"{line} {word[:split_at]}-")
+                    line = word[split_at:]
+                    continue
+                self.lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        if line:
+            self.lines.append(line)
+
+    def line(self, text):
+        self.lines.append(text)
+
+
+def _write_chapter(writer: _LineWriter, chapter_number, rng: random.Random):
+    writer.line(f"{chapter_number} Chapter INTRODUCTION")
+    for _ in range(rng.randint(1, 3)):
+        writer.paragraph([], rng.randint(20, 60))
+    writer.line("QUESTIONS")
+    writer.line("MAIN QUESTIONS")
+    answer_letters = []
+    for question_number in range(1, QUESTIONS_PER_CHAPTER + 1):
+        writer.paragraph([str(question_number), "A"], rng.randint(8, 30))
+        option_count = rng.randint(4, 5)
+        for letter in "ABCDE"[:option_count]:
+            writer.paragraph([f"{letter}."], rng.randint(1, 5))
+        answer_letters.append(rng.choice("ABCDE"[:option_count]))
+    writer.line("Back")
+    writer.line("ANSWERS")
+    for question_number, letter in enumerate(answer_letters, start=1):
+        writer.paragraph([str(question_number), f"{letter}."], rng.randint(10, 60))
+    writer.line("Back")
+
+
+def generate_book_pages(page_count, seed=0, hyphenate=True) -> list[RawPageData]:
+    """
+    Column text of the `page_count` content pages of a synthetic book, numbered from the default layout's first
+    content page, exactly as the column extraction reads them back from the book's PDF. Without `hyphenate`, no word
+    is split across lines, so intro pages can be skipped when extracting the book's PDF.
+    """
+    rng = random.Random(seed)
+    writer = _LineWriter(rng, hyphenate)
+    lines_needed = page_count * 2 * LINES_PER_COLUMN
+    chapter_number = 1
+    while len(writer.lines) < lines_needed:
+        _write_chapter(writer, chapter_number, rng)
+        chapter_number += 1
+
+    pages = []
+    for page_idx in range(page_count):
+        first_line = page_idx * 2 * LINES_PER_COLUMN
+        left_lines = writer.lines[first_line:first_line + LINES_PER_COLUMN]
+        right_lines = writer.lines[first_line + LINES_PER_COLUMN:first_line + 2 * LINES_PER_COLUMN]
+        pages.append(RawPageData(
+            page_number=DEFAULT_LAYOUT.first_content_page + page_idx,
+            left_col="\n".join(left_lines),
+            right_col="\n".join(right_lines)
+        ))
+    return pages
+
+
+def _draw_line(pdf, x, y, line, split_markers):
+    """Draw the line, as two text operators meeting in the middle of its QUESTIONS or ANSWERS marker if asked to."""
+    marker = next((marker for marker in (QUESTIONS, ANSWERS) if marker in line), None) if split_markers else None
+    if marker is None:
+        pdf.drawString(x, y, line)
+        return
+    split_at = line.index(marker) + len(marker) // 2
+    pdf.drawString(x, y, line[:split_at])
+    pdf.drawString(x + pdf.stringWidth(line[:split_at], FONT_NAME, FONT_SIZE), y, line[split_at:])
+
+
+def write_book_pdf(pages: list[RawPageData], pdf_path, split_markers=False):
+    """
+    Lay out the pages in a PDF with front matter pages before them, the way the default layout expects. With
+    `split_markers`, section markers are drawn in two pieces, like some typesetters do, which reads back the same.
+    """
+    # Only generating PDFs needs reportlab, generating page text works without it
+    from reportlab.pdfgen import canvas
+
+    pdf = canvas.Canvas(pdf_path, pagesize=PAGE_SIZE)
+    page_height = PAGE_SIZE[1]
+    for page_num in range(DEFAULT_LAYOUT.first_content_page):
+        pdf.setFont(FONT_NAME, FONT_SIZE)
+        pdf.drawString(DEFAULT_LAYOUT.left_col_bbox[0] + COLUMN_PADDING, page_height / 2, f"Front matter {page_num}")
+        pdf.showPage()
+    for page_data in pages:
+        pdf.setFont(FONT_NAME, FONT_SIZE)
+        for bbox, column_text in (
+                (DEFAULT_LAYOUT.left_col_bbox, page_data.left_col),
+                (DEFAULT_LAYOUT.right_col_bbox, page_data.right_col)
+        ):
+            top = FIRST_LINE_TOP
+            for line in column_text.split("\n"):
+                # pdfplumber measures from the top of the page, reportlab from the bottom
+                _draw_line(pdf, bbox[0] + COLUMN_PADDING, page_height - top, line, split_markers)
+                top += LINE_HEIGHT
+        pdf.showPage()
+    pdf.save()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a synthetic two-column question and answer textbook PDF.")
+    parser.add_argument("pdf_path", help="Where to save the PDF.")
+    parser.add_argument("--pages", type=int, default=100, help="Content pages, after the front matter.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generator, the same seed gives the same book.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging_setup.setup_logging()
+    args = parse_args()
+
+    write_book_pdf(generate_book_pages(args.pages, args.seed), args.pdf_path)
+    log.info(f"Saved a synthetic book of {args.pages} content pages at {args.pdf_path}")
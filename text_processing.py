@@ -1,11 +1,26 @@
+import hashlib
 import logging as log
-import os
 import re
-
-from unidecode import unidecode  # Import unidecode for sanitizing text
-
-from file_operations import write_to_file
-from model import Answer, BookData, OutputRow, Question, RawPageData
+from contextlib import nullcontext
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterable, Iterator
+
+from artifact_writer import ArtifactCollector, NullArtifactWriter, open_artifact_writer
+from checkpoint_store import CheckpointStore, open_checkpoint_store
+from metrics import PARSING_STAGE, RUN_METRICS, SANITIZATION_STAGE, SEGMENTATION_STAGE
+from model import (
+    Answer,
+    BookData,
+    BookManifest,
+    ChapterLines,
+    ChapterManifestEntry,
+    OutputRow,
+    Question,
+    RawPageData,
+    SectionIndex
+)
+from worker_pool import create_process_pool
 
 MAIN_QUESTIONS = "MAIN QUESTIONS"
 
@@ -19,55 +34,230 @@ INTRODUCTION = "INTRODUCTION"
 
 QUESTIONS_ANSWERS_FOLDER = "questions_answers"
 
+BOOK_TEXT_PATH = "anatomy.txt"
+
+# Bump whenever a change to the segmentation would index the same book text differently
+SECTION_INDEX_VERSION = 1
+SECTION_INDEX_ARTIFACT = "section_index"
+# Only lines containing one of these can change the segmentation state or be left out of the sections
+SECTION_MARKERS = (INTRODUCTION, ANSWERS, QUESTIONS, BACK)
+# Bump whenever a change to parsing or pairing would produce different rows for the same chapter lines
+PARSER_VERSION = 1
+CHAPTER_ROWS_ARTIFACT = "chapter_rows"
+BOOK_MANIFEST_ARTIFACT = "book_manifest"
+# Parse workers only need the parsers, pdfplumber is left out unless the extraction pool started the fork server
+PARSE_WORKER_PRELOAD_MODULES = ["text_processing"]
+
+
+class LineJoiner:
+    """
+    Incrementally joins words split across lines by hyphenation, keeping track of the page on which each joined line
+    starts. Completed lines are returned as soon as the next line shows they do not continue.
+    """
+
+    def __init__(self):
+        self._previous_line = ""
+        self._previous_page_number = None
+
+    def feed(self, line, page_number=None):
+        """Add the next line, returning the (line, page_number) it completes, if any."""
+        line = line.strip()  # Clean any unnecessary whitespace
+        if self._previous_line.endswith('-'):  # If the previous line ends with a dash, join with the current line
+            self._previous_line = self._previous_line[:-1] + line  # Remove the dash and concatenate without spaces
+            return None
+        completed = (self._previous_line, self._previous_page_number) if self._previous_line else None
+        self._previous_line, self._previous_page_number = line, page_number
+        return completed
+
+    def finish(self):
+        """Return the final (line, page_number), if any."""
+        return (self._previous_line, self._previous_page_number) if self._previous_line else None
+
 
 def handle_line_breaks(lines):
     """
     Handle word continuation across lines due to hyphenation.
     Join lines where a word is split across two lines (indicated by a dash at the end of a line).
     """
+    joiner = LineJoiner()
     processed_lines = []
-    previous_line = ""
 
     for line in lines:
-        line = line.strip()  # Clean any unnecessary whitespace
-        if previous_line.endswith('-'):  # If the previous line ends with a dash, join with the current line
-            previous_line = previous_line[:-1] + line  # Remove the dash and concatenate without spaces
-        else:
-            if previous_line:
-                processed_lines.append(previous_line)
-            previous_line = line
+        completed = joiner.feed(line)
+        if completed is not None:
+            processed_lines.append(completed[0])
 
-    if previous_line:
-        processed_lines.append(previous_line)  # Add the final processed line
+    completed = joiner.finish()
+    if completed is not None:
+        processed_lines.append(completed[0])  # Add the final processed line
 
     return processed_lines
 
 
+class TransliterationTable(dict):
+    """
+    ASCII transliteration of code points, starting with the typography that recurs in extracted text. Other code
+    points are transliterated by unidecode the first time they are met and kept. unidecode transliterates every
+    character on its own, so replacing characters one by one from the table gives the same text.
+    """
+
+    def __missing__(self, code_point):
+        from unidecode import unidecode  # Only imported once text has a character the table doesn't know
+
+        replacement = self[code_point] = unidecode(chr(code_point))
+        return replacement
+
+
+# unidecode's transliteration of the non-ASCII characters that make up nearly all of those in extracted text
+TRANSLITERATION_TABLE = TransliterationTable({
+    ord(char): replacement for char, replacement in {
+        "\u00a0": " ",  # No-break space
+        "\u00ad": "",  # Soft hyphen
+        "\u00b0": "deg",
+        "\u00b1": "+-",
+        "\u00b7": "*",  # Middle dot
+        "\u00d7": "x",
+        "\u2010": "-",  # Hyphen
+        "\u2011": "-",  # Non-breaking hyphen
+        "\u2012": "-",  # Figure dash
+        "\u2013": "-",  # En dash
+        "\u2014": "--",  # Em dash
+        "\u2018": "'",
+        "\u2019": "'",
+        "\u201a": ",",
+        "\u201c": '"',
+        "\u201d": '"',
+        "\u201e": ",,",
+        "\u2022": "*",  # Bullet
+        "\u2026": "...",
+        "\u2032": "'",  # Prime
+        "\u2212": "-",  # Minus sign
+        "\ufb00": "ff",
+        "\ufb01": "fi",
+        "\ufb02": "fl",
+        "\ufb03": "ffi",
+        "\ufb04": "ffl",
+    }.items()
+})
+
+
+_NON_ASCII_CHAR_PATTERN = re.compile(r"[^\x00-\x7f]")
+
+
 def sanitize_text(text):
     """
     Sanitize text by converting any Unicode characters to ASCII equivalents.
     This will handle things like smart quotes, non-standard dashes, etc.
     """
-    return unidecode(text)
+    if text.isascii():  # Nearly every column of the book
+        return text
+    # Faster than str.translate, which looks up every character of the text rather than only the non-ASCII ones
+    return _NON_ASCII_CHAR_PATTERN.sub(lambda match: TRANSLITERATION_TABLE[ord(match.group())], text)
+
+
+# Kinds of tokens of a chapter's lines. Each kind matched by a pattern is also the name of the group spanning its lines
+ANSWER_START = "answer_start"  # "66 B. The answer..."
+QUESTION_START = "question_start"  # "66 A 23-year-old...", which includes answer starts, like the line-based parser
+OPTIONS = "options"  # A run of lines like "A. Option text"
+CONTINUATION = "continuation"  # A run of any other lines
+
+_WHITESPACE_IN_LINE = r"[^\S\n]"
+_OPTION_LINE_REGEX = rf"[A-Z]\.{_WHITESPACE_IN_LINE}+.+"
+OPTION_LINE_PATTERN = re.compile(rf"\n([A-Z])\.{_WHITESPACE_IN_LINE}+(.+)")
+_TOKEN_REGEXES = {
+    ANSWER_START: (
+        rf"(?P<answer_number>\d+){_WHITESPACE_IN_LINE}+"
+        rf"(?P<answer_letter>[A-Z])\.{_WHITESPACE_IN_LINE}+(?P<answer_text>.+)"
+    ),
+    QUESTION_START: rf"(?P<question_number>\d+){_WHITESPACE_IN_LINE}+(?P<question_text>.+)",
+    OPTIONS: rf"{_OPTION_LINE_REGEX}(?:\n{_OPTION_LINE_REGEX})*",
+}
+
+
+def _token_pattern(kinds):
+    """
+    Pattern matching whole stripped lines of one of `kinds`, tried in order, from the newline in front of them.
+    Starting with a newline lets the regex engine jump from line to line instead of trying every position.
+    """
+    alternatives = "|".join(f"(?P<{kind}>{_TOKEN_REGEXES[kind]})" for kind in kinds)
+    return re.compile(rf"\n(?:{alternatives})")
+
+
+QUESTION_TOKEN_PATTERN = _token_pattern([QUESTION_START, OPTIONS])
+ANSWER_TOKEN_PATTERN = _token_pattern([ANSWER_START])
+
+
+def _join_lines(lines: list[tuple[str, int]]) -> tuple[str, list[int], list[int]]:
+    """
+    Text of the stripped lines, each preceded by a newline, along with the page numbers of the runs of lines on the
+    same page and the offsets in the text at which these runs end.
+    """
+    page_texts, page_numbers, page_end_offsets = [], [], []
+    offset = 0
+    for page_number, page_lines in groupby(lines, key=itemgetter(1)):
+        page_text = "\n" + "\n".join(map(str.strip, map(itemgetter(0), page_lines)))
+        page_texts.append(page_text)
+        page_numbers.append(page_number)
+        offset += len(page_text)
+        page_end_offsets.append(offset)
+    return "".join(page_texts), page_numbers, page_end_offsets
+
+
+def tokenize_text(
+        text: str,
+        page_numbers: list[int],
+        page_end_offsets: list[int],
+        pattern: re.Pattern
+) -> Iterator[tuple[str, object, int]]:
+    """
+    Tokenize text made of stripped lines, each preceded by a newline, with a single `finditer` of `pattern`, yielding
+    (kind, value, page_number) tokens in line order, where page_number is that of the token's last line. The text up
+    to page_end_offsets[i] is on page page_numbers[i].
+    A start token's value is its match and an OPTIONS token's value is its list of (letter, text) pairs. Lines in
+    between are not looked at one by one: each run of them is a CONTINUATION token whose value is the lines joined
+    with spaces, the way the parsers join text lines anyway.
+    """
+    position = 0  # Start of the first line not tokenized yet
+    page_idx = 0  # Page of the last token, tokens only ever move forward
+
+    for match in pattern.finditer(text):
+        start, end = match.span()
+        if start > position:
+            while page_end_offsets[page_idx] < start:
+                page_idx += 1
+            yield CONTINUATION, text[position + 1:start].replace("\n", " "), page_numbers[page_idx]
+        while page_end_offsets[page_idx] < end:
+            page_idx += 1
+        kind = match.lastgroup
+        value = OPTION_LINE_PATTERN.findall(text, start, end) if kind == OPTIONS else match
+        yield kind, value, page_numbers[page_idx]
+        position = end
+
+    if position < len(text):
+        yield CONTINUATION, text[position + 1:].replace("\n", " "), page_numbers[-1]
+
+
+def tokenize_lines(lines: list[tuple[str, int]], pattern: re.Pattern) -> Iterator[tuple[str, object, int]]:
+    """Tokenize a chapter's (line, page_number) pairs, see tokenize_text."""
+    return tokenize_text(*_join_lines(lines), pattern)
 
 
 def parse_questions(lines: list[(str, int)], chapter: int) -> list[Question]:
+    return parse_question_tokens(tokenize_lines(lines, QUESTION_TOKEN_PATTERN), chapter)
+
+
+def parse_question_tokens(tokens: Iterable[tuple[str, object, int]], chapter: int) -> list[Question]:
     questions = []
     question_number = None
     question_text_lines = []
     options = {}
-    option_pattern = re.compile(r'^([A-Z])\.\s+(.+)')  # Regex to match options like "A. Option text"
-    question_pattern = re.compile(r'^(\d+)\s+(.+)')  # Regex to match the start of a question like "66 A 23-year-old..."
     last_question_num = 0  # Keep track of the last correct question number
     last_page_number = None
 
-    for line, page_number in lines:
-        line = line.strip()
-
+    for kind, token, page_number in tokens:
         # Check if line starts a new question
-        question_match = question_pattern.match(line)
-        if question_match:
-            cur_question_num = int(question_match.group(1))
+        if kind == QUESTION_START:
+            cur_question_num = int(token['question_number'])
 
             # Check if the question number is logically incorrect (like 1285 instead of 128)
             if cur_question_num > last_question_num + 1:
@@ -90,17 +280,16 @@ def parse_questions(lines: list[(str, int)], chapter: int) -> list[Question]:
             # Reset for new question
             question_number = cur_question_num
             last_question_num = question_number  # Update the last valid question number
-            question_text_lines = [question_match.group(2)]  # Start collecting text for this question
+            question_text_lines = [token['question_text']]  # Start collecting text for this question
             options = {}
             continue
 
         # If it's not a new question, check for options
-        option_match = option_pattern.match(line)
-        if option_match:
-            options[option_match.group(1)] = option_match.group(2)  # Add option key (A, B, etc.) and text
+        if kind == OPTIONS:
+            options.update(token)  # Add option keys (A, B, etc.) and texts
         else:
             # Continue collecting text for the current question
-            question_text_lines.append(line)
+            question_text_lines.append(token)
         last_page_number = page_number
 
     # Add the last question to the list
@@ -118,17 +307,20 @@ def parse_questions(lines: list[(str, int)], chapter: int) -> list[Question]:
 
 
 def parse_answers(lines: list[(str, int)], chapter: int) -> list[Answer]:
+    return parse_answer_tokens(tokenize_lines(lines, ANSWER_TOKEN_PATTERN), chapter)
+
+
+def parse_answer_tokens(tokens: Iterable[tuple[str, object, int]], chapter: int) -> list[Answer]:
     answers = []
     answer_letter = None
     answer_text_lines = []
-    answer_pattern = re.compile(r'^(\d+)\s+([A-Z])\.\s+(.+)')
     last_page_number = None
     last_answer_number = 0  # Keep track of the last correct answer number
 
     def handle_new_answer_start(new_answer_start):
         nonlocal last_answer_number, answer_letter, answer_text_lines, answer
 
-        current_answer_number = int(new_answer_start.group(1))
+        current_answer_number = int(new_answer_start['answer_number'])
         # Check if the answer number is logically incorrect
         if current_answer_number > last_answer_number + 1:
             log.warning(
@@ -149,22 +341,19 @@ def parse_answers(lines: list[(str, int)], chapter: int) -> list[Answer]:
 
         # Start new answer
         last_answer_number = current_answer_number  # Update the last valid answer number
-        answer_letter = new_answer_start.group(2)  # Capture the letter (e.g., B)
-        answer_text_lines = [new_answer_start.group(3)]  # Start collecting text for this answer
+        answer_letter = new_answer_start['answer_letter']  # Capture the letter (e.g., B)
+        answer_text_lines = [new_answer_start['answer_text']]  # Start collecting text for this answer
 
         return answer_letter, answer_text_lines
 
-    for line, page_number in lines:
-        line = line.strip()
-
+    for kind, token, page_number in tokens:
         # Check if line starts a new answer
-        found_new_answer_start = answer_pattern.match(line)
-        if found_new_answer_start:
-            answer_letter, answer_text_lines = handle_new_answer_start(found_new_answer_start)
+        if kind == ANSWER_START:
+            answer_letter, answer_text_lines = handle_new_answer_start(token)
             continue
 
         # Continue collecting text for the current answer
-        answer_text_lines.append(line)
+        answer_text_lines.append(token)
         last_page_number = page_number
 
     # Add the last answer to the list
@@ -180,112 +369,505 @@ def parse_answers(lines: list[(str, int)], chapter: int) -> list[Answer]:
     return answers
 
 
-def chapter_folder(chapter_number):
-    return f"{QUESTIONS_ANSWERS_FOLDER}/chapter_{chapter_number}"
+def page_lines(page_data: RawPageData) -> list[str]:
+    """Sanitized lines of a page, the left column followed by the right column."""
+    return f"{sanitize_text(page_data.left_col)}\n{sanitize_text(page_data.right_col)}\n".split("\n")
 
 
-def process_questions_and_answers(page_datas: [RawPageData]) -> list[OutputRow]:
+def build_book_data(page_datas: Iterable[RawPageData]) -> BookData:
     """
-    Process the extracted column data into questions and answers, while also including the page number
-    from which the question and answer were extracted.
+    Sanitized lines of the pages, with words split by hyphenation joined back. A joined line belongs to the page it
+    starts on.
     """
-
-    pages = BookData([], {})
+    book = BookData()
+    joiner = LineJoiner()
     for page_data in page_datas:
-        page_num, left_col, right_col = page_data.page_number, page_data.left_col, page_data.right_col
-        sanitized_lines = f"{sanitize_text(left_col)}\n{sanitize_text(right_col)}\n".split("\n")
-        page_start_idx = len(pages.lines)
-        for idx in range(len(sanitized_lines)):
-            pages.page_number_by_line_idx[page_start_idx + idx] = page_num
-        pages.lines.extend(sanitized_lines)
+        with RUN_METRICS.span(SANITIZATION_STAGE):
+            lines = page_lines(page_data)
+        for line in lines:
+            completed = joiner.feed(line, page_data.page_number)
+            if completed is not None:
+                book.append_line(*completed)
+    completed = joiner.finish()
+    if completed is not None:
+        book.append_line(*completed)
+    return book
+
+
+class ChapterSegmenter:
+    """
+    Incrementally splits the book's lines into chapters, each made of a questions and an answers section.
+    A chapter is complete once the QUESTIONS section of the next chapter starts after its ANSWERS section.
+    """
 
-    pages.lines = handle_line_breaks(pages.lines)
-    write_to_file("anatomy.txt", "\n".join(pages.lines))
+    def __init__(self):
+        self.chapter_number = 1  # Track chapters where the question numbers reset
+        self._is_answers_section = False
+        self._is_introduction = False
+        self._questions_lines = []
+        self._questions_so_far = []
+        self._answers_so_far = []
+
+    def feed(self, line, page_num):
+        """Add the next line of the book, returning the ChapterLines of the chapter it completes, if any."""
+        completed_chapter = None
+        if self._is_introduction and QUESTIONS not in line:
+            return None
+        if INTRODUCTION in line:
+            self._is_introduction = True
+            introduction_index = line.find(INTRODUCTION)
+            line = line[:introduction_index]
+        if ANSWERS in line:
+            self._questions_lines = self._questions_so_far
+            self._questions_so_far = []
+            self._is_answers_section = True
+            self._is_introduction = False  # Redundant because the first section after introduction is always questions
+        elif QUESTIONS in line:
+            if self._is_answers_section:
+                completed_chapter = ChapterLines(
+                    chapter=self.chapter_number,
+                    question_lines=self._questions_lines,
+                    answer_lines=self._answers_so_far
+                )
+                self._questions_lines = []
+                self._answers_so_far = []
+                self.chapter_number += 1
+            self._is_answers_section = False
+            self._is_introduction = False
 
-    chapter_number = 1  # Track chapters where the question numbers reset
-    is_answers_section = False
+        if line != BACK and line != QUESTIONS and line != MAIN_QUESTIONS and line != ANSWERS:
+            if self._is_answers_section:
+                self._answers_so_far.append((line, page_num))
+            else:
+                self._questions_so_far.append((line, page_num))
+        return completed_chapter
+
+    def finish(self) -> ChapterLines:
+        """Close the last chapter, whose answers run until the end of the book."""
+        return ChapterLines(
+            chapter=self.chapter_number,
+            question_lines=self._questions_lines,
+            answer_lines=self._answers_so_far
+        )
+
+
+def _section_marker_offsets(book_text: str) -> list[int]:
+    """
+    Offsets of all occurrences of the section markers in the text, in text order. One str.find scan per marker is
+    several times faster than a regex alternation, which has to try every position of the text.
+    """
+    offsets = []
+    for marker in SECTION_MARKERS:
+        offset = book_text.find(marker)
+        while offset != -1:
+            offsets.append(offset)
+            offset = book_text.find(marker, offset + 1)
+    return sorted(offsets)
 
-    questions_lines_by_chapter = {}
-    answers_lines_by_chapter = {}
-    questions_so_far = []
-    answers_so_far = []
-    is_introduction = False
 
-    for idx, line in enumerate(pages.lines):
+def build_section_index(book_text: str, line_count: int) -> SectionIndex:
+    """
+    Index the chapters and sections of the book's lines, joined by newlines, exactly as ChapterSegmenter would split
+    them. Lines with a marker are found by scanning the whole text for markers, only those go through the segmentation
+    rules one by one, while the runs of lines in between are added to the current section as whole ranges.
+    """
+    spans = []
+    truncated_lines = {}
+    chapter_number = 1
+    is_answers_section = False
+    is_introduction = False
+    # Line ranges of the current chapter, mirroring ChapterSegmenter's lists of lines
+    questions_ranges, questions_so_far_ranges, answers_so_far_ranges = [], [], []
+
+    def add_lines(start_line, end_line):
+        ranges = answers_so_far_ranges if is_answers_section else questions_so_far_ranges
+        if ranges and ranges[-1][1] == start_line:
+            ranges[-1] = (ranges[-1][0], end_line)
+        elif start_line < end_line:
+            ranges.append((start_line, end_line))
+
+    def close_chapter():
+        spans.extend((chapter_number, QUESTIONS, start, end) for start, end in questions_ranges)
+        spans.extend((chapter_number, ANSWERS, start, end) for start, end in answers_so_far_ranges)
+
+    next_line_idx, next_line_start = 0, 0  # First line not handled yet, and its offset in the text
+    for marker_offset in _section_marker_offsets(book_text):
+        if marker_offset < next_line_start:
+            continue  # Another marker of a line already handled
+        line_start = book_text.rfind("\n", 0, marker_offset) + 1
+        line_idx = next_line_idx + book_text.count("\n", next_line_start, line_start)
+        if not is_introduction:
+            add_lines(next_line_idx, line_idx)
+        line_end = book_text.find("\n", marker_offset)
+        line_end = len(book_text) if line_end == -1 else line_end
+        next_line_idx, next_line_start = line_idx + 1, line_end + 1
+
+        # The same rules as ChapterSegmenter.feed, for a line with a marker
+        line = book_text[line_start:line_end]
         if is_introduction and QUESTIONS not in line:
             continue
         if INTRODUCTION in line:
             is_introduction = True
-            introduction_index = line.find(INTRODUCTION)
-            line = line[:introduction_index]
+            line = line[:line.find(INTRODUCTION)]
         if ANSWERS in line:
-            questions_lines_by_chapter[chapter_number] = questions_so_far
-            questions_so_far = []
+            questions_ranges = questions_so_far_ranges
+            questions_so_far_ranges = []
             is_answers_section = True
-            is_introduction = False  # Redundant because the first section after introduction is always questions
+            is_introduction = False
         elif QUESTIONS in line:
             if is_answers_section:
-                answers_lines_by_chapter[chapter_number] = answers_so_far
-                answers_so_far = []
+                close_chapter()
+                questions_ranges, answers_so_far_ranges = [], []
                 chapter_number += 1
             is_answers_section = False
             is_introduction = False
 
-        page_num = pages.page_number_by_line_idx[idx]
-
         if line != BACK and line != QUESTIONS and line != MAIN_QUESTIONS and line != ANSWERS:
-            if is_answers_section:
-                answers_so_far.append((line, page_num))
-            else:
-                questions_so_far.append((line, page_num))
-
-    answers_lines_by_chapter[chapter_number] = answers_so_far
-
-    # Parse questions and answers for each chapter
-    parsed_question_by_chapter_by_number = {}
-    for chapter_number, lines_with_pages in questions_lines_by_chapter.items():
-        if not os.path.exists(chapter_folder(chapter_number)):
-            os.makedirs(chapter_folder(chapter_number))
-        for question in parse_questions(lines_with_pages, chapter_number):
-            write_to_file(
-                f"{chapter_folder(chapter_number)}/question_{question.question_number}.txt",
-                question.to_dict()
-            )
-            if chapter_number not in parsed_question_by_chapter_by_number:
-                parsed_question_by_chapter_by_number[chapter_number] = {}
-            parsed_question_by_chapter_by_number[chapter_number][question.question_number] = question
+            if len(line) < line_end - line_start:
+                truncated_lines[line_idx] = line
+            add_lines(line_idx, line_idx + 1)
+
+    if not is_introduction:
+        add_lines(next_line_idx, line_count)
+    close_chapter()
+    return SectionIndex(chapter_count=chapter_number, spans=spans, truncated_lines=truncated_lines)
+
+
+def _section_index_key(book_text):
+    return hashlib.sha256(f"{SECTION_INDEX_VERSION}\n{book_text}".encode()).hexdigest()
+
+
+def load_or_build_section_index(book_text: str, line_count: int, checkpoint_store: CheckpointStore) -> SectionIndex:
+    """Section index of the book text, cached by its content so an unchanged book is never segmented twice."""
+    key = _section_index_key(book_text)
+    cached = checkpoint_store.load_artifact(SECTION_INDEX_ARTIFACT, key)
+    if cached is not None:
+        return SectionIndex.from_dict(cached)
+    section_index = build_section_index(book_text, line_count)
+    checkpoint_store.save_artifact(SECTION_INDEX_ARTIFACT, key, section_index.to_dict())
+    return section_index
+
+
+def slice_chapters(section_index: SectionIndex, book: BookData) -> list[ChapterLines]:
+    """ChapterLines of every chapter in the index, sliced from the book's lines and pages."""
+    lines = list(book.lines)
+    for line_idx, line in section_index.truncated_lines.items():
+        lines[line_idx] = line
+    chapters = [
+        ChapterLines(chapter=chapter_number, question_lines=[], answer_lines=[])
+        for chapter_number in range(1, section_index.chapter_count + 1)
+    ]
+    for chapter_number, kind, start_line, end_line in section_index.spans:
+        chapter = chapters[chapter_number - 1]
+        section_lines = chapter.question_lines if kind == QUESTIONS else chapter.answer_lines
+        section_lines.extend(zip(lines[start_line:end_line], book.page_numbers_of_lines(start_line, end_line)))
+    return chapters
+
+
+def chapter_artifacts_path(chapter_number):
+    return f"{QUESTIONS_ANSWERS_FOLDER}/chapter_{chapter_number}.jsonl"
+
+
+def pair_chapter_rows(
+        chapter_number: int,
+        questions: list[Question],
+        answers: list[Answer],
+        artifact_writer: NullArtifactWriter
+) -> list[OutputRow]:
+    """Pair up the parsed questions and answers of a chapter into output rows."""
+    artifacts_path = chapter_artifacts_path(chapter_number)
+
+    parsed_question_by_number = {}
+    for question in questions:
+        artifact_writer.append(artifacts_path, {'type': 'question', **question.to_dict()})
+        parsed_question_by_number[question.question_number] = question
 
     output_rows = []
-    for chapter_number, lines_with_pages in answers_lines_by_chapter.items():
-        if not os.path.exists(chapter_folder(chapter_number)):
-            os.makedirs(chapter_folder(chapter_number))
-        for answer in parse_answers(lines_with_pages, chapter_number):
-            write_to_file(
-                f"{chapter_folder(chapter_number)}/answer_{answer.question_number}.txt",
-                answer.to_dict()
+    for answer in answers:
+        artifact_writer.append(artifacts_path, {'type': 'answer', **answer.to_dict()})
+        try:
+            question = parsed_question_by_number[answer.question_number]
+        except KeyError:
+            log.warning(
+                f"Answer found for question {answer.question_number} "
+                f"in chapter {chapter_number} page {answer.page_number} but question not found."
             )
-            try:
-                question = parsed_question_by_chapter_by_number[chapter_number][answer.question_number]
-            except KeyError:
-                log.warning(
-                    f"Answer found for question {answer.question_number} "
-                    f"in chapter {chapter_number} page {answer.page_number} but question not found."
-                )
-                continue
-            assert answer.question_number == question.question_number, "Number on answer doesn't match that on question"
-            output_rows.append(
-                OutputRow(
-                    chapter=chapter_number,
-                    page_number=answer.page_number,
-                    question_number=answer.question_number,
-                    question=question.text,
-                    question_options="\n".join(
-                        [" ".join([letter, option]) for letter, option in question.question_options.items()]
-                    ),
-                    answer_letter=answer.answer_letter,
-                    answer=answer.text
-                )
+            continue
+        assert answer.question_number == question.question_number, "Number on answer doesn't match that on question"
+        output_rows.append(
+            OutputRow(
+                chapter=chapter_number,
+                page_number=answer.page_number,
+                question_number=answer.question_number,
+                question=question.text,
+                question_options="\n".join(
+                    [" ".join([letter, option]) for letter, option in question.question_options.items()]
+                ),
+                answer_letter=answer.answer_letter,
+                answer=answer.text
+            )
+        )
+    return output_rows
+
+
+def parse_chapter(chapter: ChapterLines, artifact_writer: NullArtifactWriter) -> list[OutputRow]:
+    """Parse the questions and answers of a chapter and pair them up into output rows."""
+    questions = parse_questions(chapter.question_lines, chapter.chapter)
+    answers = parse_answers(chapter.answer_lines, chapter.chapter)
+    return pair_chapter_rows(chapter.chapter, questions, answers, artifact_writer)
+
+
+def _parse_joined_chapter(
+        chapter_number: int,
+        joined_question_lines: tuple[str, list[int], list[int]],
+        joined_answer_lines: tuple[str, list[int], list[int]],
+        collect_artifacts: bool
+) -> tuple[list[tuple], dict[str, str]]:
+    """
+    Runs in parse workers. Parses a chapter whose sections were joined by _join_lines and returns its rows as plain
+    tuples along with the text of its debug artifacts, since strings and tuples are much cheaper to send between
+    processes than lists of lines and dataclasses.
+    """
+    artifact_writer = ArtifactCollector() if collect_artifacts else NullArtifactWriter()
+    questions = parse_question_tokens(tokenize_text(*joined_question_lines, QUESTION_TOKEN_PATTERN), chapter_number)
+    answers = parse_answer_tokens(tokenize_text(*joined_answer_lines, ANSWER_TOKEN_PATTERN), chapter_number)
+    output_rows = pair_chapter_rows(chapter_number, questions, answers, artifact_writer)
+    row_values = [
+        (row.page_number, row.chapter, row.question_number, row.question, row.question_options, row.answer_letter,
+         row.answer)
+        for row in output_rows
+    ]
+    return row_values, artifact_writer.text_by_path() if collect_artifacts else {}
+
+
+def _chapter_line_count(chapter: ChapterLines):
+    return len(chapter.question_lines) + len(chapter.answer_lines)
+
+
+def parse_chapters_in_parallel(
+        chapters: list[ChapterLines],
+        max_workers: int,
+        artifact_writer: NullArtifactWriter
+) -> list[OutputRow]:
+    """
+    Parse chapters in a pool of worker processes. Chapters are independent since question numbers restart in every
+    chapter, so the largest ones are submitted first to keep every worker busy until the end. Rows and debug artifacts
+    are merged back in chapter order, the same as when parsing chapter by chapter.
+    """
+    worker_count = min(max_workers, len(chapters))
+    log.info(f"Parsing {len(chapters)} chapters with {worker_count} workers...")
+    with create_process_pool(worker_count, PARSE_WORKER_PRELOAD_MODULES) as executor:
+        submission_order = sorted(
+            range(len(chapters)), key=lambda chapter_idx: _chapter_line_count(chapters[chapter_idx]), reverse=True
+        )
+        future_by_chapter_idx = {
+            chapter_idx: executor.submit(
+                _parse_joined_chapter,
+                chapters[chapter_idx].chapter,
+                _join_lines(chapters[chapter_idx].question_lines),
+                _join_lines(chapters[chapter_idx].answer_lines),
+                artifact_writer.is_enabled
             )
+            for chapter_idx in submission_order
+        }
+        output_rows = []
+        for chapter_idx in range(len(chapters)):
+            row_values, artifact_text_by_path = future_by_chapter_idx[chapter_idx].result()
+            for path, artifact_text in artifact_text_by_path.items():
+                artifact_writer.append(path, artifact_text)
+            output_rows.extend(OutputRow(*values) for values in row_values)
+    return output_rows
+
+
+def _parse_chapters(chapters: list[ChapterLines], artifact_writer: NullArtifactWriter, parse_workers: int):
+    if parse_workers > 1 and len(chapters) > 1:
+        return parse_chapters_in_parallel(chapters, parse_workers, artifact_writer)
+    output_rows = []
+    for chapter in chapters:
+        output_rows.extend(parse_chapter(chapter, artifact_writer))
+    return output_rows
+
+
+def chapter_manifest_entry(chapter: ChapterLines) -> ChapterManifestEntry:
+    """Pages of the chapter and digest of its input, which determines its rows."""
+    digest = hashlib.sha256(f"{PARSER_VERSION}\n{chapter.chapter}\n".encode())
+    page_numbers = []
+    for section_lines in (chapter.question_lines, chapter.answer_lines):
+        section_page_numbers = list(map(itemgetter(1), section_lines))
+        digest.update(f"{len(section_lines)}\n".encode())
+        digest.update("\n".join(map(itemgetter(0), section_lines)).encode())
+        digest.update(",".join(map(str, section_page_numbers)).encode())
+        page_numbers.extend(section_page_numbers)
+    return ChapterManifestEntry(
+        chapter=chapter.chapter,
+        first_page=min(page_numbers, default=None),
+        last_page=max(page_numbers, default=None),
+        input_digest=digest.hexdigest()
+    )
+
+
+def _book_manifest_key(book_key):
+    return hashlib.sha256(book_key.encode()).hexdigest()
+
+
+def load_book_manifest(book_key, checkpoint_store: CheckpointStore) -> BookManifest | None:
+    """Manifest saved by the last incremental run on the book, if any."""
+    cached = checkpoint_store.load_artifact(BOOK_MANIFEST_ARTIFACT, _book_manifest_key(book_key))
+    return BookManifest.from_dict(cached) if cached is not None else None
+
+
+def _parse_changed_chapters(
+        chapters: list[ChapterLines],
+        manifest: BookManifest,
+        artifact_writer: NullArtifactWriter,
+        checkpoint_store: CheckpointStore,
+        parse_workers: int
+) -> list[OutputRow]:
+    """
+    Rows of every chapter, where those of chapters parsed before from the same input are loaded from the checkpoint
+    store and only the others are parsed. The debug artifacts of unchanged chapters are left as they were written.
+    """
+    rows_by_chapter = {}
+    for entry in manifest.chapters:
+        cached = checkpoint_store.load_artifact(CHAPTER_ROWS_ARTIFACT, entry.input_digest)
+        if cached is not None:
+            rows_by_chapter[entry.chapter] = [OutputRow.from_dict(row) for row in cached['rows']]
+
+    changed_chapters = [chapter for chapter in chapters if chapter.chapter not in rows_by_chapter]
+    log.info(f"Reusing the rows of {len(rows_by_chapter)} unchanged chapters, parsing {len(changed_chapters)}.")
+
+    changed_chapter_numbers = {chapter.chapter for chapter in changed_chapters}
+    for chapter_number in changed_chapter_numbers:
+        rows_by_chapter[chapter_number] = []
+    for row in _parse_chapters(changed_chapters, artifact_writer, parse_workers):
+        rows_by_chapter[row.chapter].append(row)
+    for entry in manifest.chapters:
+        if entry.chapter in changed_chapter_numbers:
+            rows = [row.to_dict() for row in rows_by_chapter[entry.chapter]]
+            checkpoint_store.save_artifact(CHAPTER_ROWS_ARTIFACT, entry.input_digest, {'rows': rows})
+    return [row for chapter in chapters for row in rows_by_chapter[chapter.chapter]]
+
+
+def process_questions_and_answers(
+        page_datas: [RawPageData],
+        artifact_writer: NullArtifactWriter = None,
+        checkpoint_store: CheckpointStore = None,
+        parse_workers: int = 1,
+        incremental_key: str = None
+) -> list[OutputRow]:
+    """
+    Process the extracted column data into questions and answers, while also including the page number
+    from which the question and answer were extracted. With more than one parse worker, chapters are parsed
+    in parallel worker processes.
+    With an incremental key, such as the path of the book, only the chapters whose lines, pages or parser changed
+    since the last run with the same key are parsed, the rows of the others come from the checkpoint store.
+    """
+    checkpoint_store = checkpoint_store or open_checkpoint_store()
+    with nullcontext(artifact_writer) if artifact_writer else open_artifact_writer() as artifact_writer:
+        return _process_questions_and_answers(
+            page_datas, artifact_writer, checkpoint_store, parse_workers, incremental_key
+        )
+
+
+def _process_questions_and_answers(
+        page_datas: [RawPageData],
+        artifact_writer: NullArtifactWriter,
+        checkpoint_store: CheckpointStore,
+        parse_workers: int,
+        incremental_key: str | None
+) -> list[OutputRow]:
+
+    book = build_book_data(page_datas)
+    with RUN_METRICS.span(SEGMENTATION_STAGE):
+        book_text = "\n".join(book.lines)
+        section_index = load_or_build_section_index(book_text, len(book.lines), checkpoint_store)
+        chapters = slice_chapters(section_index, book)
+
+    if incremental_key is None:
+        artifact_writer.append(BOOK_TEXT_PATH, book_text)
+        with RUN_METRICS.span(PARSING_STAGE):
+            output_rows = _parse_chapters(chapters, artifact_writer, parse_workers)
+    else:
+        previous_manifest = load_book_manifest(incremental_key, checkpoint_store)
+        manifest = BookManifest(
+            book_text_digest=hashlib.sha256(book_text.encode()).hexdigest(),
+            chapters=[chapter_manifest_entry(chapter) for chapter in chapters]
+        )
+        if previous_manifest is None or previous_manifest.book_text_digest != manifest.book_text_digest:
+            artifact_writer.append(BOOK_TEXT_PATH, book_text)
+        if previous_manifest is not None:
+            previous_digests = {entry.input_digest for entry in previous_manifest.chapters}
+            for entry in manifest.chapters:
+                if entry.input_digest not in previous_digests:
+                    log.info(f"Chapter {entry.chapter} (pages {entry.first_page}-{entry.last_page}) changed.")
+        with RUN_METRICS.span(PARSING_STAGE):
+            output_rows = _parse_changed_chapters(
+                chapters, manifest, artifact_writer, checkpoint_store, parse_workers
+            )
+        checkpoint_store.save_artifact(BOOK_MANIFEST_ARTIFACT, _book_manifest_key(incremental_key), manifest.to_dict())
 
     log.info(f"Processed {len(output_rows)} question-answer pairs.")
     return output_rows
+
+
+class StreamingBookProcessor:
+    """
+    Streaming counterpart of process_questions_and_answers. Pages are fed in page order and each chapter is parsed
+    as soon as its ANSWERS section closes, so only the current chapter's lines are held in memory.
+    """
+
+    def __init__(self, artifact_writer: NullArtifactWriter):
+        self._artifact_writer = artifact_writer
+        self._joiner = LineJoiner()
+        self._segmenter = ChapterSegmenter()
+        self._has_written_line = False
+        self.rows_emitted = 0
+
+    def _add_line(self, line, page_num) -> list[OutputRow]:
+        self._artifact_writer.append(BOOK_TEXT_PATH, f"\n{line}" if self._has_written_line else line)
+        self._has_written_line = True
+        completed_chapter = self._segmenter.feed(line, page_num)
+        if completed_chapter is None:
+            return []
+        with RUN_METRICS.span(PARSING_STAGE):
+            output_rows = parse_chapter(completed_chapter, self._artifact_writer)
+        self.rows_emitted += len(output_rows)
+        return output_rows
+
+    def feed_page(self, page_data: RawPageData) -> list[OutputRow]:
+        """Add the next page, returning the rows of any chapter it completes."""
+        output_rows = []
+        with RUN_METRICS.span(SANITIZATION_STAGE):
+            lines = page_lines(page_data)
+        for line in lines:
+            completed = self._joiner.feed(line, page_data.page_number)
+            if completed is not None:
+                output_rows.extend(self._add_line(*completed))
+        return output_rows
+
+    def finish(self) -> list[OutputRow]:
+        """Flush the last line and return the rows of the final chapter."""
+        output_rows = []
+        completed = self._joiner.finish()
+        if completed is not None:
+            output_rows.extend(self._add_line(*completed))
+        with RUN_METRICS.span(PARSING_STAGE):
+            last_chapter_rows = parse_chapter(self._segmenter.finish(), self._artifact_writer)
+        self.rows_emitted += len(last_chapter_rows)
+        output_rows.extend(last_chapter_rows)
+        log.info(f"Processed {self.rows_emitted} question-answer pairs.")
+        return output_rows
+
+
+def stream_questions_and_answers(
+        page_datas: Iterable[RawPageData],
+        artifact_writer: NullArtifactWriter = None
+) -> Iterator[list[OutputRow]]:
+    """Yield the output rows of each chapter as soon as it is complete, consuming pages in page order."""
+    with nullcontext(artifact_writer) if artifact_writer else open_artifact_writer() as artifact_writer:
+        processor = StreamingBookProcessor(artifact_writer)
+        for page_data in page_datas:
+            output_rows = processor.feed_page(page_data)
+            if output_rows:
+                yield output_rows
+        yield processor.finish()
@@ -0,0 +1,125 @@
+import logging as log
+import math
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import logging_setup
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+# cgroup v1 reports no memory limit as a huge number rather than "max"
+_UNLIMITED_CGROUP_V1_BYTES = 2 ** 60
+
+
+def _init_pool_worker(log_queue, log_level, initializer):
+    logging_setup.setup_worker_logging(log_queue, log_level)
+    if initializer is not None:
+        initializer()
+
+
+def create_process_pool(
+        max_workers,
+        preload_modules: list[str],
+        initializer=None,
+        max_tasks_per_child: int = None
+) -> ProcessPoolExecutor:
+    """
+    Process pool whose workers are forked from a fork server that has already imported `preload_modules`, so workers
+    start warm. The fork server is shared by every pool of the process and only imports the modules of the first one.
+    Platforms without fork servers spawn fresh workers, which import what they need in the initializer.
+    Workers log through a queue to this process, at the level of this process's root logger.
+    With `max_tasks_per_child`, each worker is replaced by a fresh one after that many tasks, returning whatever
+    memory it accumulated to the OS.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context("forkserver")
+        mp_context.set_forkserver_preload(preload_modules)
+    else:
+        mp_context = multiprocessing.get_context("spawn")
+    # Only pass max_tasks_per_child when it is set, Python 3.10 doesn't know about it
+    recycling_kwargs = {"max_tasks_per_child": max_tasks_per_child} if max_tasks_per_child else {}
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=mp_context,
+        initializer=_init_pool_worker,
+        initargs=(logging_setup.worker_log_queue(mp_context), log.getLogger().level, initializer),
+        **recycling_kwargs
+    )
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MiB, or its peak so far where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        import resource
+
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, KiB everywhere else
+        return peak_rss / 2 ** 20 if sys.platform == "darwin" else peak_rss / 2 ** 10
+
+
+def _read_cgroup_file(*path_parts) -> str | None:
+    try:
+        with open(os.path.join(CGROUP_ROOT, *path_parts)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_cpu_limit() -> float | None:
+    """CPUs the cgroup of this process may use, from its CFS quota, or None without a quota."""
+    cpu_max = _read_cgroup_file("cpu.max")  # cgroup v2: "<quota> <period>", the quota being "max" without a limit
+    if cpu_max is not None:
+        quota, period = cpu_max.split()
+        return None if quota == "max" else int(quota) / int(period)
+    quota = _read_cgroup_file("cpu", "cpu.cfs_quota_us")  # cgroup v1: -1 without a limit
+    period = _read_cgroup_file("cpu", "cpu.cfs_period_us")
+    if quota is None or period is None or int(quota) <= 0:
+        return None
+    return int(quota) / int(period)
+
+
+def available_cpus() -> int:
+    """CPUs this process may actually run on: its CPU affinity, capped by the CPU quota of its cgroup."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS and Windows
+        cpus = os.cpu_count() or 1
+    cpu_limit = _cgroup_cpu_limit()
+    if cpu_limit is not None:
+        cpus = min(cpus, math.floor(cpu_limit))
+    return max(cpus, 1)
+
+
+def _cgroup_available_memory_mb() -> float | None:
+    """Memory left below the memory limit of the cgroup of this process in MiB, or None without a limit."""
+    limit = _read_cgroup_file("memory.max")  # cgroup v2
+    usage = _read_cgroup_file("memory.current")
+    if limit is None:
+        limit = _read_cgroup_file("memory", "memory.limit_in_bytes")  # cgroup v1
+        usage = _read_cgroup_file("memory", "memory.usage_in_bytes")
+    if limit is None or usage is None or limit == "max" or int(limit) >= _UNLIMITED_CGROUP_V1_BYTES:
+        return None
+    return max(int(limit) - int(usage), 0) / 2 ** 20
+
+
+def available_memory_mb() -> float | None:
+    """
+    Memory that new processes can take without swapping in MiB, the lower of the system's available memory and what is
+    left below the cgroup's limit. None where neither can be read.
+    """
+    system_available_mb = None
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    system_available_mb = int(line.split()[1]) / 2 ** 10  # Reported in KiB
+                    break
+    except OSError:
+        pass
+    cgroup_available_mb = _cgroup_available_memory_mb()
+    known_mb = [mb for mb in (system_available_mb, cgroup_available_mb) if mb is not None]
+    return min(known_mb) if known_mb else None